@@ -12,6 +12,8 @@ REGION_LOCAL = 'local'
 # dev environment
 ENV_DEV = 'dev'
 
+# port of the management API of the local infrastructure (e.g., to reset its state)
+DEFAULT_PORT_INFRA = 4566
 # infra service ports
 DEFAULT_PORT_APIGATEWAY = 4567
 DEFAULT_PORT_KINESIS = 4568
@@ -25,6 +27,12 @@ DEFAULT_PORT_LAMBDA = 4574
 DEFAULT_PORT_APIGATEWAY_BACKEND = 4575
 DEFAULT_PORT_KINESIS_BACKEND = 4576
 DEFAULT_PORT_DYNAMODB_BACKEND = 4577
+# backend service ports (for services that are only put behind a proxy if started lazily)
+DEFAULT_PORT_DYNAMODBSTREAMS_BACKEND = 4578
+DEFAULT_PORT_ELASTICSEARCH_BACKEND = 4579
+DEFAULT_PORT_S3_BACKEND = 4580
+DEFAULT_PORT_FIREHOSE_BACKEND = 4581
+DEFAULT_PORT_LAMBDA_BACKEND = 4582
 
 # default mock service endpoints
 LOCALHOST = 'localhost'
@@ -36,6 +44,7 @@ TEST_ELASTICSEARCH_URL = 'http://%s:%s' % (LOCALHOST, DEFAULT_PORT_ELASTICSEARCH
 TEST_DYNAMODBSTREAMS_URL = 'http://%s:%s' % (LOCALHOST, DEFAULT_PORT_DYNAMODBSTREAMS)
 TEST_S3_URL = 'http://%s:%s' % (LOCALHOST, DEFAULT_PORT_S3)
 TEST_APIGATEWAY_URL = 'http://%s:%s' % (LOCALHOST, DEFAULT_PORT_APIGATEWAY)
+TEST_INFRA_URL = 'http://%s:%s' % (LOCALHOST, DEFAULT_PORT_INFRA)
 
 # AWS user account ID used for tests
 TEST_AWS_ACCOUNT_ID = '123456789'
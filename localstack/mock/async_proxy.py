@@ -0,0 +1,585 @@
+import asyncore
+import asynchat
+import socket
+import os
+import sys
+import fcntl
+import time
+import collections
+import traceback
+import logging
+import requests
+from multiprocessing.dummy import Pool
+from requests.structures import CaseInsensitiveDict
+from localstack.mock import generic_proxy
+from localstack.mock.generic_proxy import HOP_BY_HOP_HEADERS, CLIENT_KEEPALIVE_TIMEOUT, build_response
+from localstack.mock.generic_proxy import request_body, apply_response_hooks, status_reason
+
+# interval (secs) at which the event loop wakes up to close idle connections and expire backend requests
+LOOP_TIMEOUT = 1.0
+# backlog of the listening socket
+LISTEN_BACKLOG = 128
+
+# set up logger
+LOGGER = logging.getLogger(__name__)
+
+
+class ProxyRequest(object):
+    def __init__(self, method, path, version, headers):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = None
+
+    def keep_alive(self):
+        connection = (self.headers.get('Connection') or '').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+
+def parse_headers(lines):
+    headers = CaseInsensitiveDict()
+    for line in lines:
+        if not line.strip():
+            continue
+        name, _, value = line.partition(':')
+        name = name.strip()
+        value = value.strip()
+        headers[name] = '%s, %s' % (headers[name], value) if name in headers else value
+    return headers
+
+
+def header_lines(data):
+    return [line.rstrip('\r') for line in data.split('\n')]
+
+
+class LoopTrigger(asyncore.file_dispatcher):
+    """Wakes up the event loop to run callbacks scheduled from other threads."""
+
+    def __init__(self, map):
+        read_fd, self.write_fd = os.pipe()
+        flags = fcntl.fcntl(self.write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, read_fd, map=map)
+        self.callbacks = collections.deque()
+
+    def call_soon(self, func, *args):
+        """Schedule func(*args) to be run on the event loop thread - safe to call from any thread."""
+        self.callbacks.append((func, args))
+        try:
+            os.write(self.write_fd, 'x')
+        except OSError, e:
+            pass  # pipe is full (the loop is woken up anyway), or the loop has shut down
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(8192)
+        while self.callbacks:
+            func, args = self.callbacks.popleft()
+            try:
+                func(*args)
+            except Exception, e:
+                LOGGER.error('Error running event loop callback: %s' % traceback.format_exc(e))
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self.write_fd)
+
+
+class ClientChannel(asynchat.async_chat):
+    """Connection from a client. Parses (pipelined) HTTP/1.x requests and answers them in order."""
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.incoming = []
+        self.request = None
+        self.state = None
+        self.pending = collections.deque()
+        self.busy = False
+        self.closed = False
+        self.closing = False
+        self.last_activity = time.time()
+        self.read_head()
+
+    def read_head(self):
+        self.state = 'head'
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        self.last_activity = time.time()
+        self.incoming.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self.incoming)
+        self.incoming = []
+        if self.state == 'head':
+            lines = header_lines(data.lstrip('\r\n'))
+            parts = lines[0].split()
+            if len(parts) != 3:
+                self.handle_close()
+                return
+            method, path, version = parts
+            self.request = ProxyRequest(method, path, version, parse_headers(lines[1:]))
+            length = self.request.headers.get('Content-Length')
+            if 'chunked' in (self.request.headers.get('Transfer-Encoding') or '').lower():
+                self.request.body = []
+                self.state = 'chunk_size'
+                self.set_terminator('\r\n')
+            elif length and int(length) > 0:
+                self.state = 'body'
+                self.set_terminator(int(length))
+            else:
+                self.request_complete()
+        elif self.state == 'body':
+            self.request.body = data
+            self.request_complete()
+        elif self.state == 'chunk_size':
+            size = int(data.split(';', 1)[0].strip(), 16)
+            if size == 0:
+                self.state = 'trailer'
+                self.set_terminator('\r\n')
+            else:
+                self.state = 'chunk_data'
+                self.set_terminator(size + 2)
+        elif self.state == 'chunk_data':
+            self.request.body.append(data[:-2])
+            self.state = 'chunk_size'
+            self.set_terminator('\r\n')
+        elif self.state == 'trailer':
+            if not data:
+                self.request.body = ''.join(self.request.body)
+                self.request_complete()
+
+    def request_complete(self):
+        self.pending.append(self.request)
+        self.request = None
+        self.read_head()
+        self.process_next()
+
+    def process_next(self):
+        if self.busy or self.closing or not self.pending:
+            return
+        self.busy = True
+        self.server.handle_request(self, self.pending.popleft())
+
+    def send_response(self, request, status, reason, headers, body):
+        if self.closed:
+            return
+        keep_alive = request.keep_alive()
+        skip = list(HOP_BY_HOP_HEADERS)
+        if request.method == 'HEAD':
+            body = ''
+        else:
+            skip.append('content-length')
+        lines = ['HTTP/1.1 %s %s' % (status, reason)]
+        for name, value in headers:
+            if name.lower() not in skip:
+                lines.append('%s: %s' % (name, value))
+        if request.method != 'HEAD':
+            lines.append('Content-Length: %s' % len(body))
+        if not keep_alive:
+            lines.append('Connection: close')
+        elif request.version == 'HTTP/1.0':
+            lines.append('Connection: keep-alive')
+        self.push('%s\r\n\r\n%s' % ('\r\n'.join(lines), body))
+        self.last_activity = time.time()
+        self.busy = False
+        if keep_alive:
+            self.process_next()
+        else:
+            self.closing = True
+            self.close_when_done()
+
+    def is_idle(self, now):
+        return not self.busy and not self.pending and now - self.last_activity > CLIENT_KEEPALIVE_TIMEOUT
+
+    def handle_error(self):
+        if not generic_proxy.QUIET:
+            LOGGER.error('Error on client connection: %s' % traceback.format_exc())
+        self.close()
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        self.closed = True
+        asynchat.async_chat.close(self)
+
+
+class BackendChannel(asynchat.async_chat):
+    """Keep-alive connection to the backend, which sends one request at a time and parses the response."""
+
+    def __init__(self, server):
+        asynchat.async_chat.__init__(self, map=server.map)
+        self.server = server
+        self.callback = None
+        self.state = None
+        self.closed = False
+        self.received_any = False
+        # time by which the response to the current request must be complete (None to wait indefinitely)
+        self.deadline = None
+        self.incoming = []
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connect(server.backend_address)
+
+    def send_request(self, method, path, headers, body, callback):
+        self.callback = callback
+        self.method = method
+        self.received_any = False
+        timeout = self.server.pool.timeout
+        self.deadline = time.time() + timeout if timeout else None
+        self.incoming = []
+        self.state = 'head'
+        self.set_terminator('\r\n\r\n')
+        lines = ['%s %s HTTP/1.1' % (method, path)] + ['%s: %s' % header for header in headers]
+        self.push('%s\r\n\r\n%s' % ('\r\n'.join(lines), body))
+
+    def collect_incoming_data(self, data):
+        self.received_any = True
+        self.incoming.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self.incoming)
+        self.incoming = []
+        if self.state == 'head':
+            lines = header_lines(data)
+            parts = lines[0].split(' ', 2)
+            self.status = int(parts[1])
+            self.reason = parts[2] if len(parts) > 2 else ''
+            if self.status == 100:
+                return
+            headers = parse_headers(lines[1:])
+            self.response_headers = headers.items()
+            self.body_parts = []
+            connection = (headers.get('Connection') or '').lower()
+            self.keep_alive = connection == 'keep-alive' if parts[0] == 'HTTP/1.0' else connection != 'close'
+            length = headers.get('Content-Length')
+            if self.method == 'HEAD' or self.status < 200 or self.status in [204, 304]:
+                self.complete()
+            elif 'chunked' in (headers.get('Transfer-Encoding') or '').lower():
+                self.state = 'chunk_size'
+                self.set_terminator('\r\n')
+            elif length is not None:
+                if int(length) > 0:
+                    self.state = 'body'
+                    self.set_terminator(int(length))
+                else:
+                    self.complete()
+            else:
+                # body is delimited by the backend closing the connection
+                self.state = 'until_close'
+                self.keep_alive = False
+                self.set_terminator(None)
+        elif self.state == 'body':
+            self.body_parts.append(data)
+            self.complete()
+        elif self.state == 'chunk_size':
+            size = int(data.split(';', 1)[0].strip(), 16)
+            if size == 0:
+                self.state = 'trailer'
+                self.set_terminator('\r\n')
+            else:
+                self.state = 'chunk_data'
+                self.set_terminator(size + 2)
+        elif self.state == 'chunk_data':
+            self.body_parts.append(data[:-2])
+            self.state = 'chunk_size'
+            self.set_terminator('\r\n')
+        elif self.state == 'trailer':
+            if not data:
+                self.complete()
+        else:
+            # unexpected data on an idle connection
+            self.close()
+
+    def complete(self):
+        callback = self.callback
+        self.callback = None
+        self.state = None
+        self.deadline = None
+        response = (self.status, self.reason, self.response_headers, ''.join(self.body_parts))
+        self.server.pool.release(self, self.keep_alive)
+        callback(response, None)
+
+    def fail(self, error):
+        callback = self.callback
+        self.callback = None
+        self.deadline = None
+        self.close()
+        if callback:
+            callback(None, error)
+
+    def expire(self, now):
+        """Fail the current request if the backend has not responded in time."""
+        if self.callback and self.deadline and now > self.deadline:
+            self.fail(socket.timeout('timed out'))
+
+    def handle_connect(self):
+        pass
+
+    def handle_error(self):
+        self.fail(sys.exc_info()[1])
+
+    def handle_close(self):
+        if self.state == 'until_close':
+            self.body_parts.append(''.join(self.incoming))
+            self.complete()
+            return
+        self.fail(socket.error('Backend closed the connection'))
+
+    def close(self):
+        self.closed = True
+        asynchat.async_chat.close(self)
+
+
+class AsyncBackendPool(object):
+    """Pool of idle keep-alive backend connections - must only be used from the event loop thread.
+    Requests whose response takes longer than `timeout` secs are failed (checked every LOOP_TIMEOUT secs)."""
+
+    def __init__(self, server, size, idle_timeout, timeout=None):
+        self.server = server
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = []
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def acquire(self):
+        now = time.time()
+        while self.idle:
+            channel, last_used = self.idle.pop()
+            if not channel.closed and now - last_used <= self.idle_timeout:
+                self.hits += 1
+                return channel, True
+            self.expired += 1
+            channel.close()
+        self.misses += 1
+        return BackendChannel(self.server), False
+
+    def release(self, channel, keep_alive=True):
+        if keep_alive and not channel.closed and len(self.idle) < self.size:
+            self.idle.append((channel, time.time()))
+        else:
+            channel.close()
+
+    def request(self, method, path, headers, body, callback):
+        channel, reused = self.acquire()
+
+        def done(response, error):
+            if error is not None and reused and not channel.received_any and not isinstance(error, socket.timeout):
+                # the backend has closed the idle keep-alive connection - retry once on a fresh connection
+                BackendChannel(self.server).send_request(method, path, headers, body, callback)
+                return
+            callback(response, error)
+
+        channel.send_request(method, path, headers, body, done)
+
+    def expire(self, now):
+        while self.idle and (self.idle[0][0].closed or now - self.idle[0][1] > self.idle_timeout):
+            self.expired += 1
+            self.idle.pop(0)[0].close()
+
+    def close(self):
+        for channel, last_used in self.idle:
+            channel.close()
+        self.idle = []
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': len(self.idle),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired
+        }
+
+
+class AsyncProxyServer(asyncore.dispatcher):
+    """Single-threaded, non-blocking proxy engine. Client and backend connections are multiplexed
+    on one asyncore event loop, while the (blocking) update listener runs in a bounded worker pool.
+    Responses are buffered in memory, as the loop never blocks on a slow client or backend."""
+
+    def __init__(self, address, proxy):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.proxy = proxy
+        host, port = proxy.forward_host.rsplit(':', 1)
+        self.backend_address = (host, int(port))
+        self.pool = AsyncBackendPool(self, size=proxy.pool.size, idle_timeout=proxy.pool.idle_timeout,
+            timeout=proxy.pool.timeout)
+        self.trigger = LoopTrigger(self.map)
+        self.executor = Pool(proxy.listener_workers)
+        # enqueues the listener invocations in the order of the responses (the queue may block if full)
+        self.notifier = Pool(1)
+        self.running = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(LISTEN_BACKLOG)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        sock, addr = pair
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        ClientChannel(sock, self)
+
+    def serve_forever(self):
+        self.running = True
+        last_check = time.time()
+        while self.running:
+            asyncore.loop(timeout=LOOP_TIMEOUT, map=self.map, count=1)
+            now = time.time()
+            if now - last_check >= LOOP_TIMEOUT:
+                last_check = now
+                self.close_idle(now)
+        self.executor.close()
+        self.notifier.close()
+
+    def close_idle(self, now):
+        for channel in self.map.values():
+            if isinstance(channel, ClientChannel) and channel.is_idle(now):
+                channel.close()
+            elif isinstance(channel, BackendChannel):
+                channel.expire(now)
+        self.pool.expire(now)
+        if self.proxy.admission:
+            self.proxy.admission.expire(now)
+
+    def server_close(self):
+        self.trigger.call_soon(self.shutdown)
+
+    def shutdown(self):
+        self.running = False
+        self.pool.close()
+        for channel in self.map.values():
+            if channel is not self.trigger:
+                channel.close()
+
+    def submit(self, func, callback):
+        """Run func() in the worker pool, and pass (result, error) to callback on the event loop thread."""
+        def run():
+            try:
+                result = (func(), None)
+            except Exception, e:
+                result = (None, e)
+            self.trigger.call_soon(callback, *result)
+        self.executor.apply_async(run)
+
+    def handle_request(self, channel, request):
+        proxy = self.proxy
+        path = request.path
+        if '://' in path:
+            path = '/' + path.split('://', 1)[1].split('/', 1)[1]
+        if not proxy.backend_started:
+            # the backend is started lazily - wait for it outside of the event loop
+            def started(result, error):
+                if error is not None:
+                    return self.fail(channel, request, error)
+                self.handle_request(channel, request)
+
+            self.submit(proxy.ensure_backend, started)
+            return
+        if not proxy.needs_body(request.method, path, request.headers):
+            self.forward(channel, request, path)
+            return
+
+        def decide():
+            data = proxy.parse_data(request.method, request.body)
+            return data, proxy.forward_info(request.method, path, data, request.headers)
+
+        def decided(result, error):
+            if error is not None:
+                return self.fail(channel, request, error)
+            data, do_forward = result
+            modified = None
+            if isinstance(do_forward, requests.models.Request):
+                # the listener has modified the request, and may post-process the response via hooks
+                modified, do_forward = do_forward, True
+                request.body = request_body(modified)
+            if isinstance(do_forward, requests.models.Response):
+                # the listener has handled the request itself
+                channel.send_response(request, do_forward.status_code, do_forward.reason,
+                    do_forward.headers.items(), do_forward.content)
+                return
+            if do_forward is not True:
+                code = do_forward if isinstance(do_forward, int) else 503
+                channel.send_response(request, code, status_reason(code), [], '')
+                return
+            self.forward(channel, request, path, data=data, notify=True, modified=modified)
+
+        self.submit(decide, decided)
+
+    def forward(self, channel, request, path, data=None, notify=False, modified=None):
+        proxy = self.proxy
+        skip = HOP_BY_HOP_HEADERS + ['content-length', 'accept-encoding']
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in skip]
+        # local backends gain nothing from compression, and listeners expect a plain body
+        headers.append(('Accept-Encoding', 'identity'))
+        if 'Host' not in request.headers:
+            headers.append(('Host', proxy.forward_host))
+        body = request.body or ''
+        if body or request.method in ['POST', 'PUT', 'PATCH']:
+            headers.append(('Content-Length', str(len(body))))
+
+        admission = proxy.admission
+
+        def received(response, error):
+            if admission:
+                admission.release()
+            if error is not None:
+                return self.fail(channel, request, error)
+            status, reason, response_headers, content = response
+            if notify:
+                url = 'http://%s%s' % (proxy.forward_host, path)
+                response = build_response(status, reason, response_headers, content, url=url)
+            if modified:
+                response_out = apply_response_hooks(modified, response)
+                status, reason, content = response_out.status_code, response_out.reason, response_out.content
+                response_headers = response_out.headers.items()
+            if notify:
+                self.notifier.apply_async(self.notify, (request.method, path, data, request.headers, response))
+            channel.send_response(request, status, reason, response_headers, content)
+
+        def admitted():
+            self.pool.request(request.method, path, headers, body, received)
+
+        def rejected():
+            status, response_headers, content = proxy.rejection_response()
+            channel.send_response(request, status, status_reason(status), response_headers, content)
+
+        if not admission:
+            return admitted()
+        # admission callbacks may be invoked from other threads, hence route them through the event loop
+        result = admission.try_acquire(admit=lambda: self.trigger.call_soon(admitted),
+            reject=lambda: self.trigger.call_soon(rejected))
+        if result is True:
+            admitted()
+        elif result is False:
+            rejected()
+
+    def notify(self, method, path, data, headers, response):
+        try:
+            self.proxy.notify_listener(method, path, data, headers, response)
+        except Exception, e:
+            if not generic_proxy.QUIET:
+                LOGGER.error('Error queueing update listener invocation: %s' % traceback.format_exc(e))
+
+    def fail(self, channel, request, error):
+        if not generic_proxy.QUIET:
+            LOGGER.error('Error forwarding request %s %s: %s' % (request.method, request.path, error))
+        request.headers['Connection'] = 'close'
+        status = 504 if isinstance(error, socket.timeout) else 502
+        channel.send_response(request, status, status_reason(status), [], '')
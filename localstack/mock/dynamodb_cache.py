@@ -0,0 +1,142 @@
+import json
+import threading
+import collections
+
+# default max. size (approximate, in bytes of JSON) of the items held in the cache
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# marker returned for items which are not in the cache (None denotes an item known to not exist)
+MISSING = object()
+
+
+class ShadowItemCache(object):
+    """Memory-bounded LRU cache of the latest image of DynamoDB items, by (table name, key). The
+    cache is maintained from the write requests passing the proxy, and supplies the old images of
+    items for the stream records without reading them from the backend."""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        # maps (table name, key) to a tuple (item, size); item is None for deleted items
+        self.items = collections.OrderedDict()
+        self.size = 0
+        self.mutex = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def cache_key(table_name, keys):
+        return (table_name, json.dumps(keys, sort_keys=True))
+
+    def get(self, table_name, keys):
+        """Return the latest image of the given item, None if it is known to not exist, or MISSING."""
+        return self.lookup(table_name, keys, count=True)
+
+    def peek(self, table_name, keys):
+        """Same as get(..), but without counting the lookup in the hit/miss statistics."""
+        return self.lookup(table_name, keys, count=False)
+
+    def lookup(self, table_name, keys, count=True):
+        cache_key = self.cache_key(table_name, keys)
+        with self.mutex:
+            entry = self.items.pop(cache_key, None)
+            if entry is None:
+                self.misses += count
+                return MISSING
+            # re-insert, to mark the entry as most recently used
+            self.items[cache_key] = entry
+            self.hits += count
+            return entry[0]
+
+    def put(self, table_name, keys, item):
+        """Store the latest image of the given item (None if the item has been deleted)."""
+        cache_key = self.cache_key(table_name, keys)
+        size = len(cache_key[1]) + (len(json.dumps(item)) if item else 0)
+        with self.mutex:
+            old = self.items.pop(cache_key, None)
+            if old:
+                self.size -= old[1]
+            self.items[cache_key] = (item, size)
+            self.size += size
+            while self.size > self.max_size and self.items:
+                evicted_key, evicted = self.items.popitem(last=False)
+                self.size -= evicted[1]
+                self.evictions += 1
+
+    def remove(self, table_name, keys):
+        """Forget the given item, e.g., if its latest image is unknown."""
+        with self.mutex:
+            entry = self.items.pop(self.cache_key(table_name, keys), None)
+            if entry:
+                self.size -= entry[1]
+
+    def clear(self, table_name=None):
+        """Remove all items (of the given table, or of all tables) from the cache."""
+        with self.mutex:
+            for cache_key in self.items.keys():
+                if table_name is None or cache_key[0] == table_name:
+                    self.size -= self.items.pop(cache_key)[1]
+
+    def stats(self):
+        with self.mutex:
+            lookups = self.hits + self.misses
+            return {
+                'items': len(self.items),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+
+def compile_key_extractor(key_attributes):
+    """Return a function which extracts the given key attributes (hash and optional range key) from an item."""
+    if len(key_attributes) == 1:
+        hash_key, = key_attributes
+        return lambda item: {hash_key: item[hash_key]}
+    hash_key, range_key = key_attributes
+    return lambda item: {hash_key: item[hash_key], range_key: item[range_key]}
+
+
+class TableMetadata(object):
+    """Key schema and stream specification of a DynamoDB table."""
+
+    def __init__(self, description):
+        self.name = description['TableName']
+        self.key_attributes = tuple(key['AttributeName'] for key in description['KeySchema'])
+        self.extract_keys = compile_key_extractor(self.key_attributes)
+        stream = description.get('StreamSpecification') or {}
+        # None if the table has no (enabled) stream
+        self.stream_view_type = stream.get('StreamViewType') if stream.get('StreamEnabled') else None
+
+
+class TableMetadataCache(object):
+    """Cache of the metadata of DynamoDB tables. Tables which are not in the cache are loaded on demand
+    via `loader`, a function which returns the table description (as returned by DescribeTable), or None."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.tables = {}
+
+    def get(self, table_name):
+        """Return the TableMetadata of the given table, or None if the table does not exist."""
+        table = self.tables.get(table_name)
+        if table is None and table_name:
+            description = self.loader(table_name)
+            if description:
+                table = self.put(description)
+        return table
+
+    def put(self, description):
+        table = TableMetadata(description)
+        self.tables[table.name] = table
+        return table
+
+    def invalidate(self, table_name=None):
+        """Remove the given table (or all tables) from the cache, to be reloaded on next access."""
+        if table_name is None:
+            self.tables.clear()
+        else:
+            self.tables.pop(table_name, None)
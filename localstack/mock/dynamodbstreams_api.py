@@ -15,6 +15,10 @@ app = Flask(APP_NAME)
 DDB_STREAMS = []
 
 
+def cleanup():
+    del DDB_STREAMS[:]
+
+
 def add_dynamodb_stream(table_name, view_type='NEW_AND_OLD_IMAGES', enabled=True):
     if enabled:
         stream = {
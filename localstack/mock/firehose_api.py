@@ -21,6 +21,10 @@ app = Flask(APP_NAME)
 delivery_streams = {}
 
 
+def cleanup():
+    delivery_streams.clear()
+
+
 def get_delivery_stream_names():
     names = []
     for name, stream in delivery_streams.iteritems():
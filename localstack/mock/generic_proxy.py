@@ -1,124 +1,946 @@
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 import requests
+import httplib
+import socket
+import errno
 import os
+import re
 import json
+import time
+import select
+import threading
 import traceback
 import logging
+import Queue
+import collections
+import cPickle as pickle
 from SocketServer import ThreadingMixIn
+from requests.structures import CaseInsensitiveDict
 import __init__
-from localstack.utils.common import FuncThread
+from localstack.utils.common import FuncThread, TMP_FILES, short_uid
 
 
 QUIET = False
 
+# default number of idle keep-alive connections kept open per backend
+DEFAULT_POOL_SIZE = 20
+# default time (secs) after which an idle backend connection is discarded
+DEFAULT_POOL_IDLE_TIMEOUT = 30
+# default socket timeout (secs) for requests to the backend
+DEFAULT_BACKEND_TIMEOUT = 60
+# size of the chunks (bytes) copied between client and backend in streaming mode
+STREAM_CHUNK_SIZE = 64 * 1024
+# time (secs) after which idle keep-alive connections from clients are closed
+CLIENT_KEEPALIVE_TIMEOUT = 60
+
+# proxy engines - one thread per client connection, or a single non-blocking event loop
+ENGINE_THREADED = 'threaded'
+ENGINE_ASYNC = 'async'
+DEFAULT_ENGINE = ENGINE_THREADED
+# default size of the worker pool which runs the update listeners (async engine, or listener queue)
+DEFAULT_LISTENER_WORKERS = 10
+# default size of the listener queue of the async engine (bounded per worker, for listeners with a key)
+DEFAULT_LISTENER_QUEUE_SIZE = 1000
+
+# policies for a full listener queue - block the request thread, drop the invocation, or spill it to disk
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+OVERFLOW_SPILL = 'spill'
+# directory for listener invocations spilled to disk
+SPILL_DIR_PATTERN = '/tmp/proxy.spill.*'
+
+# default time (secs) a request may wait for admission to the backend, before it is rejected
+DEFAULT_ADMISSION_TIMEOUT = 5
+# value of the Retry-After header (secs) sent with rejected requests
+REJECTION_RETRY_AFTER = 1
+
+# hop-by-hop headers which must not be forwarded to the backend
+HOP_BY_HOP_HEADERS = ['connection', 'keep-alive', 'proxy-connection', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade']
+
 # set up logger
 LOGGER = logging.getLogger(__name__)
 
 
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle each request in a separate thread."""
+    # don't let idle keep-alive connections block the shutdown of the process
+    daemon_threads = True
+
+
+class BackendConnectionPool(object):
+    """Thread-safe pool of persistent (keep-alive) HTTP connections to a single backend host."""
+
+    def __init__(self, host, size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+            timeout=DEFAULT_BACKEND_TIMEOUT):
+        self.host = host
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # socket timeout (secs) of the backend connections - None to wait indefinitely
+        self.timeout = timeout
+        # list of (connection, last_used) tuples, most recently used last
+        self.idle = []
+        self.mutex = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.retries = 0
+
+    def new_connection(self):
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def acquire(self):
+        """Return a tuple (connection, reused) with an idle connection from the pool, or a new one."""
+        now = time.time()
+        expired = []
+        with self.mutex:
+            while self.idle and now - self.idle[0][1] > self.idle_timeout:
+                expired.append(self.idle.pop(0)[0])
+        while True:
+            with self.mutex:
+                if not self.idle:
+                    self.misses += 1
+                    self.expired += len(expired)
+                    break
+                conn = self.idle.pop()[0]
+            if not is_connection_dropped(conn):
+                with self.mutex:
+                    self.hits += 1
+                    self.expired += len(expired)
+                for c in expired:
+                    c.close()
+                return conn, True
+            expired.append(conn)
+        for c in expired:
+            c.close()
+        return self.new_connection(), False
+
+    def release(self, conn, response=None):
+        """Return a connection to the pool, after the response has been fully read."""
+        if response is not None and (response.will_close or not response.isclosed()):
+            conn.close()
+            return
+        with self.mutex:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers={}):
+        """Send a request to the backend and return a tuple (connection, response). The caller is
+        responsible for reading the response and handing the connection back via release(..).
+        A request on a reused connection is retried once on a fresh connection, but only if the failure
+        shows that the backend has closed the idle connection before it could see the request - other
+        failures (incl. timeouts) are raised, as the backend may have applied the request already."""
+        conn, reused = self.acquire()
+        while True:
+            try:
+                conn.request(method, path, body, headers)
+            except Exception, e:
+                conn.close()
+                if not reused or not is_stale_send_error(e):
+                    raise
+                conn, reused = self.retry_connection()
+                continue
+            try:
+                return conn, conn.getresponse()
+            except Exception, e:
+                conn.close()
+                if not reused or not is_stale_response_error(e):
+                    raise
+            conn, reused = self.retry_connection()
+
+    def open_request(self, method, path, headers={}):
+        """Send the request line and headers to the backend and return the connection, ready for
+        streaming the request body via conn.send(..), followed by conn.getresponse()."""
+        names = [k.lower() for k in headers]
+        conn, reused = self.acquire()
+        while True:
+            try:
+                conn.putrequest(method, path, skip_host='host' in names,
+                    skip_accept_encoding='accept-encoding' in names)
+                for name, value in headers.iteritems():
+                    conn.putheader(name, value)
+                conn.endheaders()
+                return conn
+            except Exception, e:
+                conn.close()
+                if not reused or not is_stale_send_error(e):
+                    raise
+            conn, reused = self.retry_connection()
+
+    def retry_connection(self):
+        with self.mutex:
+            self.retries += 1
+        return self.new_connection(), False
+
+    def close(self):
+        with self.mutex:
+            idle = self.idle
+            self.idle = []
+        for conn, last_used in idle:
+            conn.close()
+
+    def stats(self):
+        with self.mutex:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'retries': self.retries
+            }
+
+
+def listener_for(targets=None, paths=None, key=None):
+    """Decorator which declares the requests an update listener is interested in: a list of
+    X-Amz-Target actions, and/or a list of regexes matched against the request path. Requests
+    matching neither are passed through without being parsed, and without invoking the listener.
+    Listeners which are not decorated receive all requests. If the listener depends on the order
+    of its invocations, `key` maps the arguments of an invocation (as a dict) to a key - queued
+    invocations with the same key are run one at a time, in the order of the requests."""
+    def register(listener):
+        listener.listener_targets = frozenset(targets or [])
+        listener.listener_paths = [re.compile(path) for path in paths or []]
+        listener.listener_key = key
+        return listener
+    return register
+
+
+class ListenerQueue(object):
+    """Bounded queue of post-response listener invocations, drained by a pool of worker threads.
+    This takes the listener (e.g., triggering Lambda functions) off the latency path of the request.
+    Without a `key` function, invocations are run concurrently and in no particular order. With a
+    `key` function, each worker has its own queue (bounded by `size`), and all invocations with the
+    same key are routed to the same worker, hence run in order."""
+
+    def __init__(self, listener, size, workers=DEFAULT_LISTENER_WORKERS, overflow=OVERFLOW_BLOCK, key=None):
+        if overflow not in [OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_SPILL]:
+            raise Exception('Unknown listener queue overflow policy: %s' % overflow)
+        self.listener = listener
+        self.size = size
+        self.overflow = overflow
+        self.key = key
+        # one queue per worker if invocations are routed by key, or one queue shared by all workers
+        self.queues = [Queue.Queue(maxsize=size) for i in range(workers if key else 1)]
+        # (file, queue index) of spilled invocations, in FIFO order
+        self.spilled = collections.deque()
+        self.spill_dir = None
+        self.mutex = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled_total = 0
+        self.errors = 0
+        self.last_lag = 0
+        self.max_lag = 0
+        self.total_lag = 0
+        self.running = True
+        self.workers = []
+        for i in range(workers):
+            worker = FuncThread(self.run_worker, self.queues[i % len(self.queues)], quiet=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def queue_index(self, kwargs):
+        if not self.key:
+            return 0
+        return hash(self.key(kwargs)) % len(self.queues)
+
+    def put(self, **kwargs):
+        item = (time.time(), kwargs)
+        index = self.queue_index(kwargs)
+        queue = self.queues[index]
+        with self.mutex:
+            self.enqueued += 1
+        if self.overflow == OVERFLOW_BLOCK:
+            queue.put(item)
+            return
+        with self.mutex:
+            # keep FIFO order - once items have been spilled, new items are queued behind them
+            if not self.spilled:
+                try:
+                    queue.put_nowait(item)
+                    return
+                except Queue.Full, e:
+                    pass
+            if self.overflow == OVERFLOW_DROP:
+                self.dropped += 1
+                return
+            self.spill(item, index)
+
+    def spill(self, item, index):
+        if not self.spill_dir:
+            self.spill_dir = SPILL_DIR_PATTERN.replace('*', short_uid())
+            os.makedirs(self.spill_dir)
+            TMP_FILES.append(self.spill_dir)
+        spill_file = os.path.join(self.spill_dir, '%s.pickle' % self.spilled_total)
+        with open(spill_file, 'wb') as f:
+            pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+        self.spilled.append((spill_file, index))
+        self.spilled_total += 1
+
+    def refill(self):
+        """Move spilled invocations back into the in-memory queues, as space becomes available."""
+        with self.mutex:
+            while self.spilled:
+                spill_file, index = self.spilled[0]
+                if self.queues[index].full():
+                    break
+                self.spilled.popleft()
+                with open(spill_file, 'rb') as f:
+                    item = pickle.load(f)
+                os.remove(spill_file)
+                self.queues[index].put_nowait(item)
+
+    def run_worker(self, queue):
+        while self.running:
+            try:
+                enqueued_at, kwargs = queue.get(timeout=1)
+            except Queue.Empty, e:
+                continue
+            finally:
+                if self.spilled:
+                    self.refill()
+            lag = time.time() - enqueued_at
+            try:
+                self.listener(**kwargs)
+            except Exception, e:
+                with self.mutex:
+                    self.errors += 1
+                if not QUIET:
+                    LOGGER.error('Error running update listener: %s' % traceback.format_exc(e))
+            with self.mutex:
+                self.processed += 1
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                self.total_lag += lag
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        with self.mutex:
+            return {
+                'size': self.size,
+                'overflow': self.overflow,
+                'depth': sum(queue.qsize() for queue in self.queues) + len(self.spilled),
+                'spilled_pending': len(self.spilled),
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'spilled': self.spilled_total,
+                'errors': self.errors,
+                'last_lag': self.last_lag,
+                'max_lag': self.max_lag,
+                'avg_lag': self.total_lag / self.processed if self.processed else 0
+            }
+
+
+class AdmissionController(object):
+    """Limits the number of concurrent backend requests of a proxy. Requests beyond the limit wait in a
+    bounded FIFO queue, and are rejected if the queue is full or the wait exceeds the timeout."""
+
+    def __init__(self, max_concurrent, max_queue=0, timeout=DEFAULT_ADMISSION_TIMEOUT, event_factory=threading.Event):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # creates the events on which blocking acquire() calls wait
+        self.event_factory = event_factory
+        # queue of (deadline, admit, reject) tuples
+        self.waiters = collections.deque()
+        self.mutex = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_waiting = 0
+
+    def try_acquire(self, admit=None, reject=None):
+        """Non-blocking acquire. Return True if admitted, False if rejected, or None if the request
+        has been queued - in which case exactly one of admit() or reject() is invoked later on."""
+        with self.mutex:
+            if self.in_flight < self.max_concurrent:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if len(self.waiters) >= self.max_queue or not admit:
+                self.rejected += 1
+                return False
+            self.waiters.append((time.time() + self.timeout, admit, reject))
+            self.max_waiting = max(self.max_waiting, len(self.waiters))
+            return None
+
+    def acquire(self):
+        """Blocking acquire. Return True if admitted, or False if rejected."""
+        event = self.event_factory()
+        result = self.try_acquire(admit=event.set)
+        if result is not None:
+            return result
+        event.wait(self.timeout)
+        with self.mutex:
+            for waiter in self.waiters:
+                if waiter[1] == event.set:
+                    self.waiters.remove(waiter)
+                    self.rejected += 1
+                    self.timed_out += 1
+                    return False
+            # no longer queued - the slot has been handed over by release(), possibly just after the timeout
+            return True
+
+    def release(self):
+        with self.mutex:
+            if not self.waiters:
+                self.in_flight -= 1
+                return
+            # hand the slot over to the next waiting request - within the lock, so that the hand-over
+            # cannot race with the waiter timing out (admit() must not block)
+            deadline, admit, reject = self.waiters.popleft()
+            self.admitted += 1
+            admit()
+
+    def expire(self, now=None):
+        """Reject queued requests which have exceeded the timeout (for waiters registered via try_acquire)."""
+        now = now or time.time()
+        expired = []
+        with self.mutex:
+            while self.waiters and self.waiters[0][0] < now and self.waiters[0][2]:
+                expired.append(self.waiters.popleft()[2])
+            self.rejected += len(expired)
+            self.timed_out += len(expired)
+        for reject in expired:
+            reject()
+
+    def stats(self):
+        with self.mutex:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'waiting': len(self.waiters),
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out
+            }
+
+
+def is_connection_dropped(conn):
+    """Check whether an idle keep-alive connection has been closed by the backend in the meantime."""
+    if conn.sock is None:
+        return False
+    try:
+        # an idle connection should never be readable, unless the peer has closed it
+        return bool(select.select([conn.sock], [], [], 0.0)[0])
+    except (socket.error, select.error), e:
+        return True
+
+
+def is_stale_send_error(e):
+    """Whether sending a request failed because the peer had already closed the (idle) connection."""
+    return isinstance(e, socket.error) and not isinstance(e, socket.timeout) and \
+        e.errno in [errno.EPIPE, errno.ECONNRESET]
+
+
+def is_stale_response_error(e):
+    """Whether the connection has been closed by the peer without sending a single byte of the response."""
+    if not isinstance(e, httplib.BadStatusLine):
+        return False
+    # depending on the Python version, the status line is empty, or replaced by an explanatory message
+    return e.line in ['', "''"] or e.line.startswith('No status line received')
+
+
+def build_response(status, reason, headers, content, url=None):
+    """Wrap a raw backend response into a requests Response object, as expected by the listeners."""
+    response = requests.models.Response()
+    response.status_code = status
+    response.reason = reason
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.url = url
+    response._content = content
+    return response
+
+
+def status_reason(code):
+    return BaseHTTPRequestHandler.responses.get(code, ('',))[0]
+
+
+def request_body(request):
+    """Return the raw body of a (modified) request returned by the update listener."""
+    if isinstance(request.data, (dict, list)):
+        return json.dumps(request.data)
+    return request.data or ''
+
+
+def apply_response_hooks(request, response):
+    """Run the 'response' hooks of a (modified) request returned by the update listener. The hooks
+    may return a new response to send to the client - the listener itself receives the original one."""
+    return requests.hooks.dispatch_hook('response', request.hooks, response)
 
 
 class GenericProxyHandler(BaseHTTPRequestHandler):
+    # speak HTTP/1.1, to allow clients to keep their connections open across requests
+    protocol_version = 'HTTP/1.1'
+    # close idle client connections after this many seconds
+    timeout = CLIENT_KEEPALIVE_TIMEOUT
+    # buffer the response (flushed after each request), and don't delay small writes
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
     def __init__(self, request, client_address, server):
         self.request = request
         self.client_address = client_address
         self.server = server
         self.proxy = server.my_object
         self.data_string = None
+        self.response_started = False
         BaseHTTPRequestHandler.__init__(self, request, client_address, server)
 
     def do_GET(self):
-        self.method = requests.get
         self.forward('GET')
 
     def do_PUT(self):
-        self.data_string = self.rfile.read(int(self.headers['Content-Length']))
-        self.method = requests.put
         self.forward('PUT')
 
     def do_POST(self):
-        self.data_string = self.rfile.read(int(self.headers['Content-Length']))
-        self.method = requests.post
         self.forward('POST')
 
     def do_DELETE(self):
-        self.method = requests.delete
         self.forward('DELETE')
 
     def do_HEAD(self):
-        self.method = requests.head
         self.forward('HEAD')
 
     def do_PATCH(self):
-        self.method = requests.patch
-        self.data_string = self.rfile.read(int(self.headers['Content-Length']))
         self.forward('PATCH')
 
+    def is_chunked_request(self):
+        return 'chunked' in (self.headers.get('Transfer-Encoding') or '').lower()
+
+    def read_body(self):
+        if self.is_chunked_request():
+            return self.read_chunked_body()
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return None
+        return self.rfile.read(int(length))
+
+    def read_chunked_body(self):
+        chunks = []
+        while True:
+            line = self.rfile.readline()
+            size = int(line.split(';', 1)[0].strip(), 16)
+            if size == 0:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        # skip the (optional) trailer section
+        while self.rfile.readline() not in ['\r\n', '\n', '']:
+            pass
+        return ''.join(chunks)
+
+    def copy_request_body(self, conn):
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise Exception('Client closed connection with %s bytes of request body remaining' % remaining)
+            conn.send(chunk)
+            remaining -= len(chunk)
+
+    def copy_response_body(self, backend_response, chunked=False):
+        while True:
+            chunk = backend_response.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            if chunked:
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+        if chunked:
+            self.wfile.write('0\r\n\r\n')
+
+    def send_response_only(self, code, message=None):
+        """Send the status line only - as opposed to send_response(..), which adds Server/Date headers."""
+        if message is None:
+            message = self.responses[code][0] if code in self.responses else ''
+        self.response_started = True
+        if self.request_version != 'HTTP/0.9':
+            self.wfile.write('%s %d %s\r\n' % (self.protocol_version, code, message))
+
+    def send_backend_headers(self, headers, skip=[]):
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in skip:
+                self.send_header(name, value)
+
+    def end_headers(self):
+        if self.request_version == 'HTTP/1.0' and not self.close_connection:
+            # HTTP/1.0 clients need to be told explicitly that the connection is kept alive
+            self.send_header('Connection', 'keep-alive')
+        BaseHTTPRequestHandler.end_headers(self)
+
+    def send_empty_response(self, code):
+        self.response_started = True
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_rejection(self):
+        status, headers, body = self.proxy.rejection_response()
+        self.response_started = True
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def discard_request_body(self):
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+    def forward_headers(self):
+        headers = dict((k, v) for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS)
+        # local backends gain nothing from compression, and listeners expect a plain body
+        headers['accept-encoding'] = 'identity'
+        return headers
+
     def forward(self, method):
         path = self.path
         if '://' in path:
             path = '/' + path.split('://', 1)[1].split('/', 1)[1]
-        proxy_url = 'http://%s%s' % (self.proxy.forward_host, path)
-        target_url = self.path
-        if '://' not in target_url:
-            target_url = 'http://%s%s' % (self.proxy.forward_host, target_url)
-        data = None
-        if method in ['POST', 'PUT', 'PATCH']:
-            try:
-                data = json.loads(self.data_string)
-            except Exception, e:
-                # unable to parse JSON, fallback to verbatim string
-                data = self.data_string
-        proxies = {
-            'http': proxy_url,
-            'https': proxy_url
-        }
+        self.response_started = False
         try:
-            if self.proxy.update_listener:
-                do_forward = self.proxy.update_listener(method=method, path=path,
-                    data=data, headers=self.headers, return_forward_info=True)
-                if do_forward is not True:
-                    # LOGGER.info('Proxy forward decision negative, dropping message.')
-                    code = do_forward if isinstance(do_forward, int) else 503
-                    self.send_response(code)  # Bad Gateway status code
-                    self.end_headers()
-                    return
-            response = self.method(target_url, data=self.data_string,
-                headers=self.headers, proxies=proxies)
-            self.send_response(response.status_code)
-            self.end_headers()
-            self.wfile.write(response.text)
-            if self.proxy.update_listener:
-                self.proxy.update_listener(method=method, path=path,
-                    data=data, headers=self.headers, response=response)
+            self.proxy.ensure_backend()
+            if self.proxy.streaming and not self.proxy.needs_body(method, path, self.headers):
+                self.forward_streaming(method, path)
+            else:
+                self.forward_buffered(method, path)
         except Exception, e:
             if not QUIET:
                 LOGGER.error("Error forwarding request: %s" % traceback.format_exc(e))
+            # the state of the connection is undefined at this point, hence don't reuse it
+            self.close_connection = 1
+            if not self.response_started:
+                try:
+                    self.send_empty_response(504 if isinstance(e, socket.timeout) else 502)
+                except Exception, e:
+                    pass
+
+    def forward_streaming(self, method, path):
+        """Copy the raw request and response bytes in chunks, without buffering or decoding them."""
+        headers = self.forward_headers()
+        body = None
+        if self.is_chunked_request():
+            # re-frame chunked request bodies with a Content-Length for the backend
+            body = self.read_body()
+            headers['content-length'] = str(len(body))
+        admission = self.proxy.admission
+        if admission and not admission.acquire():
+            if body is None:
+                self.discard_request_body()
+            self.send_rejection()
+            return
+        try:
+            self.forward_stream(method, path, headers, body)
+        finally:
+            if admission:
+                admission.release()
+
+    def forward_stream(self, method, path, headers, body):
+        pool = self.proxy.pool
+        conn = pool.open_request(method, path, headers=headers)
+        try:
+            if body is not None:
+                conn.send(body)
+            else:
+                self.copy_request_body(conn)
+            backend_response = conn.getresponse()
+            status = backend_response.status
+            has_body = method != 'HEAD' and status >= 200 and status not in [204, 304]
+            chunked = False
+            self.send_response_only(status, backend_response.reason)
+            self.send_backend_headers(backend_response.getheaders())
+            if has_body and backend_response.getheader('content-length') is None:
+                # the length of the body is unknown upfront - chunk it for HTTP/1.1 clients,
+                # or delimit it by closing the connection for HTTP/1.0 clients
+                if self.request_version == 'HTTP/1.1':
+                    chunked = True
+                    self.send_header('Transfer-Encoding', 'chunked')
+                else:
+                    self.close_connection = 1
+            self.end_headers()
+            if has_body:
+                self.copy_response_body(backend_response, chunked=chunked)
+            else:
+                # mark the (empty) backend response as consumed, to allow reusing the connection
+                backend_response.read()
+        except Exception, e:
+            conn.close()
+            raise
+        pool.release(conn, backend_response)
+
+    def forward_buffered(self, method, path):
+        self.data_string = self.read_body()
+        notify = self.proxy.needs_body(method, path, self.headers)
+        data = self.proxy.parse_data(method, self.data_string) if notify else None
+        do_forward = self.proxy.forward_info(method, path, data, self.headers) if notify else True
+        modified = None
+        if isinstance(do_forward, requests.models.Request):
+            # the listener has modified the request, and may post-process the response via hooks
+            modified, do_forward = do_forward, True
+        if isinstance(do_forward, requests.models.Response):
+            # the listener has handled the request itself
+            self.send_client_response(method, do_forward)
+            return
+        if do_forward is not True:
+            # LOGGER.info('Proxy forward decision negative, dropping message.')
+            code = do_forward if isinstance(do_forward, int) else 503
+            self.send_empty_response(code)  # Bad Gateway status code
+            return
+        admission = self.proxy.admission
+        if admission and not admission.acquire():
+            self.send_rejection()
+            return
+        body = self.data_string
+        headers = self.forward_headers()
+        if modified:
+            body = request_body(modified)
+            headers = dict((k, v) for k, v in headers.items() if k.lower() != 'content-length')
+            headers['Content-Length'] = str(len(body))
+        try:
+            response = self.proxy.backend_request(method, path, body, headers)
+        finally:
+            if admission:
+                admission.release()
+        client_response = apply_response_hooks(modified, response) if modified else response
+        queued = notify and self.proxy.listener_queue
+        if queued:
+            # enqueue before responding, so that the invocations for subsequent requests are queued behind
+            self.proxy.notify_listener(method, path, data, self.headers, response)
+        self.send_client_response(method, client_response)
+        if notify and not queued:
+            self.proxy.notify_listener(method, path, data, self.headers, response)
+
+    def send_client_response(self, method, response):
+        self.response_started = True
+        self.send_response_only(response.status_code, response.reason)
+        headers = response.headers.items()
+        if method == 'HEAD':
+            self.send_backend_headers(headers)
+        else:
+            self.send_backend_headers(headers, skip=['content-length'])
+            self.send_header('Content-Length', str(len(response.content)))
+        self.end_headers()
+        # write the raw bytes - decoding to unicode and back can corrupt binary payloads
+        self.wfile.write(response.content)
 
     def log_message(self, format, *args):
         return
 
 
 class GenericProxy(FuncThread):
-    def __init__(self, port, forward_host, update_listener=None, params={}):
+    def __init__(self, port, forward_host, update_listener=None, params={},
+            pool_size=DEFAULT_POOL_SIZE, pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+            backend_timeout=DEFAULT_BACKEND_TIMEOUT, streaming=False,
+            engine=DEFAULT_ENGINE, listener_workers=DEFAULT_LISTENER_WORKERS,
+            listener_queue_size=None, listener_overflow=OVERFLOW_BLOCK, max_concurrent=None,
+            max_queue=0, admission_timeout=DEFAULT_ADMISSION_TIMEOUT, rejection_error=None,
+            backend_starter=None):
         FuncThread.__init__(self, self.run_cmd, params, quiet=True)
         self.httpd = None
         self.port = port
         self.forward_host = forward_host
         self.update_listener = update_listener
+        # index of the X-Amz-Target actions and path patterns the listener is interested in (see listener_for)
+        self.listener_targets = getattr(update_listener, 'listener_targets', None)
+        self.listener_paths = getattr(update_listener, 'listener_paths', [])
+        self.pool = BackendConnectionPool(forward_host, size=pool_size, idle_timeout=pool_idle_timeout,
+            timeout=backend_timeout)
+        # if enabled, requests that no listener needs to inspect are passed through as raw byte streams
+        self.streaming = streaming
+        # either ENGINE_THREADED (one thread per connection) or ENGINE_ASYNC (single event loop)
+        self.engine = engine
+        # max. number of listener invocations running concurrently (ENGINE_ASYNC, or listener queue)
+        self.listener_workers = listener_workers
+        # if a queue size is given (and always with ENGINE_ASYNC), post-response listener invocations are
+        # queued and run asynchronously - in order for invocations with the same key (see listener_for)
+        self.listener_queue = None
+        if update_listener and (listener_queue_size or engine == ENGINE_ASYNC):
+            self.listener_queue = ListenerQueue(update_listener,
+                size=listener_queue_size or DEFAULT_LISTENER_QUEUE_SIZE, workers=listener_workers,
+                overflow=listener_overflow, key=getattr(update_listener, 'listener_key', None))
+        # if a limit is given, excess concurrent backend requests are queued, and eventually rejected
+        self.admission = None
+        if max_concurrent:
+            self.admission = AdmissionController(max_concurrent, max_queue=max_queue, timeout=admission_timeout)
+        # error type ('__type' attribute) of the response body sent for rejected requests
+        self.rejection_error = rejection_error
+        # if given, the backend is started lazily (by calling this function) when the first request comes in
+        self.backend_starter = backend_starter
+        self.backend_started = backend_starter is None
+        self.backend_condition = threading.Condition()
+        # whether a call to `backend_starter` is in progress, and the error raised by the last (failed) call
+        self.backend_starting = False
+        self.backend_error = None
+
+    def ensure_backend(self):
+        """Start the backend via `backend_starter` (once), blocking until it is ready to serve requests.
+        If starting the backend fails, the requests which have waited for it fail with the same error,
+        and the next request calls `backend_starter` again - which hence must not start a second backend
+        if the first one is still running (e.g., it should probe the running backend again)."""
+        if self.backend_started:
+            return
+        with self.backend_condition:
+            if self.backend_starting:
+                while self.backend_starting:
+                    self.backend_condition.wait()
+                if self.backend_started:
+                    return
+                raise self.backend_error
+            if self.backend_started:
+                return
+            self.backend_starting = True
+        error = None
+        try:
+            self.backend_starter()
+        except Exception, e:
+            error = e
+            raise
+        finally:
+            with self.backend_condition:
+                self.backend_error = error
+                self.backend_started = error is None
+                self.backend_starting = False
+                self.backend_condition.notify_all()
+
+    def rejection_response(self):
+        """Return a tuple (status, headers, body) for requests which have been rejected by admission control."""
+        body = {'message': 'Too many concurrent requests to the backend, please retry'}
+        if self.rejection_error:
+            body['__type'] = self.rejection_error
+        headers = [('Content-Type', 'application/x-amz-json-1.0'), ('Retry-After', str(REJECTION_RETRY_AFTER))]
+        return 503, headers, json.dumps(body)
+
+    def needs_body(self, method, path, headers):
+        """Whether the given request needs to be buffered and parsed for the update listener."""
+        if not self.update_listener:
+            return False
+        if self.listener_targets is None:
+            return True
+        if headers.get('X-Amz-Target') in self.listener_targets:
+            return True
+        for regex in self.listener_paths:
+            if regex.match(path):
+                return True
+        return False
+
+    def parse_data(self, method, data_string):
+        if method not in ['POST', 'PUT', 'PATCH']:
+            return None
+        try:
+            return json.loads(data_string)
+        except Exception, e:
+            # unable to parse JSON, fallback to verbatim string
+            return data_string
+
+    def forward_info(self, method, path, data, headers):
+        """Ask the update listener whether (and how) to forward the given request to the backend."""
+        if not self.update_listener:
+            return True
+        return self.update_listener(method=method, path=path,
+            data=data, headers=headers, return_forward_info=True)
+
+    def backend_request(self, method, path, body, headers):
+        """Send a request to the backend via the connection pool, and return the response."""
+        conn, backend_response = self.pool.request(method, path, body=body, headers=headers)
+        try:
+            content = backend_response.read()
+        except Exception, e:
+            conn.close()
+            raise
+        self.pool.release(conn, backend_response)
+        return build_response(backend_response.status, backend_response.reason,
+            backend_response.getheaders(), content, url='http://%s%s' % (self.forward_host, path))
+
+    def invoke(self, method, path, data, headers):
+        """Process a request within this process, as if it had been sent to the proxy: consult the update
+        listener, forward the request to the backend, notify the listener, and return the response for
+        the client. This allows other components to call the backend without a second HTTP hop."""
+        self.ensure_backend()
+        do_forward = self.forward_info(method, path, data, headers)
+        modified = None
+        if isinstance(do_forward, requests.models.Request):
+            modified, do_forward = do_forward, True
+        if isinstance(do_forward, requests.models.Response):
+            return do_forward
+        if do_forward is not True:
+            code = do_forward if isinstance(do_forward, int) else 503
+            return build_response(code, status_reason(code), [], '')
+        body = request_body(modified or requests.models.Request(data=data))
+        backend_headers = dict((k, v) for k, v in headers.items() if k.lower() != 'content-length')
+        backend_headers['Content-Length'] = str(len(body))
+        if self.admission and not self.admission.acquire():
+            status, response_headers, content = self.rejection_response()
+            return build_response(status, status_reason(status), response_headers, content)
+        try:
+            response = self.backend_request(method, path, body, backend_headers)
+        finally:
+            if self.admission:
+                self.admission.release()
+        client_response = apply_response_hooks(modified, response) if modified else response
+        self.notify_listener(method, path, data, CaseInsensitiveDict(headers), response)
+        return client_response
+
+    def notify_listener(self, method, path, data, headers, response):
+        """Hand the backend response for the given request to the update listener."""
+        if self.listener_queue:
+            # copy the headers, as they may be tied to the (reused) client connection
+            headers = CaseInsensitiveDict(headers.items())
+            self.listener_queue.put(method=method, path=path,
+                data=data, headers=headers, response=response)
+        elif self.update_listener:
+            self.update_listener(method=method, path=path,
+                data=data, headers=headers, response=response)
 
     def run_cmd(self, params):
         try:
-            self.httpd = ThreadedHTTPServer(("", self.port), GenericProxyHandler)
-            self.httpd.my_object = self
+            if self.engine == ENGINE_ASYNC:
+                # imported here, as the async engine itself builds on this module
+                from localstack.mock.async_proxy import AsyncProxyServer
+                self.httpd = AsyncProxyServer(("", self.port), self)
+            else:
+                self.httpd = ThreadedHTTPServer(("", self.port), GenericProxyHandler)
+                self.httpd.my_object = self
             self.httpd.serve_forever()
         except Exception, e:
             if not self.quiet:
                 LOGGER.error(traceback.format_exc(e))
             raise
 
+    def stats(self):
+        result = {
+            'pool': self.pool.stats()
+        }
+        if self.engine == ENGINE_ASYNC and self.httpd:
+            # the event loop uses its own connections, while invoke(..) uses the (blocking) pool
+            result['async_pool'] = self.httpd.pool.stats()
+        if self.listener_queue:
+            result['listener_queue'] = self.listener_queue.stats()
+        if self.admission:
+            result['admission'] = self.admission.stats()
+        return result
+
     def stop(self, quiet=False):
         self.quiet = quiet
         if self.httpd:
             self.httpd.server_close()
+        self.pool.close()
+        if self.listener_queue:
+            self.listener_queue.stop()
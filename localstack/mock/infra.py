@@ -8,12 +8,17 @@ import traceback
 import logging
 import requests
 import json
+import zlib
+import uuid
+import threading
+from flask import Flask, jsonify, request
 import __init__
 from localstack.utils.aws import aws_stack
 from localstack.utils import common
 from localstack.utils.common import *
 from localstack.mock import firehose_api, lambda_api, generic_proxy, dynamodbstreams_api
-from localstack.mock.generic_proxy import GenericProxy
+from localstack.mock.generic_proxy import GenericProxy, listener_for, build_response, status_reason
+from localstack.mock.dynamodb_cache import ShadowItemCache, TableMetadataCache, MISSING
 from localstack.constants import *
 
 this_path = os.path.dirname(os.path.realpath(__file__))
@@ -22,8 +27,98 @@ root_path = os.path.realpath(os.path.join(this_path, '..', '..'))
 # will be set to True if user hits CTRL-C
 KILLED = False
 
-# cache table definitions - used for testing
-TABLE_DEFINITIONS = {}
+
+# proxies in front of the backend services, by API name
+PROXIES = {}
+
+# error types returned by the proxies when rejecting requests (if admission control is enabled)
+PROXY_REJECTION_ERRORS = {
+    'dynamodb': 'com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException',
+    'kinesis': 'ProvisionedThroughputExceededException'
+}
+
+# readiness polling during startup: initial interval, growth factor, max interval, and overall timeout (secs)
+READINESS_POLL_INTERVAL = 0.05
+READINESS_POLL_BACKOFF = 1.5
+READINESS_POLL_MAX_INTERVAL = 1.0
+READINESS_TIMEOUT = 120
+# timeout (secs) of a single readiness probe request
+READINESS_PROBE_TIMEOUT = 2
+
+# public service ports, by API name
+SERVICE_PORTS = {
+    'kinesis': DEFAULT_PORT_KINESIS,
+    'dynamodb': DEFAULT_PORT_DYNAMODB,
+    'dynamodbstreams': DEFAULT_PORT_DYNAMODBSTREAMS,
+    'firehose': DEFAULT_PORT_FIREHOSE,
+    's3': DEFAULT_PORT_S3,
+    'es': DEFAULT_PORT_ELASTICSEARCH,
+    'apigateway': DEFAULT_PORT_APIGATEWAY,
+    'lambda': DEFAULT_PORT_LAMBDA
+}
+
+# readiness probes, by API name: path to request and (optional) X-Amz-Target header for a POST request
+READINESS_PROBES = {
+    'kinesis': ('/', 'Kinesis_20131202.ListStreams'),
+    'dynamodb': ('/', 'DynamoDB_20120810.ListTables'),
+    'dynamodbstreams': ('/', 'DynamoDBStreams_20120810.ListStreams'),
+    'firehose': ('/', 'Firehose_20150804.ListDeliveryStreams'),
+    's3': ('/', None),
+    'es': ('/', None),
+    'apigateway': ('/restapis', None),
+    'lambda': ('/2015-03-31/event-source-mappings/', None)
+}
+
+# APIs started via start_infra(..)
+RUNNING_APIS = set()
+
+# max. time (secs) to wait for deleted resources to disappear when resetting the infrastructure
+RESET_TIMEOUT = 30
+
+# return values to request from the DynamoDB backend, by action and stream view type, to obtain the
+# item images for stream records from the write itself (for NEW_AND_OLD_IMAGES, only one image is available)
+STREAM_RETURN_VALUES = {
+    'DynamoDB_20120810.UpdateItem': {
+        'NEW_IMAGE': 'ALL_NEW',
+        'OLD_IMAGE': 'ALL_OLD',
+        'NEW_AND_OLD_IMAGES': 'ALL_NEW'
+    },
+    'DynamoDB_20120810.PutItem': {
+        'OLD_IMAGE': 'ALL_OLD',
+        'NEW_AND_OLD_IMAGES': 'ALL_OLD'
+    },
+    'DynamoDB_20120810.DeleteItem': {
+        'OLD_IMAGE': 'ALL_OLD',
+        'NEW_AND_OLD_IMAGES': 'ALL_OLD'
+    }
+}
+
+# DynamoDB actions which write a single item
+DYNAMODB_ITEM_ACTIONS = ['DynamoDB_20120810.PutItem', 'DynamoDB_20120810.UpdateItem', 'DynamoDB_20120810.DeleteItem']
+
+# last sequence number of the DynamoDB stream records, by table name
+DYNAMODB_SEQUENCE_NUMBERS = {}
+DYNAMODB_STREAM_LOCK = threading.Lock()
+
+# metadata (key schema, stream specification) of DynamoDB tables, loaded on demand
+DYNAMODB_TABLES = TableMetadataCache(loader=lambda table_name: dynamodb_describe_table(table_name))
+
+# latest images of DynamoDB items, used to produce the old images of stream records
+DYNAMODB_ITEM_CACHE = ShadowItemCache()
+
+# resolved API Gateway integrations, by (API ID, HTTP method, resource path)
+APIGATEWAY_INTEGRATIONS = {}
+# number of changes to the resources/integrations of each API ID, to detect lookups which
+# raced with a change (their result is not cached)
+APIGATEWAY_GENERATIONS = {}
+APIGATEWAY_LOCK = threading.Lock()
+APIGATEWAY_CLIENT = None
+
+# management API of the local infrastructure (e.g., POST /reset)
+infra_app = Flask('infra_api')
+
+# time (secs) it took each service to become ready during the last call to start_infra(..)
+SERVICE_STARTUP_TIMES = {}
 
 
 def do_run(cmd, async):
@@ -36,88 +131,146 @@ def do_run(cmd, async):
         return run(cmd)
 
 
-def start_dynalite(port=DEFAULT_PORT_DYNAMODB, async=False, update_listener=None):
+def start_proxy(api, port, backend_port, update_listener=None, proxy_settings={}):
+    settings = {'streaming': True}
+    if api in PROXY_REJECTION_ERRORS:
+        settings['rejection_error'] = PROXY_REJECTION_ERRORS[api]
+    settings.update(proxy_settings)
+    proxy_thread = GenericProxy(port=port, forward_host='127.0.0.1:%s' % backend_port,
+        update_listener=update_listener, **settings)
+    proxy_thread.start()
+    TMP_THREADS.append(proxy_thread)
+    PROXIES[api] = proxy_thread
+    return proxy_thread
+
+
+def start_lazily(api, port, backend_port, start_backend, update_listener=None, proxy_settings={}):
+    """ Bind the proxy for the given API to `port` right away, but defer starting the backend (by calling
+        `start_backend`) until the first request comes in. That request waits until the backend is ready. """
+    # thread which runs the backend, once started
+    backend = {}
+
+    def start_on_demand():
+        thread = backend.get('thread')
+        if thread and thread.is_alive():
+            # the backend has not become ready in time before - don't start a second one on the same port
+            print('Waiting for backend of "%s" to become ready...' % api)
+        else:
+            print('Starting backend for "%s" on first request...' % api)
+            backend['thread'] = start_backend()
+        wait_for_service(api, port=backend_port)
+
+    settings = dict(proxy_settings)
+    settings['backend_starter'] = start_on_demand
+    return start_proxy(api, port, backend_port, update_listener, settings)
+
+
+def start_server(serve, port):
+    thread = FuncThread(serve, port, quiet=True)
+    thread.start()
+    TMP_THREADS.append(thread)
+    return thread
+
+
+def get_proxy_stats():
+    """ Return the connection pool, listener queue, etc. statistics of all proxies, by API name. """
+    return dict((api, proxy.stats()) for api, proxy in PROXIES.items())
+
+
+def start_dynalite(port=DEFAULT_PORT_DYNAMODB, async=False, update_listener=None, proxy_settings={}, lazy=False):
     backend_port = DEFAULT_PORT_DYNAMODB_BACKEND
     cmd = '%s/node_modules/dynalite/cli.js --port %s' % (root_path, backend_port)
     print("Starting mock DynamoDB...")
-    proxy_thread = GenericProxy(port=port, forward_host='127.0.0.1:%s' %
-                        backend_port, update_listener=update_listener)
-    proxy_thread.start()
-    TMP_THREADS.append(proxy_thread)
+    if lazy:
+        return start_lazily('dynamodb', port, backend_port, lambda: do_run(cmd, True),
+            update_listener, proxy_settings)
+    start_proxy('dynamodb', port, backend_port, update_listener, proxy_settings)
     return do_run(cmd, async)
 
 
-def start_kinesalite(port=DEFAULT_PORT_KINESIS, async=False, shard_limit=100, update_listener=None):
+def start_kinesalite(port=DEFAULT_PORT_KINESIS, async=False, shard_limit=100, update_listener=None,
+        proxy_settings={}, lazy=False):
     backend_port = DEFAULT_PORT_KINESIS_BACKEND
     cmd = ('%s/node_modules/kinesalite/cli.js --shardLimit %s --port %s' %
         (root_path, shard_limit, backend_port))
     print("Starting mock Kinesis...")
-    proxy_thread = GenericProxy(port=port, forward_host='127.0.0.1:%s' %
-                        backend_port, update_listener=update_listener)
-    proxy_thread.start()
-    TMP_THREADS.append(proxy_thread)
+    if lazy:
+        return start_lazily('kinesis', port, backend_port, lambda: do_run(cmd, True),
+            update_listener, proxy_settings)
+    start_proxy('kinesis', port, backend_port, update_listener, proxy_settings)
     return do_run(cmd, async)
 
 
-def start_elasticsearch(port=DEFAULT_PORT_ELASTICSEARCH, delete_data=True, async=False):
+def start_elasticsearch(port=DEFAULT_PORT_ELASTICSEARCH, delete_data=True, async=False, lazy=False):
+    backend_port = DEFAULT_PORT_ELASTICSEARCH_BACKEND if lazy else port
     cmd = ('%s/infra/elasticsearch/bin/elasticsearch --http.port=%s --http.publish_port=%s' %
-        (root_path, port, port))
+        (root_path, backend_port, port))
     print("Starting local Elasticsearch...")
     if delete_data:
         path = '%s/infra/elasticsearch/data/elasticsearch' % (root_path)
         run('rm -rf %s' % path)
+    if lazy:
+        return start_lazily('es', port, backend_port, lambda: do_run(cmd, True))
     return do_run(cmd, async)
 
 
-def start_apigateway(port=DEFAULT_PORT_APIGATEWAY, async=False, update_listener=None):
+def start_apigateway(port=DEFAULT_PORT_APIGATEWAY, async=False, update_listener=None, proxy_settings={},
+        lazy=False):
     backend_port = DEFAULT_PORT_APIGATEWAY_BACKEND
     cmd = '%s/bin/moto_server apigateway -p%s' % (LOCALSTACK_VENV_FOLDER, backend_port)
     print("Starting mock API Gateway...")
-    proxy_thread = GenericProxy(port=port, forward_host='127.0.0.1:%s' %
-                        backend_port, update_listener=update_listener)
-    proxy_thread.start()
-    TMP_THREADS.append(proxy_thread)
+    if lazy:
+        return start_lazily('apigateway', port, backend_port, lambda: do_run(cmd, True),
+            update_listener, proxy_settings)
+    start_proxy('apigateway', port, backend_port, update_listener, proxy_settings)
     return do_run(cmd, async)
 
 
-def start_s3(port=DEFAULT_PORT_S3, async=False):
-    cmd = '%s/bin/moto_server s3 -p%s' % (LOCALSTACK_VENV_FOLDER, port)
+def start_s3(port=DEFAULT_PORT_S3, async=False, lazy=False):
+    backend_port = DEFAULT_PORT_S3_BACKEND if lazy else port
+    cmd = '%s/bin/moto_server s3 -p%s' % (LOCALSTACK_VENV_FOLDER, backend_port)
     print("Starting mock S3 server...")
+    if lazy:
+        return start_lazily('s3', port, backend_port, lambda: do_run(cmd, True))
     return do_run(cmd, async)
 
 
-def start_firehose(async=False):
+def start_firehose(port=DEFAULT_PORT_FIREHOSE, async=False, lazy=False):
     print("Starting mock Firehose...")
+    if lazy:
+        backend_port = DEFAULT_PORT_FIREHOSE_BACKEND
+        return start_lazily('firehose', port, backend_port,
+            lambda: start_server(firehose_api.serve, backend_port))
     if async:
-        thread = FuncThread(firehose_api.serve, DEFAULT_PORT_FIREHOSE, quiet=True)
-        thread.start()
-        TMP_THREADS.append(thread)
-        return thread
+        return start_server(firehose_api.serve, port)
     else:
-        firehose_api.serve(DEFAULT_PORT_FIREHOSE)
+        firehose_api.serve(port)
 
 
-def start_dynamodbstreams(async=False):
+def start_dynamodbstreams(port=DEFAULT_PORT_DYNAMODBSTREAMS, async=False, lazy=False):
     print("Starting mock DynamoDB Streams...")
+    if lazy:
+        backend_port = DEFAULT_PORT_DYNAMODBSTREAMS_BACKEND
+        return start_lazily('dynamodbstreams', port, backend_port,
+            lambda: start_server(dynamodbstreams_api.serve, backend_port))
     if async:
-        thread = FuncThread(dynamodbstreams_api.serve, DEFAULT_PORT_DYNAMODBSTREAMS, quiet=True)
-        thread.start()
-        TMP_THREADS.append(thread)
-        return thread
+        return start_server(dynamodbstreams_api.serve, port)
     else:
-        firehose_api.serve(DEFAULT_PORT_DYNAMODBSTREAMS)
+        dynamodbstreams_api.serve(port)
 
 
-def start_lambda(async=False):
+def start_lambda(port=DEFAULT_PORT_LAMBDA, async=False, lazy=False):
     print("Starting mock Lambda...")
-    lambda_api.cleanup()
+    # keep the persisted Kinesis checkpoints, to resume where the pollers stopped before a restart
+    lambda_api.cleanup(clear_checkpoints=False)
+    if lazy:
+        backend_port = DEFAULT_PORT_LAMBDA_BACKEND
+        return start_lazily('lambda', port, backend_port,
+            lambda: start_server(lambda_api.serve, backend_port))
     if async:
-        thread = FuncThread(lambda_api.serve, DEFAULT_PORT_LAMBDA, quiet=True)
-        thread.start()
-        TMP_THREADS.append(thread)
-        return thread
+        return start_server(lambda_api.serve, port)
     else:
-        lambda_api.serve(DEFAULT_PORT_LAMBDA)
+        lambda_api.serve(port)
 
 
 def stop_infra():
@@ -125,11 +278,125 @@ def stop_infra():
     common.cleanup(files=True, quiet=True)
     common.cleanup_resources()
     lambda_api.cleanup()
+    RUNNING_APIS.clear()
     time.sleep(1)
     # TODO: optimize this (takes too long currently)
     # check_infra(retries=2, expect_shutdown=True)
 
 
+def is_backend_running(api):
+    """ Whether the backend of the given API has been started (backends started lazily may not be). """
+    proxy = PROXIES.get(api)
+    return not proxy or proxy.backend_started
+
+
+def reset_dynamodb(client):
+    DYNAMODB_TABLES.invalidate()
+    DYNAMODB_ITEM_CACHE.clear()
+    DYNAMODB_SEQUENCE_NUMBERS.clear()
+    for table_name in client.list_tables()['TableNames']:
+        client.delete_table(TableName=table_name)
+    # wait until the tables are gone, as tables with the same names are likely to be re-created
+    if not wait_until(lambda: not client.list_tables()['TableNames'], timeout=RESET_TIMEOUT):
+        raise Exception('DynamoDB tables still exist %s secs after deleting them: %s' %
+            (RESET_TIMEOUT, client.list_tables()['TableNames']))
+
+
+def reset_kinesis(client):
+    lambda_api.kinesis_checkpoints.clear()
+    for stream_name in client.list_streams()['StreamNames']:
+        client.delete_stream(StreamName=stream_name)
+    if not wait_until(lambda: not client.list_streams()['StreamNames'], timeout=RESET_TIMEOUT):
+        raise Exception('Kinesis streams still exist %s secs after deleting them: %s' %
+            (RESET_TIMEOUT, client.list_streams()['StreamNames']))
+
+
+def reset_s3(resource):
+    for bucket in resource.buckets.all():
+        bucket.objects.all().delete()
+        bucket.delete()
+
+
+def reset_infra(apis=None):
+    """ Clear the state of the (running) services in place, without restarting any processes. This deletes
+        all tables, streams, buckets, and indices in the backends, as well as Lambda functions and event
+        source mappings, Firehose delivery streams, and DynamoDB streams. The services are reset in parallel.
+        By default, all services started via start_infra(..) are reset. Raises an exception if any service
+        could not be reset (after attempting to reset all of them). """
+    start = time.time()
+    apis = RUNNING_APIS if apis is None else apis
+    # clients are created upfront, as creating them from the shared boto3 session is not thread-safe
+    resets = {
+        'lambda': lambda_api.cleanup,
+        'firehose': firehose_api.cleanup,
+        'dynamodbstreams': dynamodbstreams_api.cleanup,
+        'dynamodb': reset_dynamodb,
+        'kinesis': reset_kinesis,
+        's3': reset_s3,
+        'es': aws_stack.delete_all_elasticsearch_indices
+    }
+    tasks = []
+    names = []
+    for api, reset in resets.items():
+        if api not in apis:
+            continue
+        if not is_backend_running(api):
+            # nothing to reset for a backend that has not been started yet
+            continue
+        if api in ['dynamodb', 'kinesis']:
+            client = aws_stack.connect_to_service(api, env=ENV_DEV)
+            tasks.append(lambda reset=reset, client=client: reset(client))
+        elif api == 's3':
+            resource = aws_stack.connect_to_resource(api, env=ENV_DEV)
+            tasks.append(lambda reset=reset, resource=resource: reset(resource))
+        else:
+            tasks.append(reset)
+        names.append(api)
+    errors = parallelize(run_reset_task, tasks) if tasks else []
+    errors = ['%s: %s' % (api, error) for api, error in zip(names, errors) if error]
+    if errors:
+        raise Exception('Unable to reset the local environment - %s' % '; '.join(errors))
+    print('Reset of local environment done after %.2f secs' % (time.time() - start))
+
+
+def run_reset_task(task):
+    """ Run the given reset task, and return its error (if any) - so that the other tasks are not cut short. """
+    try:
+        task()
+    except Exception, e:
+        return e
+
+
+@infra_app.route('/reset', methods=['POST'])
+def reset_request():
+    data = json.loads(request.data or '{}')
+    try:
+        reset_infra(apis=data.get('apis'))
+    except Exception, e:
+        response = jsonify({'message': str(e)})
+        response.status_code = 500
+        return response
+    return jsonify({})
+
+
+@infra_app.route('/stats', methods=['GET'])
+def stats_request():
+    result = {
+        'proxies': get_proxy_stats(),
+        'dynamodb_item_cache': DYNAMODB_ITEM_CACHE.stats(),
+        'kinesis_lambda_lag': lambda_api.get_kinesis_dispatch_stats(),
+        'lambda_code_store': lambda_api.code_store.stats()
+    }
+    return jsonify(result)
+
+
+def serve_infra_api(port, quiet=True):
+    if quiet:
+        log = logging.getLogger('werkzeug')
+        log.setLevel(logging.ERROR)
+    infra_app.run(port=int(port), threaded=True, host='0.0.0.0')
+
+
 def check_infra_kinesis(expect_shutdown=False):
     out = None
     try:
@@ -183,7 +450,7 @@ def check_infra_elasticsearch(expect_shutdown=False):
         assert isinstance(out, list)
 
 
-def check_infra(retries=5, expect_shutdown=False, apis=None, additional_checks=[]):
+def check_infra(retries=5, expect_shutdown=False, apis=None, additional_checks=[], sleep=0.5):
     try:
         # check Kinesis
         if apis is None or 'kinesis' in apis:
@@ -203,13 +470,65 @@ def check_infra(retries=5, expect_shutdown=False, apis=None, additional_checks=[
         if retries <= 0:
             print('ERROR checking state of local environment (after some retries): %s' % traceback.format_exc(e))
             raise e
-        time.sleep(3)
-        check_infra(retries - 1, expect_shutdown=expect_shutdown, apis=apis, additional_checks=additional_checks)
+        time.sleep(min(sleep, 3))
+        check_infra(retries - 1, expect_shutdown=expect_shutdown, apis=apis,
+            additional_checks=additional_checks, sleep=sleep * 2)
+
+
+def probe_service(api, port=None):
+    """ Send a lightweight request to the given API (on its public port, unless `port` is given)
+        and return True if it responds with HTTP code 200. """
+    path, target = READINESS_PROBES[api]
+    url = 'http://%s:%s%s' % (LOCALHOST, port or SERVICE_PORTS[api], path)
+    try:
+        if target:
+            headers = aws_stack.mock_aws_request_headers(service=api)
+            headers['X-Amz-Target'] = target
+            response = requests.post(url, data='{}', headers=headers, timeout=READINESS_PROBE_TIMEOUT)
+        else:
+            response = requests.get(url, timeout=READINESS_PROBE_TIMEOUT)
+        return response.status_code == 200
+    except requests.exceptions.RequestException, e:
+        return False
+
+
+def wait_for_service(api, timeout=READINESS_TIMEOUT, port=None):
+    """ Poll the given API until it is ready, starting with a short interval that grows on every
+        unsuccessful attempt (fast services are picked up quickly, slow ones are not hammered). """
+    if api not in READINESS_PROBES:
+        return
+    if not wait_until(lambda: probe_service(api, port=port), timeout=timeout):
+        raise Exception('Service "%s" not ready after %s secs' % (api, timeout))
+
+
+def wait_until(condition, timeout=READINESS_TIMEOUT):
+    """ Call `condition` until it returns True (or the timeout expires), polling at an interval which grows
+        on every unsuccessful attempt. Return whether the condition has been met. """
+    start = time.time()
+    interval = READINESS_POLL_INTERVAL
+    while not condition():
+        if time.time() - start > timeout:
+            return False
+        time.sleep(interval)
+        interval = min(interval * READINESS_POLL_BACKOFF, READINESS_POLL_MAX_INTERVAL)
+    return True
+
+
+def start_service(api, start_func):
+    """ Start a service via `start_func`, wait until it is ready, and record the startup time. """
+    start = time.time()
+    thread = start_func()
+    wait_for_service(api)
+    SERVICE_STARTUP_TIMES[api] = time.time() - start
+    return thread
 
 
 def start_infra(async=False, dynamodb_update_listener=None, kinesis_update_listener=None,
-        apigateway_update_listener=None,
+        apigateway_update_listener=None, proxy_settings={}, lazy=False,
         apis=['s3', 'es', 'apigateway', 'dynamodb', 'kinesis', 'dynamodbstreams', 'firehose', 'lambda']):
+    """ Start the local infrastructure. The optional dict `proxy_settings` maps API names to additional
+        GenericProxy arguments, e.g., {'kinesis': {'engine': generic_proxy.ENGINE_ASYNC, 'max_concurrent': 10}}.
+        If `lazy` is set, only the proxies are started, and each backend is started on its first request. """
     try:
         if not dynamodb_update_listener:
             dynamodb_update_listener = update_dynamodb
@@ -220,30 +539,41 @@ def start_infra(async=False, dynamodb_update_listener=None, kinesis_update_liste
         # set environment
         os.environ['AWS_REGION'] = DEFAULT_REGION
         os.environ['ENV'] = ENV_DEV
-        # start services
-        thread = None
+        # start services (in parallel, in the order given by `apis`)
+        services = {
+            'es': lambda: start_elasticsearch(async=True, lazy=lazy),
+            's3': lambda: start_s3(async=True, lazy=lazy),
+            'apigateway': lambda: start_apigateway(async=True, update_listener=apigateway_update_listener,
+                proxy_settings=proxy_settings.get('apigateway', {}), lazy=lazy),
+            'dynamodb': lambda: start_dynalite(async=True, update_listener=dynamodb_update_listener,
+                proxy_settings=proxy_settings.get('dynamodb', {}), lazy=lazy),
+            'dynamodbstreams': lambda: start_dynamodbstreams(async=True, lazy=lazy),
+            'firehose': lambda: start_firehose(async=True, lazy=lazy),
+            'lambda': lambda: start_lambda(async=True, lazy=lazy),
+            'kinesis': lambda: start_kinesalite(async=True, update_listener=kinesis_update_listener,
+                proxy_settings=proxy_settings.get('kinesis', {}), lazy=lazy)
+        }
+        apis = [api for api in apis if api in services]
         if 'es' in apis:
             # delete Elasticsearch data that may be cached locally from a previous test run
             aws_stack.delete_all_elasticsearch_data()
-            thread = start_elasticsearch(async=True)
-        if 's3' in apis:
-            thread = start_s3(async=True)
-        if 'apigateway' in apis:
-            thread = start_apigateway(async=True, update_listener=apigateway_update_listener)
-        if 'dynamodb' in apis:
-            thread = start_dynalite(async=True, update_listener=dynamodb_update_listener)
-        if 'dynamodbstreams' in apis:
-            thread = start_dynamodbstreams(async=True)
-        if 'firehose' in apis:
-            thread = start_firehose(async=True)
-        if 'lambda' in apis:
-            thread = start_lambda(async=True)
-        if 'kinesis' in apis:
-            thread = start_kinesalite(async=True, update_listener=kinesis_update_listener)
-        # Elasticsearch and S3 take a bit to come up
-        time.sleep(3)
-        # check that all infra components are up and running
-        check_infra(apis=apis)
+        RUNNING_APIS.update(apis)
+        # management API, e.g., to reset the state of the running services
+        start_server(serve_infra_api, DEFAULT_PORT_INFRA)
+        thread = None
+        if lazy:
+            # only the proxies are started here, hence don't probe (which would start the backends)
+            for api in apis:
+                thread = services[api]()
+        elif apis:
+            SERVICE_STARTUP_TIMES.clear()
+            start = time.time()
+            thread = parallelize(lambda api: start_service(api, services[api]), apis)[-1]
+            for api in apis:
+                print('Service "%s" ready after %.2f secs' % (api, SERVICE_STARTUP_TIMES[api]))
+            print('All services ready after %.2f secs' % (time.time() - start))
+            # check that all infra components are up and running
+            check_infra(apis=apis)
         if not async and thread:
             thread.join()
         return thread
@@ -254,99 +584,312 @@ def start_infra(async=False, dynamodb_update_listener=None, kinesis_update_liste
             stop_infra()
 
 
+# API Gateway request paths handled by the proxy listener
+PATH_REGEX_DEPLOYMENTS = r'^/restapis/[A-Za-z0-9\-]+/deployments$'
+PATH_REGEX_USER_REQUEST = r'^/restapis/([A-Za-z0-9_\-]+)/([A-Za-z0-9_\-]+)/%s/([^/]+)$' % PATH_USER_REQUEST
+PATH_REGEX_RESOURCES = r'^/restapis/([A-Za-z0-9_\-]+)(/resources(/.*)?)?$'
+# API Gateway integration URIs of Lambda functions, and of service actions (e.g., Kinesis PutRecords)
+APIGATEWAY_LAMBDA_URI = r'^arn:aws:apigateway:[^:]*:lambda:path/[^/]+/functions/(.+)/invocations$'
+APIGATEWAY_ACTION_URI = r'^arn:aws:apigateway:[^:]*:([^:]+):action/(.+)$'
+# X-Amz-Target prefixes of the services which API Gateway integrations are dispatched to
+APIGATEWAY_TARGET_PREFIXES = {
+    'kinesis': 'Kinesis_20131202',
+    'dynamodb': 'DynamoDB_20120810'
+}
+
+
+@listener_for(paths=[PATH_REGEX_DEPLOYMENTS, PATH_REGEX_USER_REQUEST, PATH_REGEX_RESOURCES])
 def update_apigateway(method, path, data, headers, response=None, return_forward_info=False):
+    if method != 'GET' and re.match(PATH_REGEX_RESOURCES, path):
+        # resources, methods, or integrations of the API are changed (invalidate before and after the change)
+        invalidate_apigateway_integrations(re.match(PATH_REGEX_RESOURCES, path).group(1))
+        return True if return_forward_info else None
+
     if return_forward_info:
         # print('%s %s' % (method, path))
-        regex1 = r'^/restapis/[A-Za-z0-9\-]+/deployments$'
+        regex1 = PATH_REGEX_DEPLOYMENTS
         if method == 'POST' and re.match(regex1, path):
             # this is a request to deploy the API gateway, simply return HTTP code 200
             return 200
 
-        regex2 = r'^/restapis/([A-Za-z0-9_\-]+)/([A-Za-z0-9_\-]+)/%s/([^/]+)$' % PATH_USER_REQUEST
+        regex2 = PATH_REGEX_USER_REQUEST
         if method == 'POST' and re.match(regex2, path):
             api_id = re.search(regex2, path).group(1)
             sub_path = '/%s' % re.search(regex2, path).group(3)
-            integration = aws_stack.get_apigateway_integration(api_id, method, sub_path)
-            template = integration['requestTemplates'][APPLICATION_JSON]
-            new_request = aws_stack.render_velocity_template(template, data)
-
-            # forward records to our main kinesis stream
-            # TODO check whether the target of this API method is 'kinesis'
-            headers = aws_stack.mock_aws_request_headers(service='kinesis')
-            headers['X-Amz-Target'] = 'Kinesis_20131202.PutRecords'
-            result = make_request(TEST_KINESIS_URL, method='POST', data=new_request, headers=headers)
-            return 200
+            integration = get_apigateway_integration(api_id, method, sub_path)
+            return apigateway_dispatch(integration, data)
         return True
 
 
+def apigateway_dispatch(integration, data):
+    """ Send the request of an API Gateway user request to the target of the integration, within this
+        process, and return the result of the integration as response for the client. """
+    uri = integration.get('uri') or ''
+    template = (integration.get('requestTemplates') or {}).get(APPLICATION_JSON)
+    new_request = aws_stack.render_velocity_template(template, data) if template else json.dumps(data)
+
+    match = re.match(APIGATEWAY_LAMBDA_URI, uri)
+    if match:
+        return apigateway_invoke_lambda(match.group(1), json.loads(new_request))
+    match = re.match(APIGATEWAY_ACTION_URI, uri)
+    service, action = match.groups() if match else ('kinesis', 'PutRecords')
+    if service not in APIGATEWAY_TARGET_PREFIXES:
+        return build_response(501, 'Not Implemented', [], 'Unsupported integration URI: %s' % uri)
+    headers = aws_stack.mock_aws_request_headers(service=service)
+    headers['X-Amz-Target'] = '%s.%s' % (APIGATEWAY_TARGET_PREFIXES[service], action)
+    proxy = PROXIES.get(service)
+    if not proxy:
+        url = TEST_KINESIS_URL if service == 'kinesis' else TEST_DYNAMODB_URL
+        return make_request(url, method='POST', data=new_request, headers=headers)
+    return proxy.invoke('POST', '/', proxy.parse_data('POST', new_request), headers)
+
+
+def apigateway_invoke_lambda(function_arn, event):
+    headers = [('Content-Type', APPLICATION_JSON)]
+    try:
+        result = lambda_api.invoke_function(function_arn, event)
+    except Exception, e:
+        content = json.dumps({'message': 'Internal server error'})
+        return build_response(502, 'Bad Gateway', headers, content)
+    if isinstance(result, dict) and 'statusCode' in result:
+        # response in the format of a Lambda proxy integration
+        headers.extend((result.get('headers') or {}).items())
+        status = int(result['statusCode'])
+        return build_response(status, status_reason(status), headers, result.get('body') or '')
+    return build_response(200, 'OK', headers, json.dumps(result))
+
+
+def get_apigateway_integration(api_id, method, path):
+    key = (api_id, method, path)
+    integration = APIGATEWAY_INTEGRATIONS.get(key)
+    if integration:
+        return integration
+    generation = APIGATEWAY_GENERATIONS.get(api_id, 0)
+    integration = aws_stack.get_apigateway_integration(api_id, method, path,
+        apigateway=get_apigateway_client())
+    with APIGATEWAY_LOCK:
+        if APIGATEWAY_GENERATIONS.get(api_id, 0) == generation:
+            APIGATEWAY_INTEGRATIONS[key] = integration
+    return integration
+
+
+def invalidate_apigateway_integrations(api_id):
+    with APIGATEWAY_LOCK:
+        APIGATEWAY_GENERATIONS[api_id] = APIGATEWAY_GENERATIONS.get(api_id, 0) + 1
+        for key in APIGATEWAY_INTEGRATIONS.keys():
+            if key[0] == api_id:
+                del APIGATEWAY_INTEGRATIONS[key]
+
+
+def get_apigateway_client():
+    # boto3 clients are thread-safe, but creating them (from the default session) is not
+    global APIGATEWAY_CLIENT
+    if not APIGATEWAY_CLIENT:
+        with APIGATEWAY_LOCK:
+            if not APIGATEWAY_CLIENT:
+                APIGATEWAY_CLIENT = aws_stack.connect_to_service('apigateway')
+    return APIGATEWAY_CLIENT
+
+
+def kinesis_listener_key(invocation):
+    """ Queued invocations of update_kinesis(..) for the same stream are run in order. """
+    data = invocation['data']
+    return data.get('StreamName') if isinstance(data, dict) else None
+
+
+@listener_for(targets=['Kinesis_20131202.PutRecord', 'Kinesis_20131202.PutRecords',
+    'Kinesis_20131202.DeleteStream'], key=kinesis_listener_key)
 def update_kinesis(method, path, data, headers, response=None, return_forward_info=False):
     if return_forward_info:
         return True
 
+    if response is None or response.status_code != 200:
+        return
     action = headers['X-Amz-Target'] if 'X-Amz-Target' in headers else None
-    if action == 'Kinesis_20131202.PutRecord':
-        record = {
-            'data': data['Data'],
-            'partitionKey': data['PartitionKey']
-        }
-        records = [record]
-        stream_name = data['StreamName']
-        lambda_api.process_kinesis_records(records, stream_name)
-    elif action == 'Kinesis_20131202.PutRecords':
-        records = []
-        for record in data['Records']:
-            record = {
-                'data': record['Data'],
-                'partitionKey': record['PartitionKey']
-            }
-            records.append(record)
-        stream_name = data['StreamName']
-        lambda_api.process_kinesis_records(records, stream_name)
+    if action in ('Kinesis_20131202.PutRecord', 'Kinesis_20131202.PutRecords'):
+        # the records are delivered to the Lambda functions by the pollers of the stream
+        lambda_api.wake_kinesis_pollers(data['StreamName'])
+    elif action == 'Kinesis_20131202.DeleteStream':
+        # a stream re-created with the same name starts with new sequence numbers
+        lambda_api.kinesis_checkpoints.clear(data['StreamName'])
+
+
+def dynamodb_stream_view_type(table_name):
+    """ Return the stream view type of the given table, or None if the table has no enabled stream or no
+        event source mappings - then, no stream records are emitted, and no item images are required. """
+    if not table_name or not lambda_api.get_event_sources(source_arn=aws_stack.dynamodb_table_arn(table_name)):
+        return None
+    table = DYNAMODB_TABLES.get(table_name)
+    return table and table.stream_view_type
+
+
+def dynamodb_return_values(action, table_name):
+    """ Return the `ReturnValues` to request from the backend for the given write action, such
+        that the response contains the item image required by the table's stream view type. """
+    return_values = STREAM_RETURN_VALUES.get(action)
+    return return_values and return_values.get(dynamodb_stream_view_type(table_name))
 
 
+def dynamodb_strip_return_values(response, *args, **kwargs):
+    """ Remove the item image (requested by the proxy, not by the client) from a backend response. """
+    if response.status_code != 200:
+        return
+    content = json.loads(response.content)
+    content.pop('Attributes', None)
+    content = json.dumps(content)
+    headers = response.headers.copy()
+    # the client verifies the checksum of the (now modified) response body
+    headers['x-amz-crc32'] = str(zlib.crc32(content) & 0xffffffff)
+    return build_response(response.status_code, response.reason, headers, content, url=response.url)
+
+
+def dynamodb_prefetch_item(data):
+    """ Make sure the item to be updated is in the cache, if its old image is required for the stream record
+        (the backend only returns one image per request). On a cache miss, the item is read from the backend. """
+    table_name = data.get('TableName')
+    if dynamodb_stream_view_type(table_name) != 'NEW_AND_OLD_IMAGES' or 'Key' not in data:
+        return
+    if DYNAMODB_ITEM_CACHE.get(table_name, data['Key']) is not MISSING:
+        return
+    item = aws_stack.dynamodb_get_item_raw(TEST_DYNAMODB_URL, {'TableName': table_name, 'Key': data['Key']})
+    if '__type' not in item:
+        DYNAMODB_ITEM_CACHE.put(table_name, data['Key'], item.get('Item'))
+
+
+def dynamodb_prefetch_batch_items(data):
+    """ Make sure the items written via BatchWriteItem are in the cache, as BatchWriteItem cannot return the
+        old images (which tell apart INSERT and MODIFY records). The cache misses are read with one BatchGetItem. """
+    request_items = {}
+    for table_name, write_requests in data.get('RequestItems', {}).items():
+        if not dynamodb_stream_view_type(table_name):
+            continue
+        table = DYNAMODB_TABLES.get(table_name)
+        keys = [dynamodb_write_request_keys(table, write_request) for write_request in write_requests]
+        keys = [k for k in keys if k and DYNAMODB_ITEM_CACHE.get(table_name, k) is MISSING]
+        if keys:
+            request_items[table_name] = {'Keys': keys}
+    if not request_items:
+        return
+    result = aws_stack.dynamodb_batch_get_item_raw(TEST_DYNAMODB_URL, {'RequestItems': request_items})
+    if '__type' in result:
+        return
+    unprocessed = result.get('UnprocessedKeys') or {}
+    for table_name, request in request_items.items():
+        table = DYNAMODB_TABLES.get(table_name)
+        items = dict((json.dumps(table.extract_keys(item), sort_keys=True), item)
+            for item in result.get('Responses', {}).get(table_name, []))
+        skip = set(json.dumps(k, sort_keys=True) for k in unprocessed.get(table_name, {}).get('Keys', []))
+        for keys in request['Keys']:
+            key = json.dumps(keys, sort_keys=True)
+            if key not in skip:
+                # items which have not been returned do not exist
+                DYNAMODB_ITEM_CACHE.put(table_name, keys, items.get(key))
+
+
+def dynamodb_listener_key(invocation):
+    """ Queued invocations of update_dynamodb(..) for the same table are run in order, to assign the sequence
+        numbers and cache the item images in write order. A BatchWriteItem is routed by the first of its
+        (sorted) table names, hence it is ordered with the writes to that table only. """
+    data = invocation['data']
+    if not isinstance(data, dict):
+        return None
+    if 'RequestItems' in data:
+        return min(data['RequestItems'].keys() or [None])
+    return data.get('TableName')
+
+
+@listener_for(targets=['DynamoDB_20120810.PutItem', 'DynamoDB_20120810.UpdateItem',
+    'DynamoDB_20120810.DeleteItem', 'DynamoDB_20120810.BatchWriteItem', 'DynamoDB_20120810.CreateTable',
+    'DynamoDB_20120810.UpdateTable', 'DynamoDB_20120810.DeleteTable'], key=dynamodb_listener_key)
 def update_dynamodb(method, path, data, headers, response=None, return_forward_info=False):
+    action = headers['X-Amz-Target'] if 'X-Amz-Target' in headers else None
+
     if return_forward_info:
+        if isinstance(data, dict) and action == 'DynamoDB_20120810.UpdateItem':
+            dynamodb_prefetch_item(data)
+        if isinstance(data, dict) and action == 'DynamoDB_20120810.BatchWriteItem':
+            dynamodb_prefetch_batch_items(data)
+        if isinstance(data, dict) and data.get('ReturnValues', 'NONE') == 'NONE':
+            # let the backend return the item image for the stream record, instead of reading it separately
+            return_values = dynamodb_return_values(action, data.get('TableName'))
+            if return_values:
+                data = dict(data, ReturnValues=return_values)
+                return requests.models.Request(data=data, hooks={'response': dynamodb_strip_return_values})
         return True
 
-    # update table definitions
-    if data and 'TableName' in data and 'KeySchema' in data:
-        TABLE_DEFINITIONS[data['TableName']] = data
+    if response.status_code != 200:
+        return
+
+    # update table metadata
+    if action == 'DynamoDB_20120810.CreateTable':
+        DYNAMODB_TABLES.put(data)
+    elif action in ['DynamoDB_20120810.UpdateTable', 'DynamoDB_20120810.DeleteTable']:
+        DYNAMODB_TABLES.invalidate(data['TableName'])
+        if action == 'DynamoDB_20120810.DeleteTable':
+            DYNAMODB_ITEM_CACHE.clear(data['TableName'])
+        return
 
-    action = headers['X-Amz-Target'] if 'X-Amz-Target' in headers else None
     response_data = json.loads(response.text)
-    record = {
-        "eventID": "1",
-        "eventVersion": "1.0",
-        "dynamodb": {
-            "StreamViewType": "NEW_AND_OLD_IMAGES",
-            "SequenceNumber": "1",
-            "SizeBytes": -1
-        },
-        "awsRegion": DEFAULT_REGION,
-        "eventSource": "aws:dynamodb"
-    }
-    event = {
-        'Records': [record]
-    }
+    if action == 'DynamoDB_20120810.BatchWriteItem':
+        dynamodb_process_batch_write(data, response_data)
+        return
+
+    table_name = data.get('TableName')
+    view_type = dynamodb_stream_view_type(table_name)
+    keys = data.get('Key')
+    if action == 'DynamoDB_20120810.PutItem':
+        keys = dynamodb_extract_keys(item=data['Item'], table_name=table_name)
+    if not view_type and action in DYNAMODB_ITEM_ACTIONS:
+        # no stream records to emit - only forget the (now outdated) cached image of the item
+        if keys:
+            DYNAMODB_ITEM_CACHE.remove(table_name, keys)
+        return
+
+    # item image returned by the backend (either requested by the client, or by the proxy - see above)
+    return_values = data.get('ReturnValues', 'NONE')
+    if return_values == 'NONE':
+        return_values = dynamodb_return_values(action, table_name)
+    attributes = response_data.get('Attributes')
+    new_image = attributes if return_values == 'ALL_NEW' else None
+    old_image = attributes if return_values == 'ALL_OLD' else None
+    # whether the old image is known (None if the item did not exist before)
+    old_known = return_values == 'ALL_OLD'
+    if not old_known and keys and action in DYNAMODB_ITEM_ACTIONS:
+        cached = DYNAMODB_ITEM_CACHE.peek(table_name, keys)
+        if cached is not MISSING:
+            old_image, old_known = cached, True
 
     if action == 'DynamoDB_20120810.UpdateItem':
-        req = {'TableName': data['TableName']}
-        req['Key'] = data['Key']
-        new_item = aws_stack.dynamodb_get_item_raw(TEST_DYNAMODB_URL, req)
-        if 'Item' not in new_item:
-            return
-        record['eventName'] = 'MODIFY'
-        record['dynamodb']['Keys'] = data['Key']
-        record['dynamodb']['NewImage'] = new_item['Item']
+        if new_image is None and view_type in ['NEW_IMAGE', 'NEW_AND_OLD_IMAGES']:
+            # the client requested other return values, hence fall back to reading the item
+            req = {'TableName': data['TableName']}
+            req['Key'] = data['Key']
+            new_item = aws_stack.dynamodb_get_item_raw(TEST_DYNAMODB_URL, req)
+            if 'Item' not in new_item:
+                DYNAMODB_ITEM_CACHE.put(table_name, keys, None)
+                return
+            new_image = new_item['Item']
+        # UpdateItem creates the item if it does not exist yet
+        event_name = 'INSERT' if old_known and old_image is None else 'MODIFY'
+        if new_image is not None:
+            DYNAMODB_ITEM_CACHE.put(table_name, keys, new_image)
+        else:
+            DYNAMODB_ITEM_CACHE.remove(table_name, keys)
     elif action == 'DynamoDB_20120810.PutItem':
-        record['eventName'] = 'INSERT'
-        keys = dynamodb_extract_keys(item=data['Item'], table_name=data['TableName'])
-        record['dynamodb']['Keys'] = keys
-        record['dynamodb']['NewImage'] = data['Item']
+        # an existing item has been replaced if it has an old image
+        event_name = 'MODIFY' if old_image else 'INSERT'
+        new_image = data['Item']
+        if keys:
+            DYNAMODB_ITEM_CACHE.put(table_name, keys, new_image)
     elif action == 'DynamoDB_20120810.DeleteItem':
-        record['eventName'] = 'REMOVE'
-        record['dynamodb']['Keys'] = data['Key']
+        event_name = 'REMOVE'
+        DYNAMODB_ITEM_CACHE.put(table_name, keys, None)
+        if old_known and old_image is None:
+            # deleting an item that does not exist does not produce a stream record
+            return
     elif action == 'DynamoDB_20120810.CreateTable':
+        # forget items of a previous table with the same name
+        DYNAMODB_ITEM_CACHE.clear(table_name)
         if 'StreamSpecification' in data:
             stream = data['StreamSpecification']
             enabled = stream['StreamEnabled']
@@ -359,13 +902,94 @@ def update_dynamodb(method, path, data, headers, response=None, return_forward_i
     else:
         # nothing to do
         return
-    record['eventSourceARN'] = aws_stack.dynamodb_table_arn(data['TableName'])
-    sources = lambda_api.get_event_sources(source_arn=record['eventSourceARN'])
-    if len(sources) > 0:
-        pass
-    for src in sources:
-        func_to_call = lambda_api.lambda_arn_to_function[src['FunctionArn']]
-        lambda_api.run_lambda(func_to_call, event=event, context={})
+    record = dynamodb_stream_record(event_name, keys, view_type, new_image=new_image, old_image=old_image)
+    dynamodb_send_stream_records(table_name, [record])
+
+
+def dynamodb_process_batch_write(data, response_data):
+    """ Emit stream records for the items written via BatchWriteItem (skipping the items that the
+        backend returned as unprocessed), and hand them to the stream listeners as one batch per table. """
+    unprocessed = response_data.get('UnprocessedItems') or {}
+    for table_name, write_requests in data.get('RequestItems', {}).items():
+        table = DYNAMODB_TABLES.get(table_name)
+        if not table:
+            continue
+        view_type = dynamodb_stream_view_type(table_name)
+        if not view_type:
+            # no stream records to emit - only forget the (now outdated) cached images of the items
+            for write_request in write_requests:
+                keys = dynamodb_write_request_keys(table, write_request)
+                if keys:
+                    DYNAMODB_ITEM_CACHE.remove(table_name, keys)
+            continue
+        # the write requests are only serialized (for comparison) if the table has unprocessed items
+        skip = set(json.dumps(req, sort_keys=True) for req in unprocessed.get(table_name, []))
+        records = []
+        for write_request in write_requests:
+            if skip and json.dumps(write_request, sort_keys=True) in skip:
+                continue
+            keys = dynamodb_write_request_keys(table, write_request)
+            if not keys:
+                continue
+            new_image = write_request['PutRequest']['Item'] if 'PutRequest' in write_request else None
+            cached = DYNAMODB_ITEM_CACHE.peek(table_name, keys)
+            DYNAMODB_ITEM_CACHE.put(table_name, keys, new_image)
+            old_image = None if cached is MISSING else cached
+            if new_image is None:
+                if cached is None:
+                    # deleting an item that does not exist does not produce a stream record
+                    continue
+                event_name = 'REMOVE'
+            else:
+                # if the old image is unknown (see dynamodb_prefetch_batch_items), the item may have existed
+                event_name = 'INSERT' if cached is None else 'MODIFY'
+            records.append(dynamodb_stream_record(event_name, keys, view_type,
+                new_image=new_image, old_image=old_image))
+        if records:
+            dynamodb_send_stream_records(table_name, records)
+
+
+def dynamodb_write_request_keys(table, write_request):
+    if 'PutRequest' in write_request:
+        return table.extract_keys(write_request['PutRequest']['Item'])
+    if 'DeleteRequest' in write_request:
+        return write_request['DeleteRequest']['Key']
+
+
+def dynamodb_stream_record(event_name, keys, view_type, new_image=None, old_image=None):
+    record = {
+        "eventID": uuid.uuid4().hex,
+        "eventName": event_name,
+        "eventVersion": "1.0",
+        "dynamodb": {
+            "Keys": keys,
+            "StreamViewType": view_type,
+            "SizeBytes": -1
+        },
+        "awsRegion": DEFAULT_REGION,
+        "eventSource": "aws:dynamodb"
+    }
+    if new_image is not None and view_type in ['NEW_IMAGE', 'NEW_AND_OLD_IMAGES']:
+        record['dynamodb']['NewImage'] = new_image
+    if old_image is not None and view_type in ['OLD_IMAGE', 'NEW_AND_OLD_IMAGES']:
+        record['dynamodb']['OldImage'] = old_image
+    return record
+
+
+def dynamodb_send_stream_records(table_name, records):
+    table_arn = aws_stack.dynamodb_table_arn(table_name)
+    # assign the sequence numbers and enqueue the records atomically, to preserve the order of the records
+    with DYNAMODB_STREAM_LOCK:
+        for record in records:
+            record['eventSourceARN'] = table_arn
+            record['dynamodb']['SequenceNumber'] = dynamodb_next_sequence_number(table_name)
+        lambda_api.process_stream_records(records, table_arn)
+
+
+def dynamodb_next_sequence_number(table_name):
+    number = DYNAMODB_SEQUENCE_NUMBERS.get(table_name, 0) + 1
+    DYNAMODB_SEQUENCE_NUMBERS[table_name] = number
+    return '%021d' % number
 
 
 def make_request(url, headers, data, method='GET'):
@@ -380,15 +1004,16 @@ def make_request(url, headers, data, method='GET'):
     return method(url, headers=headers, data=data, auth=NetrcBypassAuth())
 
 
-def dynamodb_extract_keys(item, table_name):
-    result = {}
-    if table_name not in TABLE_DEFINITIONS:
-        print("WARN: unknown table: %s not found in %s" % (table_name, TABLE_DEFINITIONS))
+def dynamodb_describe_table(table_name):
+    try:
+        return aws_stack.dynamodb_describe_table_raw(TEST_DYNAMODB_URL, table_name).get('Table')
+    except Exception, e:
         return None
-    for key in TABLE_DEFINITIONS[table_name]['KeySchema']:
-        attr_name = key['AttributeName']
-        result[attr_name] = item[attr_name]
-    return result
+
+
+def dynamodb_extract_keys(item, table_name):
+    table = DYNAMODB_TABLES.get(table_name)
+    return table.extract_keys(item) if table else None
 
 
 if __name__ == '__main__':
@@ -7,18 +7,21 @@ import time
 import traceback
 import logging
 import base64
+import hashlib
 import threading
+import Queue
 from flask import Flask, jsonify, request
 from datetime import datetime
+from botocore.exceptions import ClientError
 from localstack.constants import *
 from localstack.utils.common import *
 from localstack.utils.aws import aws_stack
+from localstack.mock.lambda_namespace import FunctionNamespace, NAMESPACE_ATTRIBUTE
+from localstack.mock import lambda_process, lambda_code
 
 
 APP_NAME = 'lambda_mock'
 PATH_ROOT = '/2015-03-31'
-ARCHIVE_FILE_PATTERN = '/tmp/lambda.handler.*.jar'
-EVENT_FILE_PATTERN = '/tmp/lambda.event.*.json'
 LAMBDA_EXECUTOR_JAR = os.path.join(LOCALSTACK_ROOT_FOLDER, 'localstack',
     'mock', 'target', 'lambda-executor-1.0-SNAPSHOT.jar')
 LAMBDA_EXECUTOR_CLASS = 'com.atlassian.LambdaExecutor'
@@ -32,21 +35,490 @@ lambda_arn_to_handler = {}
 
 # list of event source mappings for the API
 event_source_mappings = []
+# index of the event source mappings by UUID, by source ARN (see source_arn_key(..)), and by function ARN.
+# The lists in the indexes are replaced (not modified) on updates, hence they can be read without locking.
+event_sources_by_uuid = {}
+event_sources_by_source = {}
+event_sources_by_function = {}
+event_sources_lock = threading.RLock()
+
+# default max. number of records per function invocation for event source mappings
+DEFAULT_BATCH_SIZE = 100
+# max. time (secs) to collect stream records before invoking a function with a partial batch
+STREAM_BATCH_WINDOW = 0.2
+
+# collectors of stream records, by UUID of the event source mapping
+stream_batchers = {}
+stream_batchers_lock = threading.Lock()
+
+# number of worker threads which invoke the functions subscribed to Kinesis streams
+KINESIS_DISPATCH_WORKERS = int(os.environ.get('KINESIS_DISPATCH_WORKERS', 8))
+# dispatcher of Kinesis records to the subscribed functions (see ShardDispatcher)
+kinesis_dispatcher = None
+kinesis_dispatcher_lock = threading.Lock()
+
+# default position in the shards at which Kinesis pollers start reading, if there is no checkpoint
+DEFAULT_STARTING_POSITION = 'TRIM_HORIZON'
+# file with the checkpoints (last delivered sequence numbers) of the Kinesis pollers
+KINESIS_CHECKPOINT_FILE = '/tmp/localstack.kinesis.checkpoints.json'
+# max. time (secs) between a change of the checkpoints and writing them to the file
+KINESIS_CHECKPOINT_SAVE_INTERVAL = 1
+# min. and max. interval (secs) between two polls of an idle Kinesis shard, and backoff factor
+KINESIS_POLL_MIN_INTERVAL = 0.1
+KINESIS_POLL_MAX_INTERVAL = 2
+KINESIS_POLL_BACKOFF = 2
+# interval (secs) after which the pollers refresh the list of shards of their stream
+KINESIS_SHARDS_REFRESH_INTERVAL = 10
+# pollers of Kinesis streams, by UUID of the event source mapping
+kinesis_pollers = {}
+kinesis_client = None
+kinesis_client_lock = threading.Lock()
 
 # logger
 LOG = logging.getLogger(__name__)
 
-# mutex for access to CWD
+# runtime of Python functions: 'local' (exec'd into this process), or 'process' (pool of warm worker processes)
+LAMBDA_EXECUTOR = os.environ.get('LAMBDA_EXECUTOR', 'local')
+LAMBDA_EXECUTOR_LOCAL = 'local'
+LAMBDA_EXECUTOR_PROCESS = 'process'
+# settings of the worker process pools: max. processes per function, invocations and memory (MB) per process
+LAMBDA_PROCESS_POOL_SIZE = int(os.environ.get('LAMBDA_PROCESS_POOL_SIZE', lambda_process.DEFAULT_POOL_SIZE))
+LAMBDA_PROCESS_MAX_INVOCATIONS = int(os.environ.get('LAMBDA_PROCESS_MAX_INVOCATIONS',
+    lambda_process.DEFAULT_MAX_INVOCATIONS))
+LAMBDA_PROCESS_MAX_MEMORY = int(os.environ.get('LAMBDA_PROCESS_MAX_MEMORY', lambda_process.DEFAULT_MAX_MEMORY))
+# worker process pools, by function ARN
+lambda_process_pools = {}
+
+# number of background workers which load the code of deployed functions before their first invocation
+# (by default, the code of a function is only loaded on its first invocation)
+LAMBDA_PREWARM_WORKERS = int(os.environ.get('LAMBDA_PREWARM_WORKERS', 0))
+prewarm_queue = None
+lambda_load_lock = threading.RLock()
+
+# store of the function code, shared by functions with identical code
+LAMBDA_CODE_DISK_QUOTA = int(os.environ.get('LAMBDA_CODE_DISK_QUOTA', lambda_code.DEFAULT_DISK_QUOTA))
+code_store = lambda_code.CodeStore(disk_quota=LAMBDA_CODE_DISK_QUOTA)
+
+# mutex for access to CWD (only used for functions which are not run in their own FunctionNamespace)
 cwd_mutex = threading.Semaphore(1)
 
 
-def cleanup():
+class StreamBatcher(object):
+    """ Collects the stream records for an event source mapping, and invokes the function with batches of up
+        to `BatchSize` records, once the batch is full or `window` secs after its first record arrived.
+        Batches are processed one at a time, hence the function sees the records in the order they were put. """
+
+    def __init__(self, mapping, window=STREAM_BATCH_WINDOW):
+        self.mapping = mapping
+        self.window = window
+        self.records = []
+        self.first_arrival = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.start_shards()
+        self.thread = FuncThread(self.run, None, quiet=True)
+        self.thread.start()
+
+    def start_shards(self):
+        """ Resolve the iterators of the shards when the mapping is created, hence records put to the
+            stream before the first poll are delivered as well (e.g., with StartingPosition LATEST). """
+        try:
+            self.refresh_shards()
+            for shard in self.shards.values():
+                shard.iterator = self.get_iterator(shard)
+        except Exception, e:
+            # e.g., the stream does not exist yet - the shards are resolved on the first poll
+            LOG.info('Unable to get the shards of Kinesis stream %s: %s' % (self.stream_name, e))
+
+    def put(self, records):
+        with self.condition:
+            if not self.records:
+                self.first_arrival = time.time()
+            self.records.extend(records)
+            self.condition.notify()
+
+    def remaining_time(self):
+        """ Return the time until the current batch is due (0 if it is due now, None if it is empty). """
+        if not self.records:
+            return None
+        if len(self.records) >= self.mapping.get('BatchSize', DEFAULT_BATCH_SIZE):
+            return 0
+        return max(0, self.first_arrival + self.window - time.time())
+
+    def run(self, params):
+        while True:
+            with self.condition:
+                remaining = self.remaining_time()
+                while self.running and remaining != 0:
+                    self.condition.wait(remaining)
+                    remaining = self.remaining_time()
+                if not self.running:
+                    return
+                batch_size = self.mapping.get('BatchSize', DEFAULT_BATCH_SIZE)
+                batch = self.records[:batch_size]
+                self.records = self.records[batch_size:]
+            self.invoke(batch)
+
+    def invoke(self, records):
+        arn = self.mapping['FunctionArn']
+        func = lambda_arn_to_function.get(arn)
+        if not func:
+            return
+        event = {
+            'Records': records
+        }
+        run_lambda(func, event=event, context={}, lambda_cwd=lambda_arn_to_cwd.get(arn))
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+class ShardDispatcher(object):
+    """ Invokes the functions subscribed to Kinesis streams asynchronously. Records are queued by
+        (function, shard), and each queue is served by one of `workers` threads (chosen by the hash of
+        the queue key). Hence, a function receives the records of a shard in order, while different
+        shards and functions are processed in parallel. """
+
+    def __init__(self, workers=KINESIS_DISPATCH_WORKERS):
+        self.queues = [Queue.Queue() for i in range(workers)]
+        self.mutex = threading.Lock()
+        # lag gauge, maps (stream name, shard ID) to the number of records not yet delivered, and
+        # to the time the last delivered records have been waiting in the queue
+        self.lag = {}
+        for queue in self.queues:
+            FuncThread(self.run, queue, quiet=True).start()
+
+    def put(self, function_arn, stream_name, shard_id, records, callback=None):
+        """ Queue the given records for the function. The optional `callback` is called once
+            the function has been invoked. """
+        key = (stream_name, shard_id)
+        with self.mutex:
+            lag = self.lag.setdefault(key, {'pending_records': 0, 'iterator_age_ms': 0})
+            lag['pending_records'] += len(records)
+        queue = self.queues[hash((function_arn, shard_id)) % len(self.queues)]
+        queue.put((function_arn, key, records, time.time(), callback))
+
+    def run(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            function_arn, key, records, enqueued, callback = item
+            with self.mutex:
+                lag = self.lag[key]
+                lag['pending_records'] -= len(records)
+                lag['iterator_age_ms'] = int((time.time() - enqueued) * 1000)
+            try:
+                self.invoke(function_arn, records)
+            except Exception, e:
+                LOG.warning('Unable to run Lambda function %s on Kinesis records: %s' %
+                    (function_arn, traceback.format_exc(e)))
+            if callback:
+                callback()
+
+    def invoke(self, function_arn, records):
+        func = lambda_arn_to_function.get(function_arn)
+        if not func:
+            return
+        event = {
+            'Records': records
+        }
+        run_lambda(func, event=event, context={}, lambda_cwd=lambda_arn_to_cwd.get(function_arn))
+
+    def stats(self):
+        with self.mutex:
+            return [dict(lag, stream_name=key[0], shard_id=key[1]) for key, lag in self.lag.items()]
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+
+
+class KinesisCheckpoints(object):
+    """ Sequence numbers of the last records delivered to a function, by (function ARN, stream ARN, stream
+        creation time, shard ID). The checkpoints are persisted in `file`, hence the pollers resume where they
+        stopped after a restart. The creation time tells apart streams re-created with the same name, e.g., after
+        a reset, or with an in-memory backend - their sequence numbers do not continue those of the old stream.
+        Changes are written at most every `save_interval` seconds (and by flush()), hence a crash may
+        re-deliver the records of the last interval, but never loses records. """
+
+    def __init__(self, file=KINESIS_CHECKPOINT_FILE, save_interval=KINESIS_CHECKPOINT_SAVE_INTERVAL):
+        self.file = file
+        self.save_interval = save_interval
+        self.checkpoints = None
+        self.mutex = threading.Lock()
+        # pending write of the changed checkpoints
+        self.timer = None
+
+    @staticmethod
+    def key(function_arn, stream_arn, stream_created, shard_id):
+        return '%s|%s|%s|%s' % (function_arn, stream_arn, stream_created, shard_id)
+
+    def load(self):
+        if self.checkpoints is None:
+            try:
+                self.checkpoints = json.loads(load_file(self.file, default='{}'))
+            except Exception, e:
+                LOG.warning('Unable to load Kinesis checkpoints from %s: %s' % (self.file, e))
+                self.checkpoints = {}
+        return self.checkpoints
+
+    def get(self, function_arn, stream_arn, stream_created, shard_id):
+        with self.mutex:
+            return self.load().get(self.key(function_arn, stream_arn, stream_created, shard_id))
+
+    def put(self, function_arn, stream_arn, stream_created, shard_id, sequence_number):
+        with self.mutex:
+            self.load()[self.key(function_arn, stream_arn, stream_created, shard_id)] = sequence_number
+            self.changed()
+
+    def remove(self, function_arn, stream_arn, stream_created, shard_id):
+        with self.mutex:
+            if self.load().pop(self.key(function_arn, stream_arn, stream_created, shard_id), None):
+                self.changed()
+
+    def clear(self, stream_name=None):
+        """ Remove the checkpoints of the given stream (e.g., after it has been deleted), or of all streams. """
+        with self.mutex:
+            checkpoints = self.load()
+            for key in checkpoints.keys():
+                if stream_name is None or key.split('|')[1].split('/')[-1] == stream_name:
+                    del checkpoints[key]
+            self.save()
+
+    def flush(self):
+        """ Write pending changes of the checkpoints to the file, e.g., on shutdown. """
+        with self.mutex:
+            if self.timer:
+                self.save()
+
+    def changed(self):
+        # called with the mutex held
+        if not self.timer:
+            self.timer = threading.Timer(self.save_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def save(self):
+        # called with the mutex held
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        # write a new file and rename it, to not leave a truncated file behind on a crash
+        tmp_file = '%s.tmp' % self.file
+        try:
+            save_file(tmp_file, json.dumps(self.checkpoints))
+            os.rename(tmp_file, self.file)
+        except Exception, e:
+            LOG.warning('Unable to save Kinesis checkpoints to %s: %s' % (self.file, e))
+
+
+kinesis_checkpoints = KinesisCheckpoints()
+
+
+class ShardState(object):
+    """ Read position and polling schedule of a Kinesis shard. """
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.iterator = None
+        self.closed = False
+        # whether a batch of records of this shard is waiting to be processed by the function
+        self.in_flight = False
+        self.interval = KINESIS_POLL_MIN_INTERVAL
+        self.next_poll = 0
+
+
+class KinesisPoller(object):
+    """ Reads the shards of the Kinesis stream of an event source mapping with GetShardIterator/GetRecords,
+        and hands batches of up to `BatchSize` records to the ShardDispatcher. At most one batch per shard is
+        in flight; the shard is checkpointed once its batch has been processed. The poll interval of idle
+        shards grows from KINESIS_POLL_MIN_INTERVAL to KINESIS_POLL_MAX_INTERVAL, and is reset once the shard
+        returns records, or when records have been put to the stream through the proxy (see wake()). """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.stream_arn = mapping['EventSourceArn']
+        self.stream_name = self.stream_arn.split('/')[-1]
+        # creation time of the stream, which is part of the checkpoint keys
+        self.stream_created = None
+        self.shards = {}
+        self.shards_refreshed = 0
+        self.running = True
+        self.condition = threading.Condition()
+        self.start_shards()
+        self.thread = FuncThread(self.run, None, quiet=True)
+        self.thread.start()
+
+    def start_shards(self):
+        """ Resolve the iterators of the shards when the mapping is created, hence records put to the
+            stream before the first poll are delivered as well (e.g., with StartingPosition LATEST). """
+        try:
+            self.refresh_shards()
+            for shard in self.shards.values():
+                shard.iterator = self.get_iterator(shard)
+        except Exception, e:
+            # e.g., the stream does not exist yet - the shards are resolved on the first poll
+            LOG.info('Unable to get the shards of Kinesis stream %s: %s' % (self.stream_name, e))
+
+    def run(self, params):
+        while True:
+            with self.condition:
+                timeout = self.next_poll_time() - time.time()
+                while self.running and timeout > 0:
+                    self.condition.wait(timeout)
+                    timeout = self.next_poll_time() - time.time()
+                if not self.running:
+                    return
+            if self.mapping['State'] != 'Enabled':
+                with self.condition:
+                    self.condition.wait(KINESIS_POLL_MAX_INTERVAL)
+                continue
+            try:
+                if not self.shards or time.time() - self.shards_refreshed > KINESIS_SHARDS_REFRESH_INTERVAL:
+                    self.refresh_shards()
+                now = time.time()
+                for shard in self.shards.values():
+                    if not shard.closed and not shard.in_flight and shard.next_poll <= now:
+                        self.poll(shard)
+            except Exception, e:
+                LOG.info('Unable to poll Kinesis stream %s: %s' % (self.stream_name, e))
+
+    def next_poll_time(self):
+        if not self.shards:
+            return self.shards_refreshed + KINESIS_POLL_MAX_INTERVAL
+        shards = [s for s in self.shards.values() if not s.closed and not s.in_flight]
+        return min(s.next_poll for s in shards) if shards else time.time() + KINESIS_SHARDS_REFRESH_INTERVAL
+
+    def refresh_shards(self):
+        self.shards_refreshed = time.time()
+        stream = get_kinesis_client().describe_stream(StreamName=self.stream_name)['StreamDescription']
+        stream_created = str(stream.get('StreamCreationTimestamp'))
+        if stream_created != self.stream_created:
+            # the stream has been (re-)created - start over with its shards
+            self.stream_created = stream_created
+            self.shards = {}
+        for shard in stream['Shards']:
+            if shard['ShardId'] not in self.shards:
+                self.shards[shard['ShardId']] = ShardState(shard['ShardId'])
+
+    def get_iterator(self, shard):
+        client = get_kinesis_client()
+        function_arn = self.mapping['FunctionArn']
+        checkpoint = kinesis_checkpoints.get(function_arn, self.stream_arn, self.stream_created, shard.shard_id)
+        if checkpoint:
+            try:
+                return client.get_shard_iterator(StreamName=self.stream_name, ShardId=shard.shard_id,
+                    ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                    StartingSequenceNumber=checkpoint)['ShardIterator']
+            except ClientError, e:
+                if e.response.get('Error', {}).get('Code') != 'InvalidArgumentException':
+                    raise
+                # the sequence number does not belong to this shard - fall back to the starting position
+                LOG.warning('Discarding invalid checkpoint %s of Kinesis shard %s/%s: %s' %
+                    (checkpoint, self.stream_name, shard.shard_id, e))
+                kinesis_checkpoints.remove(function_arn, self.stream_arn, self.stream_created, shard.shard_id)
+        position = self.mapping.get('StartingPosition') or DEFAULT_STARTING_POSITION
+        return client.get_shard_iterator(StreamName=self.stream_name, ShardId=shard.shard_id,
+            ShardIteratorType=position)['ShardIterator']
+
+    def poll(self, shard):
+        try:
+            if not shard.iterator:
+                shard.iterator = self.get_iterator(shard)
+            result = get_kinesis_client().get_records(ShardIterator=shard.iterator,
+                Limit=self.mapping.get('BatchSize', DEFAULT_BATCH_SIZE))
+        except Exception, e:
+            # e.g., ExpiredIteratorException - re-create the iterator from the checkpoint on the next poll
+            shard.iterator = None
+            self.backoff(shard)
+            raise
+        shard.iterator = result.get('NextShardIterator')
+        shard.closed = not shard.iterator
+        records = result['Records']
+        if not records:
+            self.backoff(shard)
+            return
+        shard.interval = KINESIS_POLL_MIN_INTERVAL
+        shard.next_poll = 0
+        shard.in_flight = True
+        sequence_number = records[-1]['SequenceNumber']
+        stream_created = self.stream_created
+        records = [self.to_event_record(shard, record) for record in records]
+
+        def delivered():
+            kinesis_checkpoints.put(self.mapping['FunctionArn'], self.stream_arn, stream_created,
+                shard.shard_id, sequence_number)
+            with self.condition:
+                shard.in_flight = False
+                self.condition.notify()
+
+        get_kinesis_dispatcher().put(self.mapping['FunctionArn'], self.stream_name,
+            shard.shard_id, records, callback=delivered)
+
+    def to_event_record(self, shard, record):
+        return {
+            'eventID': '%s:%s' % (shard.shard_id, record['SequenceNumber']),
+            'eventSource': 'aws:kinesis',
+            'eventSourceARN': self.stream_arn,
+            'kinesis': {
+                'data': base64.b64encode(record['Data']),
+                'partitionKey': record['PartitionKey'],
+                'sequenceNumber': record['SequenceNumber']
+            }
+        }
+
+    def backoff(self, shard):
+        shard.interval = min(shard.interval * KINESIS_POLL_BACKOFF, KINESIS_POLL_MAX_INTERVAL)
+        shard.next_poll = time.time() + shard.interval
+
+    def wake(self):
+        """ Poll the (idle) shards immediately, e.g., after records have been put to the stream. """
+        with self.condition:
+            for shard in self.shards.values():
+                shard.interval = KINESIS_POLL_MIN_INTERVAL
+                shard.next_poll = 0
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+def cleanup(clear_checkpoints=True):
     global lambda_arn_to_function, event_source_mappings, lambda_arn_to_cwd, lambda_arn_to_handler
+    global event_sources_by_uuid, event_sources_by_source, event_sources_by_function, stream_batchers
+    global kinesis_dispatcher, kinesis_pollers, lambda_process_pools
     # reset the state
     lambda_arn_to_function = {}
     lambda_arn_to_cwd = {}
     lambda_arn_to_handler = {}
     event_source_mappings = []
+    event_sources_by_uuid = {}
+    event_sources_by_source = {}
+    event_sources_by_function = {}
+    for batcher in stream_batchers.values():
+        batcher.stop()
+    stream_batchers = {}
+    for poller in kinesis_pollers.values():
+        poller.stop()
+    kinesis_pollers = {}
+    for pool in lambda_process_pools.values():
+        pool.shutdown()
+    lambda_process_pools = {}
+    # the code stays in the store, for functions re-deployed with the same code
+    code_store.release_all()
+    if clear_checkpoints:
+        kinesis_checkpoints.clear()
+    else:
+        kinesis_checkpoints.flush()
+    with kinesis_dispatcher_lock:
+        if kinesis_dispatcher:
+            kinesis_dispatcher.stop()
+        kinesis_dispatcher = None
 
 
 def func_arn(function_name):
@@ -59,64 +531,178 @@ def add_function_mapping(lambda_name, lambda_handler, lambda_cwd=None):
     lambda_arn_to_cwd[arn] = lambda_cwd
 
 
-def add_event_source(function_name, source_arn):
+def add_event_source(function_name, source_arn, batch_size=DEFAULT_BATCH_SIZE, enabled=True,
+        starting_position=None):
     mapping = {
         "UUID": str(uuid.uuid4()),
         "StateTransitionReason": "User action",
         "LastModified": float(time.mktime(datetime.utcnow().timetuple())),
-        "BatchSize": 100,
-        "State": "Enabled",
+        "BatchSize": batch_size,
+        "State": "Enabled" if enabled else "Disabled",
         "FunctionArn": func_arn(function_name),
         "EventSourceArn": source_arn,
         "LastProcessingResult": "OK"
     }
-    event_source_mappings.append(mapping)
+    if starting_position:
+        mapping['StartingPosition'] = starting_position
+    with event_sources_lock:
+        event_source_mappings.append(mapping)
+        index_event_source(mapping)
+    if ':kinesis:' in source_arn:
+        kinesis_pollers[mapping['UUID']] = KinesisPoller(mapping)
     return mapping
 
 
-def process_kinesis_records(records, stream_name):
-    # feed records into listening lambdas
-    try:
-        sources = get_event_sources(source_arn=aws_stack.kinesis_stream_arn(stream_name))
-        for source in sources:
-            arn = source['FunctionArn']
-            lambda_function = lambda_arn_to_function[arn]
-            lambda_cwd = lambda_arn_to_cwd[arn]
-            event = {
-                'Records': []
-            }
-            for rec in records:
-                event['Records'].append({
-                    'kinesis': rec
-                })
-            run_lambda(lambda_function, event=event, context={}, lambda_cwd=lambda_cwd)
-    except Exception, e:
-        print(traceback.format_exc(e))
+def update_event_source(uuid, function_name=None, batch_size=None, enabled=None):
+    with event_sources_lock:
+        mapping = event_sources_by_uuid.get(uuid)
+        if not mapping:
+            return None
+        if function_name:
+            unindex_event_source(mapping)
+            mapping['FunctionArn'] = function_arn(function_name)
+            index_event_source(mapping)
+        if batch_size:
+            mapping['BatchSize'] = batch_size
+        if enabled is not None:
+            mapping['State'] = 'Enabled' if enabled else 'Disabled'
+        mapping['LastModified'] = float(time.mktime(datetime.utcnow().timetuple()))
+        return mapping
+
+
+def delete_event_source(uuid):
+    with event_sources_lock:
+        mapping = event_sources_by_uuid.get(uuid)
+        if not mapping:
+            return None
+        event_source_mappings.remove(mapping)
+        unindex_event_source(mapping)
+    for worker in (stream_batchers.pop(uuid, None), kinesis_pollers.pop(uuid, None)):
+        if worker:
+            worker.stop()
+    return mapping
+
+
+def source_arn_key(source_arn):
+    """ Return the key of an event source ARN in the index. DynamoDB stream ARNs map to the ARN of
+        their table ('arn:aws:dynamodb:<region>:<account>:table/<name>/stream/<label>' -> '...table/<name>'). """
+    return source_arn.split('/stream/')[0]
+
+
+def function_arn(func_name):
+    return func_name if func_name.startswith('arn:') else func_arn(func_name)
+
+
+def index_event_source(mapping):
+    source_key = source_arn_key(mapping['EventSourceArn'])
+    function_key = mapping['FunctionArn']
+    event_sources_by_uuid[mapping['UUID']] = mapping
+    event_sources_by_source[source_key] = event_sources_by_source.get(source_key, []) + [mapping]
+    event_sources_by_function[function_key] = event_sources_by_function.get(function_key, []) + [mapping]
+
 
+def unindex_event_source(mapping):
+    source_key = source_arn_key(mapping['EventSourceArn'])
+    function_key = mapping['FunctionArn']
+    event_sources_by_uuid.pop(mapping['UUID'], None)
+    event_sources_by_source[source_key] = [m for m in event_sources_by_source.get(source_key, []) if m is not mapping]
+    event_sources_by_function[function_key] = [m for m in event_sources_by_function.get(function_key, [])
+        if m is not mapping]
 
-def get_event_sources(func_name=None, source_arn=None):
-    result = []
-    for m in event_source_mappings:
-        if not func_name or m['FunctionArn'] in [func_name, func_arn(func_name)]:
-            if not source_arn or m['EventSourceArn'].startswith(source_arn):
-                result.append(m)
+
+def wake_kinesis_pollers(stream_name):
+    """ Notify the pollers of the given stream that records have been put to it. """
+    for mapping in get_event_sources(source_arn=aws_stack.kinesis_stream_arn(stream_name)):
+        poller = kinesis_pollers.get(mapping['UUID'])
+        if poller:
+            poller.wake()
+
+
+def get_kinesis_client():
+    # boto3 clients are thread-safe, but creating them (from the default session) is not
+    global kinesis_client
+    if not kinesis_client:
+        with kinesis_client_lock:
+            if not kinesis_client:
+                kinesis_client = aws_stack.connect_to_service('kinesis')
+    return kinesis_client
+
+
+def get_kinesis_dispatcher():
+    global kinesis_dispatcher
+    if not kinesis_dispatcher:
+        with kinesis_dispatcher_lock:
+            if not kinesis_dispatcher:
+                kinesis_dispatcher = ShardDispatcher()
+    return kinesis_dispatcher
+
+
+def get_kinesis_dispatch_stats():
+    dispatcher = kinesis_dispatcher
+    return dispatcher.stats() if dispatcher else []
+
+
+def process_stream_records(records, source_arn):
+    """ Hand the given stream records to the functions listening on the stream, which are invoked
+        with batches of records (see StreamBatcher). """
+    for mapping in get_event_sources(source_arn=source_arn, enabled_only=True):
+        get_stream_batcher(mapping).put(records)
+
+
+def get_stream_batcher(mapping):
+    batcher = stream_batchers.get(mapping['UUID'])
+    if not batcher:
+        with stream_batchers_lock:
+            batcher = stream_batchers.get(mapping['UUID'])
+            if not batcher:
+                batcher = stream_batchers[mapping['UUID']] = StreamBatcher(mapping)
+    return batcher
+
+
+def get_event_sources(func_name=None, source_arn=None, enabled_only=False):
+    """ Return the event source mappings for the given function name/ARN and/or source ARN. The
+        returned list must not be modified. """
+    if source_arn:
+        result = event_sources_by_source.get(source_arn_key(source_arn), [])
+        if func_name:
+            arn = function_arn(func_name)
+            result = [m for m in result if m['FunctionArn'] == arn]
+    elif func_name:
+        result = event_sources_by_function.get(function_arn(func_name), [])
+    else:
+        result = event_source_mappings
+    if enabled_only:
+        result = [m for m in result if m['State'] == 'Enabled']
     return result
 
 
-def run_lambda(func, event, context, suppress_output=False, lambda_cwd=None):
+def invoke_function(function_arn, event, context={}):
+    """ Run the given function synchronously, and return its result. Raises an error if the function fails. """
+    func = lambda_arn_to_function.get(function_arn)
+    if not func:
+        raise Exception('Function not found: %s' % function_arn)
+    return run_lambda(func, event=event, context=context,
+        lambda_cwd=lambda_arn_to_cwd.get(function_arn), raise_errors=True)
+
+
+def run_lambda(func, event, context, suppress_output=False, lambda_cwd=None, raise_errors=False):
     if suppress_output:
         stdout_ = sys.stdout
         stderr_ = sys.stderr
         stream = cStringIO.StringIO()
         sys.stdout = stream
         sys.stderr = stream
-    if lambda_cwd:
-        cwd_mutex.acquire()
-        previous_cwd = os.getcwd()
-        os.chdir(lambda_cwd)
+    change_cwd = False
     try:
+        # functions loaded into their own namespace (see exec_lambda_code) resolve relative paths against
+        # their directory themselves, hence only other functions need to (exclusively) change the process CWD
+        change_cwd = lambda_cwd and not isinstance(func.func_globals.get(NAMESPACE_ATTRIBUTE), FunctionNamespace)
+        if change_cwd:
+            cwd_mutex.acquire()
+            previous_cwd = os.getcwd()
+            os.chdir(lambda_cwd)
         if func.func_code.co_argcount == 2:
-            func(event, context)
+            return func(event, context)
         else:
             raise Exception('Expected handler function with 2 parameters, found %s' % func.func_code.co_argcount)
     except Exception, e:
@@ -124,79 +710,167 @@ def run_lambda(func, event, context, suppress_output=False, lambda_cwd=None):
             sys.stdout = stdout_
             sys.stderr = stderr_
         print("ERROR executing Lambda function: %s" % traceback.format_exc(e))
+        if raise_errors:
+            raise
     finally:
         if suppress_output:
             sys.stdout = stdout_
             sys.stderr = stderr_
-        if lambda_cwd:
+        if change_cwd:
             os.chdir(previous_cwd)
             cwd_mutex.release()
 
 
-def exec_lambda_code(script, handler_function='handler', lambda_cwd=None):
-    if lambda_cwd:
-        cwd_mutex.acquire()
-        previous_cwd = os.getcwd()
-        os.chdir(lambda_cwd)
+def exec_lambda_code(script, handler_function='handler', lambda_cwd=None, compiler=None):
     # WARNING: we can only do exec(..) for controlled test environments - it's dangerous!
     local_vars = {}
     # make sure os.environ[...] is available in the lambda context
     local_vars['os'] = os
     try:
-        exec(script, local_vars)
+        if lambda_cwd:
+            # run the code in its own namespace, which resolves relative file paths and imports against
+            # `lambda_cwd` - this allows running functions concurrently, without changing the process CWD
+            namespace = FunctionNamespace(lambda_cwd, compiler=compiler)
+            local_vars = namespace.exec_script(script, os.path.join(lambda_cwd, LAMBDA_MAIN_SCRIPT_NAME), local_vars)
+        else:
+            exec(script, local_vars)
     except Exception, e:
         print('ERROR: Unable to exec: %s %s' % (script, traceback.format_exc(e)))
         raise e
-    finally:
-        if lambda_cwd:
-            os.chdir(previous_cwd)
-            cwd_mutex.release()
     return local_vars[handler_function]
 
 
 def set_function_code(code, lambda_name):
+    """ Deploy the given code for the function. Only the archive is kept here - it is extracted and loaded
+        on the first invocation of the function (see LazyFunctionLoader), or by the pre-warm workers. """
+    arn = func_arn(lambda_name)
+    if 'ZipFile' not in code:
+        add_function_mapping(lambda_name, None)
+        return
+    zip_file_content = base64.b64decode(code['ZipFile'])
+    loader = LazyFunctionLoader(lambda_name, zip_file_content)
+    with lambda_load_lock:
+        current = lambda_arn_to_function.get(arn)
+        current_hash = current.loader.hash if hasattr(current, 'loader') else current and code_store.owners.get(arn)
+        if loader.hash == current_hash:
+            # the code is unchanged - keep the (loaded or pending) function
+            return
+        # shut down the worker processes running the previous code of the function
+        previous_pool = lambda_process_pools.pop(arn, None)
+        add_function_mapping(lambda_name, loader.handler)
+    if previous_pool:
+        previous_pool.shutdown()
+    if LAMBDA_PREWARM_WORKERS:
+        get_prewarm_queue().put(loader)
+
+
+def load_function_code(lambda_name, zip_file_content):
+    """ Extract (via the code store) and load the given function code, and return its handler. """
+    arn = func_arn(lambda_name)
     lambda_handler = None
     lambda_cwd = None
-    if 'ZipFile' in code:
-        zip_file_content = code['ZipFile']
-        zip_file_content = base64.b64decode(zip_file_content)
-
-        if is_jar_archive(zip_file_content):
-            archive = ARCHIVE_FILE_PATTERN.replace('*', short_uid())
-            save_file(archive, zip_file_content)
-            TMP_FILES.append(archive)
-
-            def execute(event, context):
-                event_file = EVENT_FILE_PATTERN.replace('*', short_uid())
-                save_file(event_file, json.dumps(event))
-                TMP_FILES.append(event_file)
-                class_name = lambda_arn_to_handler[func_arn(lambda_name)].split('::')[0]
-                classpath = '%s:%s' % (LAMBDA_EXECUTOR_JAR, archive)
-                cmd = 'java -cp %s %s %s %s' % (classpath, LAMBDA_EXECUTOR_CLASS, class_name, event_file)
-                # print(cmd)
-                output = run(cmd)
-                LOG.info('Lambda output: %s' % output.replace('\n', '\n> '))
-
-            lambda_handler = execute
+    entry = code_store.checkout(arn, zip_file_content)
+    if entry.kind == lambda_code.CODE_JAR:
+        lambda_handler = java_server_handler(lambda_name, entry.path)
+    else:
+        if entry.kind == lambda_code.CODE_ZIP:
+            lambda_cwd = entry.path
+        if not entry.script or 'def handler' not in entry.script:
+            raise Exception('Unable to get handler function from lambda code')
+        if LAMBDA_EXECUTOR == LAMBDA_EXECUTOR_PROCESS:
+            lambda_handler = process_pool_handler(lambda_name, entry.script, lambda_cwd)
+            # the worker processes run in the function directory themselves
+            lambda_cwd = None
         else:
-            if 'def handler' not in zip_file_content:
-                zip_file_name = 'original_file.zip'
-                tmp_dir = '/tmp/zipfile.%s' % short_uid()
-                run('mkdir -p %s' % tmp_dir)
-                tmp_file = '%s/%s' % (tmp_dir, zip_file_name)
-                save_file(tmp_file, zip_file_content)
-                TMP_FILES.append(tmp_dir)
-                run('cd %s && unzip %s' % (tmp_dir, zip_file_name))
-                main_script = '%s/%s' % (tmp_dir, LAMBDA_MAIN_SCRIPT_NAME)
-                lambda_cwd = tmp_dir
-                with open(main_script, "rb") as file_obj:
-                    zip_file_content = file_obj.read()
-
-            if 'def handler' in zip_file_content:
-                lambda_handler = exec_lambda_code(zip_file_content, lambda_cwd=lambda_cwd)
-            else:
-                raise Exception('Unable to get handler function from lambda code')
-    add_function_mapping(lambda_name, lambda_handler, lambda_cwd)
+            # the compiled code is shared by all functions with identical code
+            lambda_handler = exec_lambda_code(entry.main_code(), lambda_cwd=lambda_cwd,
+                compiler=entry.compile)
+    return lambda_handler, lambda_cwd
+
+
+class LazyFunctionLoader(object):
+    """ Loads the code of a function once, on its first invocation. Until then, `handler` is registered for
+        the function: it loads the code (concurrent first invocations wait for the same load), replaces itself
+        with the loaded handler (unless the function has been re-deployed meanwhile), and invokes it. """
+
+    def __init__(self, lambda_name, zip_file_content):
+        self.lambda_name = lambda_name
+        self.zip_file_content = zip_file_content
+        self.hash = hashlib.sha256(zip_file_content).hexdigest()
+        self.loaded = None
+        self.lock = threading.Lock()
+
+        def handler(event, context):
+            return self.load()(event, context)
+
+        handler.loader = self
+        self.handler = handler
+
+    def is_deployed(self):
+        return lambda_arn_to_function.get(func_arn(self.lambda_name)) is self.handler
+
+    def load(self):
+        if self.loaded:
+            return self.loaded
+        with self.lock:
+            if not self.loaded:
+                lambda_handler, lambda_cwd = load_function_code(self.lambda_name, self.zip_file_content)
+                arn = func_arn(self.lambda_name)
+                with lambda_load_lock:
+                    if self.is_deployed():
+                        if hasattr(lambda_handler, 'pool'):
+                            lambda_process_pools[arn] = lambda_handler.pool
+                        add_function_mapping(self.lambda_name, lambda_handler, lambda_cwd)
+                self.loaded = lambda_handler
+                self.zip_file_content = None
+        return self.loaded
+
+
+def get_prewarm_queue():
+    global prewarm_queue
+    if not prewarm_queue:
+        with lambda_load_lock:
+            if not prewarm_queue:
+                prewarm_queue = Queue.Queue()
+                for i in range(LAMBDA_PREWARM_WORKERS):
+                    FuncThread(prewarm, prewarm_queue, quiet=True).start()
+    return prewarm_queue
+
+
+def prewarm(queue):
+    while True:
+        loader = queue.get()
+        if not loader.is_deployed():
+            continue
+        try:
+            loader.load()
+        except Exception, e:
+            LOG.warning('Unable to pre-load code of Lambda function %s: %s' % (loader.lambda_name, e))
+
+
+def java_server_handler(lambda_name, archive):
+    """ Return a handler which streams the events to a warm JVM (see JavaLambdaServer). """
+    classpath = '%s:%s' % (LAMBDA_EXECUTOR_JAR, archive)
+    server = lambda_process.JavaLambdaServer(classpath, LAMBDA_EXECUTOR_CLASS)
+
+    def execute(event, context):
+        server.set_handler_class(lambda_arn_to_handler[func_arn(lambda_name)].split('::')[0])
+        return server.invoke(event, context)
+
+    execute.pool = server
+    return execute
+
+
+def process_pool_handler(lambda_name, script, lambda_cwd):
+    """ Return a handler which runs the given function code in a pool of warm worker processes. """
+    pool = lambda_process.ProcessPool(script, lambda_cwd=lambda_cwd, size=LAMBDA_PROCESS_POOL_SIZE,
+        max_invocations=LAMBDA_PROCESS_MAX_INVOCATIONS, max_memory=LAMBDA_PROCESS_MAX_MEMORY)
+
+    def execute(event, context):
+        return pool.invoke(event, context)
+
+    execute.pool = pool
+    return execute
 
 
 @app.route('%s/functions' % PATH_ROOT, methods=['POST'])
@@ -252,9 +926,16 @@ def list_event_source_mappings():
     """ List event source mappings
         ---
         operationId: 'listEventSourceMappings'
+        parameters:
+            - name: 'EventSourceArn'
+              in: query
+            - name: 'FunctionName'
+              in: query
     """
+    mappings = get_event_sources(func_name=request.args.get('FunctionName'),
+        source_arn=request.args.get('EventSourceArn'))
     response = {
-        'EventSourceMappings': event_source_mappings
+        'EventSourceMappings': mappings
     }
     return jsonify(response)
 
@@ -269,10 +950,71 @@ def create_event_source_mapping():
               in: body
     """
     data = json.loads(request.data)
-    mapping = add_event_source(data['FunctionName'], data['EventSourceArn'])
+    mapping = add_event_source(data['FunctionName'], data['EventSourceArn'],
+        batch_size=data.get('BatchSize', DEFAULT_BATCH_SIZE), enabled=data.get('Enabled', True),
+        starting_position=data.get('StartingPosition'))
+    return jsonify(mapping)
+
+
+@app.route('%s/event-source-mappings/<uuid>' % PATH_ROOT, methods=['GET'])
+def get_event_source_mapping(uuid):
+    """ Get an event source mapping
+        ---
+        operationId: 'getEventSourceMapping'
+        parameters:
+            - name: uuid
+              in: path
+    """
+    mapping = event_sources_by_uuid.get(uuid)
+    if not mapping:
+        return mapping_not_found(uuid)
+    return jsonify(mapping)
+
+
+@app.route('%s/event-source-mappings/<uuid>' % PATH_ROOT, methods=['PUT'])
+def update_event_source_mapping(uuid):
+    """ Update an event source mapping
+        ---
+        operationId: 'updateEventSourceMapping'
+        parameters:
+            - name: uuid
+              in: path
+            - name: 'request'
+              in: body
+    """
+    data = json.loads(request.data)
+    mapping = update_event_source(uuid, function_name=data.get('FunctionName'),
+        batch_size=data.get('BatchSize'), enabled=data.get('Enabled'))
+    if not mapping:
+        return mapping_not_found(uuid)
     return jsonify(mapping)
 
 
+@app.route('%s/event-source-mappings/<uuid>' % PATH_ROOT, methods=['DELETE'])
+def delete_event_source_mapping(uuid):
+    """ Delete an event source mapping
+        ---
+        operationId: 'deleteEventSourceMapping'
+        parameters:
+            - name: uuid
+              in: path
+    """
+    mapping = delete_event_source(uuid)
+    if not mapping:
+        return mapping_not_found(uuid)
+    return jsonify(mapping)
+
+
+def mapping_not_found(uuid):
+    response = jsonify({
+        'Type': 'User',
+        'message': 'The resource you requested does not exist. (Event source mapping %s)' % uuid
+    })
+    response.status_code = 404
+    response.headers['x-amzn-errortype'] = 'ResourceNotFoundException'
+    return response
+
+
 def serve(port, quiet=True):
     if quiet:
         log = logging.getLogger('werkzeug')
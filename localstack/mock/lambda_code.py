@@ -0,0 +1,203 @@
+import os
+import shutil
+import hashlib
+import zipfile
+import threading
+import collections
+from cStringIO import StringIO
+from localstack.constants import LAMBDA_MAIN_SCRIPT_NAME
+from localstack.utils.common import is_jar_archive, short_uid, save_file, TMP_FILES
+
+# directory in which the code archives of the functions are stored/extracted
+DEFAULT_CODE_DIR = '/tmp/localstack.lambda.code'
+# default max. disk usage (bytes) of the archives/extracted trees which are not used by any function
+DEFAULT_DISK_QUOTA = 512 * 1024 * 1024
+
+# kinds of function code
+CODE_SCRIPT = 'script'
+CODE_ZIP = 'zip'
+CODE_JAR = 'jar'
+
+
+class CodeEntry(object):
+    """The code of a function, stored under the SHA-256 hash of its (decoded) archive. Depending on
+    the kind of code, `path` is the JAR file or the directory the ZIP archive has been extracted into.
+    Compiled code objects are kept in `compiled` (by file name), and shared by all functions which
+    have identical code."""
+
+    def __init__(self, hash, kind, path=None, script=None, size=0):
+        self.hash = hash
+        self.kind = kind
+        self.path = path
+        self.script = script
+        self.size = size
+        self.compiled = {}
+        # ARNs of the functions which use this code
+        self.owners = set()
+
+    def main_file(self):
+        return os.path.join(self.path, LAMBDA_MAIN_SCRIPT_NAME) if self.kind == CODE_ZIP else '<lambda>'
+
+    def exists(self):
+        """Whether the files of this code are (still) on disk - they may have been removed by a cleanup."""
+        if self.kind == CODE_JAR:
+            return os.path.isfile(self.path)
+        if self.kind == CODE_ZIP:
+            return os.path.isdir(self.path)
+        return True
+
+    def compile(self, file_name, source):
+        """Return the (cached) code object for the given source file of this function code."""
+        code = self.compiled.get(file_name)
+        if code is None:
+            code = self.compiled[file_name] = compile(source, file_name, 'exec')
+        return code
+
+    def main_code(self):
+        return self.compile(self.main_file(), self.script)
+
+
+class CodeStore(object):
+    """Content-addressed store of function code. Each unique archive is stored/extracted once (in-process),
+    and shared by all functions deployed with it. Entries which are no longer used by any function are
+    kept for re-deployments, and evicted in LRU order once their total size exceeds `disk_quota`.
+    Archives are extracted outside of the store lock, hence different archives are extracted concurrently."""
+
+    def __init__(self, base_dir=DEFAULT_CODE_DIR, disk_quota=DEFAULT_DISK_QUOTA):
+        self.base_dir = base_dir
+        self.disk_quota = disk_quota
+        # code entries by hash, in LRU order
+        self.entries = collections.OrderedDict()
+        # hash of the code used by each function ARN
+        self.owners = {}
+        self.lock = threading.RLock()
+        # locks of the archives which are being stored, by hash
+        self.storing = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def checkout(self, owner, content):
+        """Return the CodeEntry for the given archive content, used by function `owner` from now on."""
+        hash = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            entry = self.lookup(owner, hash)
+            if entry:
+                return entry
+            hash_lock = self.storing.setdefault(hash, threading.Lock())
+        with hash_lock:
+            # the archive may have been stored by another thread in the meantime
+            entry = self.lookup(owner, hash)
+            if entry:
+                return entry
+            try:
+                entry = self.store(hash, content)
+            except Exception, e:
+                with self.lock:
+                    self.storing.pop(hash, None)
+                raise
+            # register the entry along with removing the in-flight marker, hence concurrent checkouts
+            # of the same archive either wait for the hash lock, or find the entry
+            with self.lock:
+                self.storing.pop(hash, None)
+                self.misses += 1
+                self.add(owner, entry)
+                self.evict()
+                return entry
+
+    def lookup(self, owner, hash):
+        """Return the stored entry with the given hash (now used by `owner`), or None if it is not stored.
+        Entries whose files have been removed meanwhile (e.g., by cleaning up the temporary files) are
+        not returned - they are replaced once the archive has been stored again."""
+        with self.lock:
+            entry = self.entries.get(hash)
+            if not entry or not entry.exists():
+                return None
+            self.hits += 1
+            self.add(owner, entry)
+            return entry
+
+    def add(self, owner, entry):
+        old = self.entries.pop(entry.hash, None)
+        if old:
+            entry.owners.update(old.owners)
+        self.entries[entry.hash] = entry
+        self.release(owner)
+        entry.owners.add(owner)
+        self.owners[owner] = entry.hash
+
+    def release(self, owner):
+        """Mark the code used by function `owner` as unused (by this function)."""
+        with self.lock:
+            hash = self.owners.pop(owner, None)
+            entry = self.entries.get(hash)
+            if entry:
+                entry.owners.discard(owner)
+
+    def release_all(self):
+        with self.lock:
+            for owner in self.owners.keys():
+                self.release(owner)
+            self.evict()
+
+    def store(self, hash, content):
+        if is_jar_archive(content):
+            path = self.path('%s.jar' % hash)
+            save_file(path, content)
+            return CodeEntry(hash, CODE_JAR, path=path, size=len(content))
+        if 'def handler' in content:
+            return CodeEntry(hash, CODE_SCRIPT, script=content, size=len(content))
+        path = self.path(hash)
+        # extract into a temporary directory first, to never expose a partially extracted tree
+        tmp_dir = self.path('%s.%s.tmp' % (hash, short_uid()))
+        try:
+            archive = zipfile.ZipFile(StringIO(content))
+            archive.extractall(tmp_dir)
+        except Exception, e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_dir, path)
+        size = sum(info.file_size for info in archive.infolist())
+        main_script = os.path.join(path, LAMBDA_MAIN_SCRIPT_NAME)
+        script = None
+        if os.path.isfile(main_script):
+            with open(main_script, 'rb') as f:
+                script = f.read()
+        return CodeEntry(hash, CODE_ZIP, path=path, script=script, size=size)
+
+    def path(self, name):
+        if not os.path.isdir(self.base_dir):
+            try:
+                os.makedirs(self.base_dir)
+                TMP_FILES.append(self.base_dir)
+            except OSError, e:
+                # the directory may have been created by a concurrent call
+                if not os.path.isdir(self.base_dir):
+                    raise
+        return os.path.join(self.base_dir, name)
+
+    def evict(self):
+        unused = [e for e in self.entries.values() if not e.owners and e.hash not in self.storing]
+        size = sum(e.size for e in unused)
+        for entry in unused:
+            if size <= self.disk_quota:
+                break
+            del self.entries[entry.hash]
+            size -= entry.size
+            self.evictions += 1
+            if entry.kind == CODE_JAR and os.path.isfile(entry.path):
+                os.remove(entry.path)
+            elif entry.kind == CODE_ZIP:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': sum(e.size for e in self.entries.values()),
+                'disk_quota': self.disk_quota,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
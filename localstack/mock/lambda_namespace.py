@@ -0,0 +1,140 @@
+import os
+import imp
+import types
+import threading
+import __builtin__
+
+# marker attribute of the modules loaded by a FunctionNamespace
+NAMESPACE_ATTRIBUTE = '__lambda_namespace__'
+
+
+class FunctionNamespace(object):
+    """Module namespace of a Python Lambda function whose code has been unpacked into directory `cwd`.
+    The code of the function runs with its own builtins: relative paths passed to open(..)/file(..) are
+    resolved against `cwd`, and modules/packages in `cwd` are imported into a module cache private
+    to the function (not sys.modules). Hence, functions do not need to change the process CWD (which
+    would have to be serialized), and two functions may ship modules with the same name."""
+
+    def __init__(self, cwd, compiler=None):
+        self.cwd = cwd
+        # function which compiles the source of a module, given (file name, source) - allows sharing
+        # the compiled code of the modules across namespaces
+        self.compile = compiler or (lambda file_name, source: compile(source, file_name, 'exec'))
+        self.modules = {}
+        # locations of the modules of the function by name (None for modules outside of `cwd`)
+        self.locations = {}
+        self.lock = threading.RLock()
+        self.builtins = dict(__builtin__.__dict__)
+        self.builtins['__import__'] = self.import_module
+        self.builtins['open'] = self.open
+        self.builtins['file'] = self.open
+
+    def path(self, path):
+        return path if os.path.isabs(path) else os.path.join(self.cwd, path)
+
+    def open(self, name, *args, **kwargs):
+        return __builtin__.open(self.path(name), *args, **kwargs)
+
+    def exec_script(self, script, file_name, variables={}):
+        """Run the given (main) script (source or code object) of the function, and return its global variables."""
+        scope = dict(variables)
+        scope['__builtins__'] = self.builtins
+        scope['__name__'] = os.path.splitext(os.path.basename(file_name))[0]
+        scope['__file__'] = file_name
+        scope[NAMESPACE_ATTRIBUTE] = self
+        exec(script if isinstance(script, types.CodeType) else self.compile(file_name, script), scope)
+        return scope
+
+    def import_module(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        package = self.importing_package(globals, level)
+        if package is not None:
+            # relative import from within a module of the function (explicit, or implicit in Python 2)
+            base = package
+            for i in range(level - 1):
+                base = base.rpartition('.')[0]
+            full_name = '.'.join([part for part in [base, name] if part])
+            if level > 0 or self.find(full_name):
+                return self.import_local(full_name, name, fromlist)
+        if level <= 0 and self.find(name):
+            return self.import_local(name, name, fromlist)
+        return __builtin__.__import__(name, globals, locals, fromlist, level)
+
+    def importing_package(self, globals, level):
+        """Return the package of the importing module, if it is a module of this function."""
+        if not globals or globals.get(NAMESPACE_ATTRIBUTE) is not self or level == 0:
+            return None
+        if '__path__' in globals:
+            return globals['__name__']
+        return globals['__name__'].rpartition('.')[0]
+
+    def import_local(self, full_name, name, fromlist):
+        with self.lock:
+            module = self.load(full_name)
+            for attr in fromlist or []:
+                if attr != '*' and not hasattr(module, attr) and hasattr(module, '__path__'):
+                    self.load('%s.%s' % (full_name, attr))
+            if fromlist:
+                return module
+            # "import a.b.c" binds (and returns) the top-level package "a" of the imported name
+            depth = full_name.count('.') - name.count('.')
+            return self.modules['.'.join(full_name.split('.')[:depth + 1])]
+
+    def find(self, full_name):
+        """Return the location (as returned by imp.find_module) of a module of the function, or None."""
+        if full_name not in self.locations:
+            self.locations[full_name] = self.find_module(full_name)
+        return self.locations[full_name]
+
+    def find_module(self, full_name):
+        parent, _, name = full_name.rpartition('.')
+        if parent:
+            if not self.find(parent):
+                return None
+            path = [os.path.join(self.cwd, *parent.split('.'))]
+        else:
+            path = [self.cwd]
+        try:
+            location = imp.find_module(name, path)
+        except ImportError, e:
+            return None
+        if location[0]:
+            location[0].close()
+        return location
+
+    def load(self, full_name):
+        module = self.modules.get(full_name)
+        if module:
+            return module
+        location = self.find(full_name)
+        if not location:
+            raise ImportError('No module named %s' % full_name)
+        parent, _, name = full_name.rpartition('.')
+        if parent:
+            self.load(parent)
+        file_name, path, (suffix, mode, kind) = location
+        if kind not in [imp.PY_SOURCE, imp.PKG_DIRECTORY]:
+            # e.g., compiled extensions - these can only be loaded globally
+            module = imp.load_module(full_name, open(path, mode) if kind != imp.C_BUILTIN else None, path,
+                (suffix, mode, kind))
+        else:
+            module = types.ModuleType(full_name)
+            module.__builtins__ = self.builtins
+            setattr(module, NAMESPACE_ATTRIBUTE, self)
+            if kind == imp.PKG_DIRECTORY:
+                module.__path__ = [path]
+                path = os.path.join(path, '__init__.py')
+            module.__file__ = path
+            module.__package__ = full_name if kind == imp.PKG_DIRECTORY else parent
+            # register the module before running it, to allow circular imports
+            self.modules[full_name] = module
+            with open(path, 'rU') as f:
+                code = self.compile(path, f.read() + '\n')
+            try:
+                exec(code, module.__dict__)
+            except Exception, e:
+                del self.modules[full_name]
+                raise
+        self.modules[full_name] = module
+        if parent:
+            setattr(self.modules[parent], name, module)
+        return module
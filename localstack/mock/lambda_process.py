@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import resource
+import threading
+import traceback
+import multiprocessing
+from localstack.utils.common import mutex_popen
+
+# default max. number of worker processes per function
+DEFAULT_POOL_SIZE = 4
+# default number of invocations after which a worker process is replaced by a fresh one
+DEFAULT_MAX_INVOCATIONS = 1000
+# default max. resident memory (MB) of a worker process, above which it is replaced after the invocation
+DEFAULT_MAX_MEMORY = 512
+
+
+def worker_main(conn, script, handler_function, lambda_cwd):
+    """Main loop of a worker process: load the function code once, then run the handler for each
+    (event, context) received over the pipe, and send back a tuple (status, result, memory in MB)."""
+    if lambda_cwd:
+        # this process is dedicated to the function, hence it can simply change its own CWD
+        os.chdir(lambda_cwd)
+        sys.path.insert(0, lambda_cwd)
+    scope = {'os': os}
+    try:
+        exec(script, scope)
+        handler = scope[handler_function]
+        conn.send(('ready', None))
+    except Exception, e:
+        conn.send(('error', traceback.format_exc(e)))
+        return
+    while True:
+        try:
+            event, context = conn.recv()
+        except EOFError, e:
+            return
+        try:
+            result = ('ok', handler(event, context))
+        except Exception, e:
+            result = ('error', traceback.format_exc(e))
+        # ru_maxrss is reported in KB on Linux
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        try:
+            conn.send(result + (memory,))
+        except Exception, e:
+            conn.send(('error', 'Unable to serialize the result of the function: %s' % e, memory))
+
+
+class Worker(object):
+    """A warm worker process, connected via a pipe."""
+
+    def __init__(self, script, handler_function, lambda_cwd):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_main,
+            args=(child_conn, script, handler_function, lambda_cwd))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.invocations = 0
+        self.memory = 0
+        status, error = self.conn.recv()
+        if status != 'ready':
+            self.stop()
+            raise Exception('Unable to load Lambda function code: %s' % error)
+
+    def invoke(self, event, context):
+        self.conn.send((event, context))
+        status, result, self.memory = self.conn.recv()
+        self.invocations += 1
+        if status != 'ok':
+            raise Exception('Lambda function failed: %s' % result)
+        return result
+
+    def stop(self):
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ProcessPool(object):
+    """Pool of warm worker processes which run the handler of a Python Lambda function, outside the
+    process of the emulator (i.e., without competing for its GIL, and isolated from its failures).
+    Workers are reused across invocations, and replaced after `max_invocations` invocations, once
+    their memory exceeds `max_memory` MB, or if they die."""
+
+    def __init__(self, script, handler_function='handler', lambda_cwd=None, size=DEFAULT_POOL_SIZE,
+            max_invocations=DEFAULT_MAX_INVOCATIONS, max_memory=DEFAULT_MAX_MEMORY):
+        self.script = script
+        self.handler_function = handler_function
+        self.lambda_cwd = lambda_cwd
+        self.size = size
+        self.max_invocations = max_invocations
+        self.max_memory = max_memory
+        self.idle = []
+        self.workers = 0
+        self.recycled = 0
+        self.running = True
+        self.condition = threading.Condition()
+        # start one worker upfront, which also verifies that the code can be loaded
+        self.idle.append(self.new_worker())
+        self.workers = 1
+
+    def new_worker(self):
+        return Worker(self.script, self.handler_function, self.lambda_cwd)
+
+    def acquire(self):
+        with self.condition:
+            while self.running and not self.idle and self.workers >= self.size:
+                self.condition.wait()
+            if not self.running:
+                raise Exception('Process pool of Lambda function has been shut down')
+            if self.idle:
+                return self.idle.pop()
+            self.workers += 1
+        try:
+            return self.new_worker()
+        except Exception, e:
+            self.discard(None)
+            raise
+
+    def release(self, worker):
+        with self.condition:
+            retire = not self.running or worker.invocations >= self.max_invocations or \
+                worker.memory > self.max_memory
+            if retire:
+                self.workers -= 1
+                self.recycled += self.running
+            else:
+                self.idle.append(worker)
+            self.condition.notify()
+        if retire:
+            worker.stop()
+
+    def discard(self, worker):
+        with self.condition:
+            self.workers -= 1
+            self.condition.notify()
+        if worker:
+            worker.stop()
+
+    def invoke(self, event, context):
+        worker = self.acquire()
+        try:
+            result = worker.invoke(event, context)
+        except (EOFError, IOError), e:
+            # the worker process has died
+            self.discard(worker)
+            raise Exception('Lambda worker process terminated unexpectedly: %s' % e)
+        except Exception, e:
+            self.release(worker)
+            raise
+        self.release(worker)
+        return result
+
+    def stats(self):
+        with self.condition:
+            return {'workers': self.workers, 'idle': len(self.idle), 'recycled': self.recycled}
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            idle, self.idle = self.idle, []
+            self.workers -= len(idle)
+            self.condition.notify_all()
+        for worker in idle:
+            worker.stop()
+
+
+class JavaLambdaServer(object):
+    """A long-running JVM which keeps the handler class of a Java Lambda function loaded. Events are
+    streamed to the `LambdaExecutor` (in server mode) via stdin, one JSON document per line, and the
+    responses are read from stdout. The JVM is restarted on the next invocation if it has died."""
+
+    def __init__(self, classpath, executor_class, handler_class=None):
+        self.classpath = classpath
+        self.executor_class = executor_class
+        self.handler_class = handler_class
+        self.process = None
+        self.restarts = 0
+        self.lock = threading.Lock()
+
+    def set_handler_class(self, handler_class):
+        """Set the handler class to run - the JVM is replaced if the class changes."""
+        with self.lock:
+            if handler_class != self.handler_class:
+                self.stop()
+                self.handler_class = handler_class
+
+    def start(self):
+        # subprocess is not thread-safe in Python 2 (see common.run(..)), and this is called from request threads
+        import subprocess32 as subprocess
+        cmd = ['java', '-cp', self.classpath, self.executor_class, self.handler_class, '--server']
+        # stderr (incl. the output of the handler) is passed through to the stderr of this process
+        with mutex_popen:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def invoke(self, event, context=None):
+        # the handler instance is shared, hence events are processed one at a time
+        with self.lock:
+            if not self.process or self.process.poll() is not None:
+                if self.process:
+                    self.restarts += 1
+                self.start()
+            try:
+                self.process.stdin.write(json.dumps(event) + '\n')
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+            except IOError, e:
+                line = None
+            if not line:
+                self.stop()
+                self.restarts += 1
+                raise Exception('JVM of Lambda handler %s terminated unexpectedly' % self.handler_class)
+        response = json.loads(line)
+        if response['status'] != 'ok':
+            raise Exception('Lambda function failed: %s' % response.get('message'))
+        return response.get('result')
+
+    def stop(self):
+        process, self.process = self.process, None
+        if not process:
+            return
+        try:
+            process.stdin.close()
+        except IOError, e:
+            # e.g., the JVM has exited with unread input in the pipe
+            pass
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+        process.stdout.close()
+
+    def shutdown(self):
+        with self.lock:
+            self.stop()
@@ -7,9 +7,11 @@ import java.io.FileOutputStream;
 import java.io.InputStream;
 import java.io.InputStreamReader;
 import java.io.OutputStreamWriter;
+import java.io.PrintStream;
 import java.net.URL;
 import java.nio.ByteBuffer;
 import java.util.Date;
+import java.util.HashMap;
 import java.util.LinkedList;
 import java.util.List;
 import java.util.Map;
@@ -23,11 +25,14 @@ import com.fasterxml.jackson.databind.ObjectMapper;
 
 public class LambdaExecutor {
 
+	/** Pass this instead of the records file path to process events from stdin (see serve(..)). */
+	private static final String SERVER_MODE = "--server";
+
 	@SuppressWarnings("unchecked")
 	public static void main(String[] args) throws Exception {
 		if(args.length < 2) {
 			System.err.println("Usage: java " + LambdaExecutor.class.getSimpleName() +
-					"<lambdaClass> <recordsFilePath>");
+					" <lambdaClass> <recordsFilePath>|" + SERVER_MODE);
 			boolean test = true;
 			if(test) {
 				final String testFile = "/tmp/test.event.kinesis.json";
@@ -50,10 +55,59 @@ public class LambdaExecutor {
 
 		Class<RequestHandler<KinesisEvent, ?>> clazz = (Class<RequestHandler<KinesisEvent, ?>>) Class.forName(args[0]);
 		RequestHandler<KinesisEvent, ?> handler = clazz.newInstance();
-		KinesisEvent event = new KinesisEvent();
+		if(SERVER_MODE.equals(args[1])) {
+			serve(handler);
+			return;
+		}
 		ObjectMapper reader = new ObjectMapper();
 		String fileContent = readFile(args[1]);
 		Map<String,Object> map = reader.reader(Map.class).readValue(fileContent);
+		Context ctx = new LambdaContext();
+		handler.handleRequest(toKinesisEvent(map), ctx);
+	}
+
+	/**
+	 * Keep the handler loaded, and process the events read from stdin - one JSON document per line.
+	 * For each event, a JSON line {"status": "ok"|"error", ...} is written to stdout. The output of
+	 * the handler itself is redirected to stderr, to not interfere with the responses.
+	 */
+	private static void serve(RequestHandler<KinesisEvent, ?> handler) throws Exception {
+		PrintStream out = System.out;
+		System.setOut(System.err);
+		ObjectMapper mapper = new ObjectMapper();
+		BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+		Context ctx = new LambdaContext();
+		String line = null;
+		while((line = in.readLine()) != null) {
+			if(line.trim().isEmpty()) {
+				continue;
+			}
+			Map<String,Object> response = new HashMap<String,Object>();
+			try {
+				Map<String,Object> map = mapper.reader(Map.class).readValue(line);
+				Object result = handler.handleRequest(toKinesisEvent(map), ctx);
+				response.put("status", "ok");
+				response.put("result", result);
+			} catch (Throwable t) {
+				t.printStackTrace();
+				response.put("status", "error");
+				response.put("message", String.valueOf(t));
+			}
+			String content;
+			try {
+				content = mapper.writeValueAsString(response);
+			} catch (Exception e) {
+				response.remove("result");
+				content = mapper.writeValueAsString(response);
+			}
+			out.println(content);
+			out.flush();
+		}
+	}
+
+	@SuppressWarnings("unchecked")
+	private static KinesisEvent toKinesisEvent(Map<String,Object> map) {
+		KinesisEvent event = new KinesisEvent();
 		List<Map<String,Object>> records = (List<Map<String, Object>>) get(map, "Records");
 		event.setRecords(new LinkedList<KinesisEvent.KinesisEventRecord>());
 		for(Map<String,Object> record : records) {
@@ -66,8 +120,7 @@ public class LambdaExecutor {
 			kinesisRecord.setApproximateArrivalTimestamp(new Date());
 			r.setKinesis(kinesisRecord);
 		}
-		Context ctx = new LambdaContext();
-		handler.handleRequest(event, ctx);
+		return event;
 	}
 
 	private static <T> T get(Map<String,T> map, String key) {
@@ -4,6 +4,7 @@ import airspeed
 import requests
 import json
 import base64
+import hashlib
 import logging
 from elasticsearch import Elasticsearch
 from jsonpath_rw import jsonpath, parse
@@ -17,6 +18,13 @@ ENVIRONMENT_FILE = '.env.properties'
 # set up logger
 LOGGER = logging.getLogger(__name__)
 
+# compiled Velocity templates, by SHA-256 hash of the template content
+VELOCITY_TEMPLATES = {}
+# max. number of compiled templates to keep (the cache is cleared once it is full)
+MAX_VELOCITY_TEMPLATES = 1000
+# parsed JSONPath expressions used in Velocity templates, by expression
+JSONPATH_EXPRESSIONS = {}
+
 
 class Environment(object):
     def __init__(self, region=None, prefix=None):
@@ -139,7 +147,9 @@ class VelocityInput:
 
     def path(self, path):
         value = self.value if isinstance(self.value, dict) else json.loads(self.value)
-        jsonpath_expr = parse(path)
+        jsonpath_expr = JSONPATH_EXPRESSIONS.get(path)
+        if not jsonpath_expr:
+            jsonpath_expr = JSONPATH_EXPRESSIONS[path] = parse(path)
         result = [match.value for match in jsonpath_expr.find(value)]
         result = result[0] if len(result) == 1 else result
         return result
@@ -162,8 +172,22 @@ class VelocityUtil:
         return base64.b64decode(s)
 
 
+def get_velocity_template(template):
+    """ Return the compiled airspeed.Template for the given template content. """
+    content = template.encode('utf-8') if isinstance(template, unicode) else template
+    key = hashlib.sha256(content).hexdigest()
+    compiled = VELOCITY_TEMPLATES.get(key)
+    if not compiled:
+        compiled = airspeed.Template(template)
+        compiled.ensure_compiled()
+        if len(VELOCITY_TEMPLATES) >= MAX_VELOCITY_TEMPLATES:
+            VELOCITY_TEMPLATES.clear()
+        VELOCITY_TEMPLATES[key] = compiled
+    return compiled
+
+
 def render_velocity_template(template, context, as_json=False):
-    t = airspeed.Template(template)
+    t = get_velocity_template(template)
     variables = {
         'input': VelocityInput(context),
         'util': VelocityUtil()
@@ -201,6 +225,22 @@ def dynamodb_get_item_raw(dynamodb_url, request):
     return new_item
 
 
+def dynamodb_batch_get_item_raw(dynamodb_url, request):
+    headers = mock_aws_request_headers()
+    headers['X-Amz-Target'] = 'DynamoDB_20120810.BatchGetItem'
+    result = requests.post(dynamodb_url, data=json.dumps(request), headers=headers)
+    result = json.loads(result.text)
+    return result
+
+
+def dynamodb_describe_table_raw(dynamodb_url, table_name):
+    headers = mock_aws_request_headers()
+    headers['X-Amz-Target'] = 'DynamoDB_20120810.DescribeTable'
+    result = requests.post(dynamodb_url, data=json.dumps({'TableName': table_name}), headers=headers)
+    result = json.loads(result.text)
+    return result
+
+
 def mock_aws_request_headers(service='dynamodb'):
     ctype = APPLICATION_AMZ_JSON_1_0
     if service == 'kinesis':
@@ -216,8 +256,9 @@ def mock_aws_request_headers(service='dynamodb'):
     return headers
 
 
-def get_apigateway_integration(api_id, method, path, env=None):
-    apigateway = connect_to_service(service_name='apigateway', client=True, env=env)
+def get_apigateway_integration(api_id, method, path, env=None, apigateway=None):
+    if not apigateway:
+        apigateway = connect_to_service(service_name='apigateway', client=True, env=env)
 
     resources = apigateway.get_resources(
         restApiId=api_id,
@@ -245,16 +286,18 @@ def connect_elasticsearch():
     return es
 
 
-def delete_all_elasticsearch_indices(endpoint=None, env=None):
+def delete_all_elasticsearch_indices(env=None):
     """
     This function drops ALL indexes in Elasticsearch. Handle with care!
     """
-    env = aws_util.get_environment(env)
+    env = get_environment(env)
     if env.region != REGION_LOCAL:
         raise Exception('Refusing to delete ALL Elasticsearch indices outside of local dev environment.')
-    indices = aws_util.elasticsearch_get_indices(endpoint=endpoint, env=env)
-    for index in indices:
-        aws_util.elasticsearch_delete_index(index, endpoint=endpoint, env=env)
+    es = connect_elasticsearch()
+    indices = es.indices.get_aliases().keys()
+    if indices:
+        # delete all indices in a single request
+        es.indices.delete(index=','.join(indices))
 
 
 def delete_all_elasticsearch_data():
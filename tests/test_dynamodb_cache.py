@@ -0,0 +1,116 @@
+import __init__
+from localstack.mock.dynamodb_cache import ShadowItemCache, TableMetadataCache, MISSING
+
+KEY1 = {'id': {'S': '1'}}
+KEY2 = {'id': {'S': '2'}}
+ITEM1 = {'id': {'S': '1'}, 'data': {'S': 'x' * 100}}
+ITEM2 = {'id': {'S': '2'}, 'data': {'S': 'y' * 100}}
+
+
+def test_get_and_put():
+    cache = ShadowItemCache()
+    assert cache.get('table', KEY1) is MISSING
+    cache.put('table', KEY1, ITEM1)
+    assert cache.get('table', KEY1) == ITEM1
+    # the key is compared by value, regardless of the order of its attributes
+    cache.put('table', {'id': {'S': '3'}, 'sort': {'N': '1'}}, ITEM2)
+    assert cache.get('table', {'sort': {'N': '1'}, 'id': {'S': '3'}}) == ITEM2
+    # items of other tables are separate
+    assert cache.get('other', KEY1) is MISSING
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 2
+
+
+def test_deleted_items():
+    cache = ShadowItemCache()
+    cache.put('table', KEY1, None)
+    # a deleted item is known to not exist, as opposed to an unknown item
+    assert cache.get('table', KEY1) is None
+    cache.remove('table', KEY1)
+    assert cache.get('table', KEY1) is MISSING
+
+
+def test_peek_is_not_counted():
+    cache = ShadowItemCache()
+    cache.put('table', KEY1, ITEM1)
+    assert cache.peek('table', KEY1) == ITEM1
+    assert cache.peek('table', KEY2) is MISSING
+    assert cache.stats()['hits'] == 0
+    assert cache.stats()['misses'] == 0
+
+
+def test_lru_eviction():
+    cache = ShadowItemCache()
+    cache.put('table', KEY1, ITEM1)
+    item_size = cache.stats()['size']
+    cache.max_size = 2 * item_size
+    cache.put('table', KEY2, ITEM2)
+    # mark KEY1 as most recently used, hence KEY2 is evicted next
+    cache.get('table', KEY1)
+    cache.put('table', {'id': {'S': '3'}}, ITEM1)
+    assert cache.peek('table', KEY2) is MISSING
+    assert cache.peek('table', KEY1) == ITEM1
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size'] <= cache.max_size
+
+
+def test_replace_updates_size():
+    cache = ShadowItemCache()
+    cache.put('table', KEY1, ITEM1)
+    size = cache.stats()['size']
+    cache.put('table', KEY1, ITEM1)
+    assert cache.stats()['size'] == size
+    assert cache.stats()['items'] == 1
+
+
+def test_clear():
+    cache = ShadowItemCache()
+    cache.put('table1', KEY1, ITEM1)
+    cache.put('table2', KEY1, ITEM1)
+    cache.clear('table1')
+    assert cache.peek('table1', KEY1) is MISSING
+    assert cache.peek('table2', KEY1) == ITEM1
+    cache.clear()
+    assert cache.stats()['items'] == 0
+    assert cache.stats()['size'] == 0
+
+
+def table_description(name, keys, stream_view_type=None):
+    description = {'TableName': name, 'KeySchema': [{'AttributeName': key} for key in keys]}
+    if stream_view_type:
+        description['StreamSpecification'] = {'StreamEnabled': True, 'StreamViewType': stream_view_type}
+    return description
+
+
+def test_table_metadata_loaded_on_demand():
+    loaded = []
+
+    def loader(table_name):
+        loaded.append(table_name)
+        if table_name == 'table':
+            return table_description('table', ['id', 'sort'], 'NEW_AND_OLD_IMAGES')
+
+    tables = TableMetadataCache(loader)
+    table = tables.get('table')
+    assert table.key_attributes == ('id', 'sort')
+    assert table.stream_view_type == 'NEW_AND_OLD_IMAGES'
+    item = {'id': {'S': '1'}, 'sort': {'N': '2'}, 'data': {'S': 'x'}}
+    assert table.extract_keys(item) == {'id': {'S': '1'}, 'sort': {'N': '2'}}
+    assert tables.get('table') is table
+    # unknown tables are not cached, as they may be created later on
+    assert tables.get('unknown') is None
+    assert tables.get('unknown') is None
+    assert loaded == ['table', 'unknown', 'unknown']
+
+
+def test_table_metadata_invalidation():
+    descriptions = {'table': table_description('table', ['id'])}
+    tables = TableMetadataCache(lambda table_name: descriptions.get(table_name))
+    assert tables.get('table').stream_view_type is None
+    descriptions['table'] = table_description('table', ['id'], 'KEYS_ONLY')
+    assert tables.get('table').stream_view_type is None
+    tables.invalidate('table')
+    assert tables.get('table').stream_view_type == 'KEYS_ONLY'
+    tables.put(table_description('other', ['key']))
+    tables.invalidate()
+    assert tables.tables == {}
@@ -0,0 +1,414 @@
+import __init__
+import json
+import time
+import socket
+import errno
+import httplib
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler
+from localstack.mock import generic_proxy
+from localstack.mock.generic_proxy import BackendConnectionPool, ThreadedHTTPServer, GenericProxy
+from localstack.mock.generic_proxy import ENGINE_THREADED, ENGINE_ASYNC, listener_for
+from localstack.mock.generic_proxy import ListenerQueue, AdmissionController, OVERFLOW_SPILL, OVERFLOW_DROP
+from localstack.utils.common import FuncThread
+
+SLOW_RESPONSE_SECS = 1
+HANGING_RESPONSE_SECS = 3
+ENGINES = [ENGINE_THREADED, ENGINE_ASYNC]
+
+
+class BackendHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.requests.append((self.path, body))
+        if self.path == '/slow':
+            threading.Event().wait(SLOW_RESPONSE_SECS)
+        if self.path == '/hang':
+            threading.Event().wait(HANGING_RESPONSE_SECS)
+        self.send_response(200)
+        if self.path == '/chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 3):
+                self.wfile.write('%x\r\n%s\r\n' % (len(body[i:i + 3]), body[i:i + 3]))
+            self.wfile.write('0\r\n\r\n')
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class BackendServer(ThreadedHTTPServer):
+    def handle_error(self, request, client_address):
+        # e.g., the client has closed the connection after a timeout
+        return
+
+
+def start_backend():
+    server = BackendServer(('localhost', 0), BackendHandler)
+    server.requests = []
+    FuncThread(lambda params: server.serve_forever(), None, quiet=True).start()
+    return server
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def is_port_open(port):
+    sock = socket.socket()
+    try:
+        return sock.connect_ex(('localhost', port)) == 0
+    finally:
+        sock.close()
+
+
+def start_proxy(backend, **kwargs):
+    proxy = GenericProxy(free_port(), 'localhost:%s' % backend.server_port, **kwargs)
+    proxy.start()
+    assert wait_until(lambda: is_port_open(proxy.port))
+    return proxy
+
+
+def post(conn, path, body, headers={}):
+    conn.request('POST', path, body, headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def test_pool_reuses_connections():
+    backend = start_backend()
+    pool = BackendConnectionPool('localhost:%s' % backend.server_port)
+    try:
+        for i in range(3):
+            conn, response = pool.request('POST', '/', body='data%s' % i)
+            assert response.read() == 'data%s' % i
+            pool.release(conn, response)
+        assert pool.stats()['hits'] == 2
+        assert pool.stats()['misses'] == 1
+    finally:
+        pool.close()
+        backend.shutdown()
+
+
+def test_pool_does_not_retry_timeouts():
+    backend = start_backend()
+    pool = BackendConnectionPool('localhost:%s' % backend.server_port, timeout=0.2)
+    try:
+        conn, response = pool.request('POST', '/', body='first')
+        response.read()
+        pool.release(conn, response)
+        # the request on the reused connection times out - it must not be sent a second time
+        try:
+            pool.request('POST', '/slow', body='second')
+            assert False, 'Expected the request to time out'
+        except socket.timeout, e:
+            pass
+        threading.Event().wait(SLOW_RESPONSE_SECS + 0.5)
+        assert [path for path, body in backend.requests] == ['/', '/slow']
+        assert pool.stats()['retries'] == 0
+    finally:
+        pool.close()
+        backend.shutdown()
+
+
+def test_stale_connection_errors():
+    assert generic_proxy.is_stale_send_error(socket.error(errno.EPIPE, 'Broken pipe'))
+    assert generic_proxy.is_stale_send_error(socket.error(errno.ECONNRESET, 'Connection reset by peer'))
+    assert not generic_proxy.is_stale_send_error(socket.timeout('timed out'))
+    assert not generic_proxy.is_stale_send_error(socket.error(errno.ECONNREFUSED, 'Connection refused'))
+    assert generic_proxy.is_stale_response_error(httplib.BadStatusLine(''))
+    assert generic_proxy.is_stale_response_error(
+        httplib.BadStatusLine('No status line received - the server has closed the connection'))
+    assert not generic_proxy.is_stale_response_error(httplib.BadStatusLine('garbage'))
+    assert not generic_proxy.is_stale_response_error(socket.timeout('timed out'))
+
+
+def run_with_engines(test):
+    for engine in ENGINES:
+        backend = start_backend()
+        try:
+            test(backend, engine)
+        finally:
+            backend.shutdown()
+
+
+def test_keep_alive_connections():
+    def check(backend, engine):
+        proxy = start_proxy(backend, engine=engine)
+        try:
+            conn = httplib.HTTPConnection('localhost', proxy.port)
+            for i in range(3):
+                assert post(conn, '/', 'data%s' % i) == (200, 'data%s' % i)
+                if i == 0:
+                    sock = conn.sock
+                # the client connection is kept open across requests
+                assert conn.sock is sock
+            pool = 'async_pool' if engine == ENGINE_ASYNC else 'pool'
+            assert proxy.stats()[pool]['hits'] == 2
+            conn.close()
+        finally:
+            proxy.stop(quiet=True)
+
+    run_with_engines(check)
+
+
+def test_chunked_bodies():
+    def check(backend, engine):
+        proxy = start_proxy(backend, engine=engine)
+        try:
+            conn = httplib.HTTPConnection('localhost', proxy.port)
+            conn.putrequest('POST', '/')
+            conn.putheader('Transfer-Encoding', 'chunked')
+            conn.endheaders()
+            for chunk in ['hello', ' chunked', ' world']:
+                conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            conn.send('0\r\n\r\n')
+            response = conn.getresponse()
+            assert response.read() == 'hello chunked world'
+            # the backend has received the body with a Content-Length
+            assert backend.requests[-1] == ('/', 'hello chunked world')
+            # chunked responses of the backend are passed on to the client
+            assert post(conn, '/chunked', 'chunked response') == (200, 'chunked response')
+            conn.close()
+        finally:
+            proxy.stop(quiet=True)
+
+    run_with_engines(check)
+
+
+def test_listener_filtering():
+    def check(backend, engine):
+        calls = []
+
+        @listener_for(targets=['Test.Put'])
+        def listener(method, path, data, headers, response=None, return_forward_info=False):
+            if not return_forward_info:
+                calls.append((data, response.status_code, response.content))
+            return True
+
+        proxy = start_proxy(backend, engine=engine, update_listener=listener, streaming=True)
+        try:
+            conn = httplib.HTTPConnection('localhost', proxy.port)
+            body = json.dumps({'key': 'value'})
+            assert post(conn, '/', body, {'X-Amz-Target': 'Test.Get'}) == (200, body)
+            assert post(conn, '/', body, {'X-Amz-Target': 'Test.Put'}) == (200, body)
+            assert wait_until(lambda: calls)
+            assert calls == [({'key': 'value'}, 200, body)]
+            conn.close()
+        finally:
+            proxy.stop(quiet=True)
+
+    run_with_engines(check)
+
+
+def test_backend_timeout():
+    def check(backend, engine):
+        proxy = start_proxy(backend, engine=engine, backend_timeout=0.5, max_concurrent=1)
+        try:
+            conn = httplib.HTTPConnection('localhost', proxy.port)
+            start = time.time()
+            assert post(conn, '/hang', 'data') == (504, '')
+            assert time.time() - start < HANGING_RESPONSE_SECS
+            # the admission slot of the request has been released
+            assert wait_until(lambda: proxy.admission.stats()['in_flight'] == 0)
+            conn.close()
+        finally:
+            proxy.stop(quiet=True)
+
+    run_with_engines(check)
+
+
+def test_admission_rejects_excess_requests():
+    def check(backend, engine):
+        proxy = start_proxy(backend, engine=engine, max_concurrent=1, admission_timeout=0.2)
+        try:
+            results = []
+            slow = FuncThread(lambda params: results.append(
+                post(httplib.HTTPConnection('localhost', proxy.port), '/slow', 'slow')), None, quiet=True)
+            slow.start()
+            assert wait_until(lambda: backend.requests)
+            conn = httplib.HTTPConnection('localhost', proxy.port)
+            conn.request('POST', '/', 'rejected')
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 503
+            assert response.getheader('Retry-After')
+            slow.join()
+            assert results == [(200, 'slow')]
+            assert wait_until(lambda: proxy.admission.stats()['in_flight'] == 0)
+            assert post(conn, '/', 'admitted') == (200, 'admitted')
+            conn.close()
+        finally:
+            proxy.stop(quiet=True)
+
+    run_with_engines(check)
+
+
+def test_listener_queue_keeps_order_per_key():
+    calls = []
+
+    def listener(key, index):
+        # make later invocations faster, to provoke reordering among concurrent workers
+        time.sleep(0.01 * (5 - index))
+        calls.append((key, index))
+
+    queue = ListenerQueue(listener, size=100, workers=4, key=lambda invocation: invocation['key'])
+    try:
+        for index in range(5):
+            for key in ['table1', 'table2', 'table3']:
+                queue.put(key=key, index=index)
+        assert wait_until(lambda: len(calls) == 15)
+        for key in ['table1', 'table2', 'table3']:
+            assert [index for k, index in calls if k == key] == range(5)
+        assert queue.stats()['processed'] == 15
+    finally:
+        queue.stop()
+
+
+def test_listener_queue_spills_in_order():
+    calls = []
+    blocked = threading.Event()
+
+    def listener(index):
+        blocked.wait()
+        calls.append(index)
+
+    queue = ListenerQueue(listener, size=2, workers=1, overflow=OVERFLOW_SPILL)
+    try:
+        for index in range(10):
+            queue.put(index=index)
+        assert queue.stats()['spilled'] > 0
+        blocked.set()
+        assert wait_until(lambda: len(calls) == 10)
+        assert calls == range(10)
+        assert queue.stats()['depth'] == 0
+    finally:
+        queue.stop()
+
+
+def test_listener_queue_drops_when_full():
+    blocked = threading.Event()
+    queue = ListenerQueue(lambda index: blocked.wait(), size=2, workers=1, overflow=OVERFLOW_DROP)
+    try:
+        for index in range(10):
+            queue.put(index=index)
+        # one invocation is running, two are queued
+        assert queue.stats()['dropped'] >= 7
+    finally:
+        blocked.set()
+        queue.stop()
+
+
+def test_admission_queues_and_hands_over():
+    controller = AdmissionController(1, max_queue=1, timeout=5)
+    assert controller.acquire()
+    results = []
+    waiter = FuncThread(lambda params: results.append(controller.acquire()), None, quiet=True)
+    waiter.start()
+    assert wait_until(lambda: controller.stats()['waiting'] == 1)
+    # the queue is full
+    assert controller.try_acquire(admit=lambda: None) is False
+    controller.release()
+    waiter.join()
+    assert results == [True]
+    controller.release()
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_admission_release_racing_with_timeout():
+
+    class RacingEvent(object):
+        """The slot is handed over by release() right as the wait times out, before the event is set."""
+
+        def set(self):
+            pass
+
+        def is_set(self):
+            return False
+
+        def wait(self, timeout):
+            controller.release()
+
+    controller = AdmissionController(1, max_queue=1, timeout=0.01, event_factory=RacingEvent)
+    assert controller.acquire()
+    # the slot has been handed over, hence it must be owned (and released) by the waiter
+    assert controller.acquire()
+    controller.release()
+    assert controller.stats()['in_flight'] == 0
+    assert controller.stats()['waiting'] == 0
+
+
+def test_admission_under_contention():
+    controller = AdmissionController(2, max_queue=100, timeout=0.002)
+
+    def run(params):
+        for i in range(200):
+            if controller.acquire():
+                controller.release()
+
+    threads = [FuncThread(run, None, quiet=True) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = controller.stats()
+    assert stats['in_flight'] == 0
+    assert stats['waiting'] == 0
+    assert stats['admitted'] + stats['rejected'] == 8 * 200
+
+
+def test_backend_not_restarted_by_waiting_requests():
+    attempts = []
+    starting = threading.Event()
+
+    def start_backend():
+        attempts.append(time.time())
+        if len(attempts) == 1:
+            starting.wait()
+            raise Exception('Backend not ready')
+
+    proxy = GenericProxy(free_port(), 'localhost:0', backend_starter=start_backend)
+    errors = []
+
+    def request(params):
+        try:
+            proxy.ensure_backend()
+        except Exception, e:
+            errors.append(e)
+
+    threads = [FuncThread(request, None, quiet=True) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    assert wait_until(lambda: attempts)
+    # give the other requests time to wait for the attempt in progress
+    time.sleep(0.2)
+    starting.set()
+    for thread in threads:
+        thread.join()
+    # the requests which have waited for the failed attempt fail as well, without starting the backend again
+    assert len(attempts) == 1
+    assert len(errors) == 3
+    assert not proxy.backend_started
+    # the next request tries again
+    proxy.ensure_backend()
+    assert len(attempts) == 2
+    assert proxy.backend_started
@@ -0,0 +1,135 @@
+import __init__
+import json
+from localstack.mock import infra, lambda_api
+from localstack.mock.dynamodb_cache import MISSING
+from localstack.utils.aws import aws_stack
+
+
+class FakeResponse(object):
+    def __init__(self, content, status_code=200):
+        self.status_code = status_code
+        self.text = self.content = json.dumps(content)
+
+
+class FakeDynamoDB(object):
+    def __init__(self, tables, deletable=True):
+        self.tables = list(tables)
+        self.deletable = deletable
+
+    def list_tables(self):
+        return {'TableNames': list(self.tables)}
+
+    def delete_table(self, TableName):
+        if self.deletable:
+            self.tables.remove(TableName)
+
+
+def test_reset_dynamodb():
+    client = FakeDynamoDB(['table1', 'table2'])
+    infra.reset_dynamodb(client)
+    assert client.tables == []
+
+
+def test_reset_dynamodb_reports_timeout():
+    timeout = infra.RESET_TIMEOUT
+    infra.RESET_TIMEOUT = 0.1
+    try:
+        infra.reset_dynamodb(FakeDynamoDB(['table1'], deletable=False))
+        assert False, 'Expected the reset to fail'
+    except Exception, e:
+        assert 'table1' in str(e)
+    finally:
+        infra.RESET_TIMEOUT = timeout
+
+
+def create_table(table_name, view_type='NEW_AND_OLD_IMAGES', mapping=True):
+    """ Register the metadata of a table with a stream, and (optionally) an event source mapping for the stream. """
+    infra.DYNAMODB_TABLES.put({'TableName': table_name, 'KeySchema': [{'AttributeName': 'id'}],
+        'StreamSpecification': {'StreamEnabled': True, 'StreamViewType': view_type}})
+    if mapping:
+        stream_arn = '%s/stream/label' % aws_stack.dynamodb_table_arn(table_name)
+        return lambda_api.add_event_source('test_function', stream_arn, enabled=False)
+
+
+def delete_table(table_name, mapping=None):
+    if mapping:
+        lambda_api.delete_event_source(mapping['UUID'])
+    infra.DYNAMODB_TABLES.invalidate(table_name)
+    infra.DYNAMODB_ITEM_CACHE.clear(table_name)
+
+
+def test_batch_write_skips_unprocessed_items():
+    table_name = 'test_batch_write'
+    mapping = create_table(table_name)
+    sent = []
+    send_stream_records = infra.dynamodb_send_stream_records
+    infra.dynamodb_send_stream_records = lambda table_name, records: sent.extend(records)
+    try:
+        requests = [{'PutRequest': {'Item': {'id': {'S': str(i)}, 'data': {'N': str(i)}}}} for i in range(5)]
+        for request in requests:
+            infra.DYNAMODB_ITEM_CACHE.put(table_name, {'id': request['PutRequest']['Item']['id']}, None)
+        unprocessed = {table_name: [requests[1], requests[3]]}
+        infra.dynamodb_process_batch_write({'RequestItems': {table_name: requests}},
+            {'UnprocessedItems': unprocessed})
+        assert [r['dynamodb']['Keys']['id']['S'] for r in sent] == ['0', '2', '4']
+        assert [r['eventName'] for r in sent] == ['INSERT'] * 3
+    finally:
+        infra.dynamodb_send_stream_records = send_stream_records
+        delete_table(table_name, mapping)
+
+
+def test_batch_write_reads_uncached_items():
+    table_name = 'test_batch_write_uncached'
+    mapping = create_table(table_name)
+    existing = {'id': {'S': '1'}, 'data': {'S': 'old'}}
+    sent = []
+    requests = []
+    send_stream_records = infra.dynamodb_send_stream_records
+    batch_get_item = aws_stack.dynamodb_batch_get_item_raw
+    infra.dynamodb_send_stream_records = lambda table_name, records: sent.extend(records)
+    aws_stack.dynamodb_batch_get_item_raw = lambda url, request: requests.append(request) or {
+        'Responses': {table_name: [existing]}, 'UnprocessedKeys': {}}
+    try:
+        data = {'RequestItems': {table_name: [
+            {'PutRequest': {'Item': {'id': {'S': '1'}, 'data': {'S': 'new'}}}},
+            {'PutRequest': {'Item': {'id': {'S': '2'}, 'data': {'S': 'new'}}}},
+            {'DeleteRequest': {'Key': {'id': {'S': '3'}}}}]}}
+        headers = {'X-Amz-Target': 'DynamoDB_20120810.BatchWriteItem'}
+        infra.update_dynamodb('POST', '/', data, headers, return_forward_info=True)
+        # the items which are not in the cache are read with one request
+        assert len(requests) == 1
+        assert len(requests[0]['RequestItems'][table_name]['Keys']) == 3
+        infra.dynamodb_process_batch_write(data, {'UnprocessedItems': {}})
+        # the overwritten item is a modification, and the deleted item did not exist
+        assert [r['eventName'] for r in sent] == ['MODIFY', 'INSERT']
+        assert sent[0]['dynamodb']['OldImage'] == existing
+        assert 'OldImage' not in sent[1]['dynamodb']
+    finally:
+        infra.dynamodb_send_stream_records = send_stream_records
+        aws_stack.dynamodb_batch_get_item_raw = batch_get_item
+        delete_table(table_name, mapping)
+
+
+def test_no_item_images_without_event_sources():
+    table_name = 'test_no_event_sources'
+    headers = {'X-Amz-Target': 'DynamoDB_20120810.PutItem'}
+    data = {'TableName': table_name, 'Item': {'id': {'S': '1'}}}
+    create_table(table_name, mapping=False)
+    mapping = None
+    try:
+        # the request is passed on unchanged, and the item is not cached
+        assert infra.update_dynamodb('POST', '/', data, headers, return_forward_info=True) is True
+        infra.DYNAMODB_ITEM_CACHE.put(table_name, {'id': {'S': '1'}}, {'id': {'S': '1'}})
+        response = FakeResponse({})
+        assert infra.update_dynamodb('POST', '/', data, headers, response=response) is None
+        assert infra.DYNAMODB_ITEM_CACHE.peek(table_name, {'id': {'S': '1'}}) is MISSING
+        # the backend returns the image required for the stream records of a subscribed table
+        mapping = create_table(table_name)
+        request = infra.update_dynamodb('POST', '/', data, headers, return_forward_info=True)
+        assert request.data['ReturnValues'] == 'ALL_OLD'
+        # tables with a disabled stream do not require any images
+        infra.DYNAMODB_TABLES.put({'TableName': table_name, 'KeySchema': [{'AttributeName': 'id'}],
+            'StreamSpecification': {'StreamEnabled': False, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}})
+        assert infra.dynamodb_stream_view_type(table_name) is None
+    finally:
+        delete_table(table_name, mapping)
@@ -0,0 +1,159 @@
+import __init__
+import os
+import time
+import base64
+import tempfile
+from botocore.exceptions import ClientError
+from localstack.mock import lambda_api
+from localstack.mock.lambda_api import KinesisCheckpoints, KinesisPoller, ShardState
+
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:000000000000:function:test'
+STREAM_ARN = 'arn:aws:kinesis:us-east-1:000000000000:stream/test_stream'
+OTHER_STREAM_ARN = 'arn:aws:kinesis:us-east-1:000000000000:stream/other_stream'
+
+
+def new_checkpoints_file():
+    fd, file = tempfile.mkstemp()
+    os.close(fd)
+    os.remove(file)
+    return file
+
+
+def test_checkpoints_persisted():
+    file = new_checkpoints_file()
+    try:
+        checkpoints = KinesisCheckpoints(file)
+        checkpoints.put(FUNCTION_ARN, STREAM_ARN, 'created1', 'shard-1', '100')
+        # the checkpoints are written with a delay, or when flushed
+        assert not os.path.exists(file)
+        checkpoints.flush()
+        # the checkpoints are reloaded from the file, e.g., after a restart
+        checkpoints = KinesisCheckpoints(file)
+        assert checkpoints.get(FUNCTION_ARN, STREAM_ARN, 'created1', 'shard-1') == '100'
+        # a stream re-created with the same name does not inherit the checkpoints of the old one
+        assert checkpoints.get(FUNCTION_ARN, STREAM_ARN, 'created2', 'shard-1') is None
+        checkpoints.remove(FUNCTION_ARN, STREAM_ARN, 'created1', 'shard-1')
+        checkpoints.flush()
+        assert KinesisCheckpoints(file).get(FUNCTION_ARN, STREAM_ARN, 'created1', 'shard-1') is None
+    finally:
+        os.remove(file)
+
+
+def test_checkpoints_cleared():
+    file = new_checkpoints_file()
+    try:
+        checkpoints = KinesisCheckpoints(file)
+        checkpoints.put(FUNCTION_ARN, STREAM_ARN, 'created', 'shard-1', '100')
+        checkpoints.put(FUNCTION_ARN, OTHER_STREAM_ARN, 'created', 'shard-1', '200')
+        checkpoints.clear('test_stream')
+        assert checkpoints.get(FUNCTION_ARN, STREAM_ARN, 'created', 'shard-1') is None
+        assert checkpoints.get(FUNCTION_ARN, OTHER_STREAM_ARN, 'created', 'shard-1') == '200'
+        checkpoints.clear()
+        assert KinesisCheckpoints(file).load() == {}
+    finally:
+        os.remove(file)
+
+
+class FakeKinesis(object):
+    def __init__(self):
+        self.requests = []
+
+    def get_shard_iterator(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs['ShardIteratorType'] == 'AFTER_SEQUENCE_NUMBER':
+            error = {'Error': {'Code': 'InvalidArgumentException', 'Message': 'Invalid sequence number'}}
+            raise ClientError(error, 'GetShardIterator')
+        return {'ShardIterator': 'iterator-%s' % kwargs['ShardIteratorType']}
+
+
+def test_invalid_checkpoint_falls_back_to_starting_position():
+    file = new_checkpoints_file()
+    checkpoints, client = lambda_api.kinesis_checkpoints, lambda_api.kinesis_client
+    lambda_api.kinesis_checkpoints = KinesisCheckpoints(file)
+    lambda_api.kinesis_client = FakeKinesis()
+    mapping = {'FunctionArn': FUNCTION_ARN, 'EventSourceArn': STREAM_ARN,
+        'State': 'Disabled', 'StartingPosition': 'TRIM_HORIZON'}
+    poller = KinesisPoller(mapping)
+    try:
+        poller.stream_created = 'created'
+        lambda_api.kinesis_checkpoints.put(FUNCTION_ARN, STREAM_ARN, 'created', 'shard-1', '100')
+        iterator = poller.get_iterator(ShardState('shard-1'))
+        assert iterator == 'iterator-TRIM_HORIZON'
+        types = [r['ShardIteratorType'] for r in lambda_api.kinesis_client.requests]
+        assert types == ['AFTER_SEQUENCE_NUMBER', 'TRIM_HORIZON']
+        # the invalid checkpoint has been discarded
+        assert lambda_api.kinesis_checkpoints.get(FUNCTION_ARN, STREAM_ARN, 'created', 'shard-1') is None
+    finally:
+        poller.stop()
+        poller.thread.join(5)
+        lambda_api.kinesis_checkpoints.flush()
+        lambda_api.kinesis_checkpoints, lambda_api.kinesis_client = checkpoints, client
+        if os.path.exists(file):
+            os.remove(file)
+
+
+class FakeStream(FakeKinesis):
+    """ Kinesis client with a single shard, whose iterators are positions in the list of records. """
+
+    def __init__(self):
+        FakeKinesis.__init__(self)
+        self.records = []
+
+    def describe_stream(self, StreamName):
+        return {'StreamDescription': {'StreamCreationTimestamp': 'created', 'Shards': [{'ShardId': 'shard-1'}]}}
+
+    def get_shard_iterator(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs['ShardIteratorType'] == 'LATEST':
+            return {'ShardIterator': str(len(self.records))}
+        if kwargs['ShardIteratorType'] == 'AFTER_SEQUENCE_NUMBER':
+            return {'ShardIterator': str(int(kwargs['StartingSequenceNumber']) + 1)}
+        return {'ShardIterator': '0'}
+
+    def get_records(self, ShardIterator, Limit):
+        position = int(ShardIterator)
+        records = self.records[position:position + Limit]
+        return {'Records': records, 'NextShardIterator': str(position + len(records))}
+
+    def put_record(self, data):
+        self.records.append({'Data': data, 'PartitionKey': 'key', 'SequenceNumber': str(len(self.records))})
+
+
+def test_records_put_after_creating_mapping_are_delivered():
+    file = new_checkpoints_file()
+    checkpoints, client = lambda_api.kinesis_checkpoints, lambda_api.kinesis_client
+    lambda_api.kinesis_checkpoints = KinesisCheckpoints(file)
+    lambda_api.kinesis_client = FakeStream()
+    events = []
+    try:
+        lambda_api.kinesis_client.put_record('before')
+        lambda_api.add_function_mapping('test', lambda event, context: events.append(event))
+        lambda_api.add_event_source('test', STREAM_ARN, starting_position='LATEST')
+        # the record is put before the poller's first poll, but after the mapping has been created
+        lambda_api.kinesis_client.put_record('after')
+        deadline = time.time() + 5
+        while not events and time.time() < deadline:
+            time.sleep(0.05)
+        data = [base64.b64decode(r['kinesis']['data']) for e in events for r in e['Records']]
+        assert data == ['after']
+    finally:
+        pollers = lambda_api.kinesis_pollers.values()
+        lambda_api.cleanup()
+        for poller in pollers:
+            poller.thread.join(5)
+        lambda_api.kinesis_checkpoints, lambda_api.kinesis_client = checkpoints, client
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def test_run_lambda_without_handler():
+    # the error is handled (logged, or raised to the caller) like errors of the handler itself
+    assert lambda_api.run_lambda(None, {}, {}, lambda_cwd=tempfile.gettempdir()) is None
+    try:
+        lambda_api.run_lambda(None, {}, {}, lambda_cwd=tempfile.gettempdir(), raise_errors=True)
+        assert False, 'Expected the invocation to fail'
+    except AttributeError, e:
+        pass
+    # the CWD lock has not been acquired
+    assert lambda_api.cwd_mutex.acquire(False)
+    lambda_api.cwd_mutex.release()
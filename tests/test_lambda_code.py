@@ -0,0 +1,156 @@
+import __init__
+import os
+import time
+import shutil
+import zipfile
+import threading
+import tempfile
+from cStringIO import StringIO
+from localstack.mock.lambda_code import CodeStore, CODE_ZIP, CODE_JAR
+from localstack.utils.common import FuncThread
+
+HANDLER = 'def handler(event, context):\n    return %s\n'
+
+
+def create_zip(files):
+    content = StringIO()
+    archive = zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED)
+    for name, data in files.items():
+        archive.writestr(name, data)
+    archive.close()
+    return content.getvalue()
+
+
+def new_store(**kwargs):
+    return CodeStore(base_dir=os.path.join(tempfile.mkdtemp(), 'code'), **kwargs)
+
+
+def test_identical_code_is_shared():
+    store = new_store()
+    try:
+        archive = create_zip({'handler.py': HANDLER % 1, 'helper.py': ''})
+        entry1 = store.checkout('function1', archive)
+        entry2 = store.checkout('function2', archive)
+        assert entry1 is entry2
+        assert entry1.kind == CODE_ZIP
+        assert entry1.script == HANDLER % 1
+        assert os.path.isfile(os.path.join(entry1.path, 'helper.py'))
+        assert entry1.owners == set(['function1', 'function2'])
+        assert store.stats()['misses'] == 1
+        assert store.stats()['hits'] == 1
+        # re-deploying a function with other code releases the old code
+        store.checkout('function1', create_zip({'handler.py': HANDLER % 2}))
+        assert entry1.owners == set(['function2'])
+    finally:
+        shutil.rmtree(os.path.dirname(store.base_dir))
+
+
+def test_removed_files_are_stored_again():
+    store = new_store()
+    try:
+        archive = create_zip({'handler.py': HANDLER % 1, 'helper.py': 'VALUE = 1\n'})
+        entry = store.checkout('function1', archive)
+        # e.g., the temporary files have been cleaned up while the entry is still in the store
+        shutil.rmtree(store.base_dir)
+        new_entry = store.checkout('function2', archive)
+        assert new_entry is not entry
+        assert os.path.isfile(os.path.join(new_entry.path, 'helper.py'))
+        assert new_entry.owners == set(['function1', 'function2'])
+        assert store.stats()['entries'] == 1
+        assert store.stats()['misses'] == 2
+    finally:
+        shutil.rmtree(os.path.dirname(store.base_dir))
+
+
+def test_eviction_of_unused_code():
+    jar = 'META-INF KinesisEvent class' + 'x' * 100
+    store = new_store(disk_quota=len(jar))
+    try:
+        jar_entry = store.checkout('function1', jar)
+        assert jar_entry.kind == CODE_JAR
+        zip_entry = store.checkout('function2', create_zip({'handler.py': HANDLER % 2}))
+        # the code in use is never evicted
+        store.checkout('function3', create_zip({'handler.py': HANDLER % 3}))
+        assert store.stats()['evictions'] == 0
+        # the least recently used code is evicted first, even if its files are gone already
+        os.remove(jar_entry.path)
+        store.release_all()
+        assert jar_entry.hash not in store.entries
+        assert zip_entry.hash in store.entries
+        assert store.stats()['size'] <= store.disk_quota
+        assert store.stats()['evictions'] == 1
+        # once the quota is exceeded, the extracted trees are removed as well
+        store.disk_quota = 0
+        store.evict()
+        assert not store.entries
+        assert not os.path.exists(zip_entry.path)
+    finally:
+        shutil.rmtree(os.path.dirname(store.base_dir))
+
+
+class SlowCodeStore(CodeStore):
+    def store(self, hash, content):
+        time.sleep(0.3)
+        return CodeStore.store(self, hash, content)
+
+
+def test_archives_extracted_concurrently():
+    store = SlowCodeStore(base_dir=os.path.join(tempfile.mkdtemp(), 'code'))
+    try:
+        archives = [create_zip({'handler.py': HANDLER % i}) for i in range(2)] * 2
+        entries = []
+        threads = [FuncThread(lambda archive: entries.append(store.checkout(archive, archive)), archive, quiet=True)
+            for archive in archives]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # different archives are extracted in parallel, and each archive is extracted once
+        assert time.time() - start < 0.55
+        assert len(entries) == 4
+        assert store.stats()['misses'] == 2
+        assert store.stats()['entries'] == 2
+    finally:
+        shutil.rmtree(os.path.dirname(store.base_dir))
+
+
+class CheckedLock(object):
+    """ Lock of a CodeStore which records whether a stored archive is visible neither as in-flight,
+        nor as entry, whenever the lock is released (another checkout would then extract it again). """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.RLock()
+        self.gaps = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *args):
+        for hash in self.store.stored:
+            if hash not in self.store.storing and hash not in self.store.entries:
+                self.gaps += 1
+        self.lock.release()
+
+
+class CheckedCodeStore(CodeStore):
+    def __init__(self, *args, **kwargs):
+        CodeStore.__init__(self, *args, **kwargs)
+        self.lock = CheckedLock(self)
+        self.stored = []
+
+    def store(self, hash, content):
+        entry = CodeStore.store(self, hash, content)
+        self.stored.append(hash)
+        return entry
+
+
+def test_stored_archive_always_visible():
+    store = CheckedCodeStore(base_dir=os.path.join(tempfile.mkdtemp(), 'code'))
+    try:
+        store.checkout('function1', create_zip({'handler.py': HANDLER % 1}))
+        assert store.stored
+        assert store.lock.gaps == 0
+    finally:
+        shutil.rmtree(os.path.dirname(store.base_dir))
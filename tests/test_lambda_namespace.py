@@ -0,0 +1,83 @@
+import __init__
+import os
+import sys
+import shutil
+import tempfile
+from localstack.mock.lambda_namespace import FunctionNamespace
+
+
+def create_function_dir(files):
+    cwd = tempfile.mkdtemp()
+    for name, content in files.items():
+        path = os.path.join(cwd, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+    return cwd
+
+
+def test_relative_paths_and_imports():
+    cwd = create_function_dir({
+        'config.txt': 'from file',
+        'helper.py': 'def read():\n    return open("config.txt").read()\n',
+        'handler.py': 'import helper\ndef handler(event, context):\n    return helper.read()\n'
+    })
+    try:
+        namespace = FunctionNamespace(cwd)
+        scope = namespace.exec_script(open(os.path.join(cwd, 'handler.py')).read(), os.path.join(cwd, 'handler.py'))
+        assert scope['handler'](None, None) == 'from file'
+        # the modules of the function are not registered globally
+        assert 'helper' not in sys.modules
+        assert 'helper' in namespace.modules
+    finally:
+        shutil.rmtree(cwd)
+
+
+def test_modules_with_same_name_are_isolated():
+    cwd1 = create_function_dir({'helper.py': 'VALUE = 1\n'})
+    cwd2 = create_function_dir({'helper.py': 'VALUE = 2\n'})
+    try:
+        script = 'import helper\nvalue = helper.VALUE\n'
+        assert FunctionNamespace(cwd1).exec_script(script, os.path.join(cwd1, 'handler.py'))['value'] == 1
+        assert FunctionNamespace(cwd2).exec_script(script, os.path.join(cwd2, 'handler.py'))['value'] == 2
+    finally:
+        shutil.rmtree(cwd1)
+        shutil.rmtree(cwd2)
+
+
+def test_packages_and_relative_imports():
+    cwd = create_function_dir({
+        'pkg/__init__.py': 'from .util import NAME\n',
+        'pkg/util.py': 'import sibling\nNAME = "util:" + sibling.NAME\n',
+        'pkg/sibling.py': 'NAME = "sibling"\n',
+        'pkg/sub/__init__.py': '',
+        'pkg/sub/mod.py': 'from ..util import NAME as PARENT\nNAME = "mod"\n'
+    })
+    try:
+        namespace = FunctionNamespace(cwd)
+        scope = namespace.exec_script('import pkg.sub.mod\nfrom pkg import NAME\nfrom pkg.sub import mod\n' +
+            'result = (NAME, pkg.sub.mod.NAME, mod.PARENT)\n', os.path.join(cwd, 'handler.py'))
+        assert scope['result'] == ('util:sibling', 'mod', 'util:sibling')
+        # standard library modules are still imported globally
+        assert namespace.exec_script('import json\nresult = json\n', 'handler.py')['result'] is sys.modules['json']
+    finally:
+        shutil.rmtree(cwd)
+
+
+def test_shared_compiler():
+    cwd = create_function_dir({'helper.py': 'VALUE = 1\n'})
+    compiled = {}
+
+    def compiler(file_name, source):
+        if file_name not in compiled:
+            compiled[file_name] = compile(source, file_name, 'exec')
+        return compiled[file_name]
+
+    try:
+        for i in range(2):
+            FunctionNamespace(cwd, compiler=compiler).exec_script('import helper\n', os.path.join(cwd, 'handler.py'))
+        assert os.path.join(cwd, 'helper.py') in compiled
+        assert len(compiled) == 2
+    finally:
+        shutil.rmtree(cwd)